@@ -0,0 +1,86 @@
+"""
+Time adding channel map info to event data: reindex + concat join vs channels.ChannelLookup.attach().
+
+Run with e.g.
+
+.. code-block:: console
+  $ python benchmarks/channel_lookup.py --events 10000000 --channels 100
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from legend_data_monitor import channels
+
+
+def make_data(n_events: int, n_channels: int, seed: int = 0) -> tuple:
+    """Return synthetic (event data, channel map) with channel numbers as in LEGEND channel maps."""
+    rng = np.random.default_rng(seed)
+    channel = np.arange(1000, 1000 + n_channels)
+    channel_map = pd.DataFrame(
+        {
+            "channel": channel,
+            "name": [f"V{i:05d}" for i in range(n_channels)],
+            "location": np.arange(n_channels) % 10 + 1,
+            "position": np.arange(n_channels) // 10 + 1,
+            "status": "On",
+            "cc4_id": [f"A{i % 7}" for i in range(n_channels)],
+            "cc4_channel": np.arange(n_channels) % 16,
+        }
+    )
+    data = pd.DataFrame(
+        {
+            "channel": rng.choice(channel, n_events),
+            "wf_max": rng.random(n_events),
+            "baseline": rng.random(n_events),
+        }
+    )
+    return data, channel_map
+
+
+def join_reindex(data: pd.DataFrame, channel_map: pd.DataFrame) -> pd.DataFrame:
+    """Join as done before ChannelLookup: reindex the channel map to the event index and concatenate."""
+    data = data.set_index("channel")
+    data = pd.concat(
+        [data, channel_map.set_index("channel").reindex(data.index)], axis=1
+    )
+    return data.reset_index()
+
+
+def join_lookup(data: pd.DataFrame, channel_map: pd.DataFrame) -> pd.DataFrame:
+    """Join with ChannelLookup, channel map with compact types as in Subsystem."""
+    lookup = channels.ChannelLookup(channels.compact_dtypes(channel_map.copy()))
+    return lookup.attach(data)
+
+
+def run(function, data: pd.DataFrame, channel_map: pd.DataFrame) -> pd.DataFrame:
+    data = data.copy()
+    start = time.perf_counter()
+    joined = function(data, channel_map)
+    elapsed = time.perf_counter() - start
+    size = joined.memory_usage(deep=True).sum() / 1e6
+    print(f"{function.__name__:15s} {elapsed:8.3f} s {size:10.1f} MB")
+    return joined
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--events", type=int, default=10**7)
+    parser.add_argument("--channels", type=int, default=100)
+    args = parser.parse_args()
+
+    data, channel_map = make_data(args.events, args.channels)
+    print(f"{args.events} events, {args.channels} channels")
+    old = run(join_reindex, data, channel_map)
+    new = run(join_lookup, data, channel_map)
+
+    # same values, only the types differ (categorical, small integers)
+    for column in channel_map:
+        assert (old[column].to_numpy() == new[column].to_numpy().astype(object)).all()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,18 @@
 from legend_data_monitor._version import version as __version__
-from legend_data_monitor.analysis_data import AnalysisData
-from legend_data_monitor.core import control_plots
-from legend_data_monitor.subsystem import Subsystem
 
 __all__ = ["__version__", "control_plots", "Subsystem", "AnalysisData"]
+
+# heavy dependencies (pygama, matplotlib, seaborn, ...) are only imported when one of these is first used
+_LAZY_ATTRIBUTES = {
+    "AnalysisData": "legend_data_monitor.analysis_data",
+    "control_plots": "legend_data_monitor.core",
+    "Subsystem": "legend_data_monitor.subsystem",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        import importlib
+
+        return getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
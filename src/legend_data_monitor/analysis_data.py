@@ -3,7 +3,8 @@ import pandas as pd
 
 # needed to know which parameters are not in DataLoader
 # but need to be calculated, such as event rate
-from . import utils
+from . import binning, channels, derived, event_time, selection, utils
+from .stats import ChannelStats
 
 # -------------------------------------------------------------------------
 
@@ -13,21 +14,32 @@ class AnalysisData:
     Object containing information for a data subselected from Subsystem data based on given criteria.
 
     sub_data [DataFrame]: subsystem data
+    context [AnalysisContext]: [optional] event selections shared with other AnalysisData of the same subsystem data;
+        if not given, a new one is created for this object only
 
     Available kwargs:
         selection=
             dict with the following contents:
-                - 'parameters' [str or list of str]: parameter(s) of interest e.g. 'baseline'
+                - 'parameters' [str or list of str]: parameter(s) of interest e.g. 'baseline' or ['baseline', 'noise', 'event_rate'],
+                    all taken from the same selection of events
                 - 'event_type' [str]: event type, options: pulser/phy/all/Klines
                 - 'variation' [bool]: [optional] keep absolute value of parameter (False) or calculate % variation from mean (True).
                     Default: False
-                - 'time_window' [str]: [optional] time window in which to calculate event rate, in case that's the parameter of interest.
+                - 'time_window' [str]: [optional] time window in which to calculate event rate, in case that's one of the parameters of interest.
                     Format: time_window='NA', where N is integer, and A is M for months, D for days, T for minutes, and S for seconds.
                     Default: None
+                    With event rate, data has one row per channel and time window instead of one per event:
+                    other parameters are then the mean of their values in each time window (see time_windows()).
         Or input kwargs directly parameters=, event_type=, variation=, time_window=
+        channel_stats=
+            [optional] dict of format {<parameter>: ChannelStats} with statistics of previous data (e.g. loaded with ChannelStats.load()).
+            They are updated with the events of this data that are later than the ones already included,
+            and the channel mean (and variation) is then taken from them instead of this data alone.
     """
 
-    def __init__(self, sub_data: pd.DataFrame, **kwargs):
+    def __init__(
+        self, sub_data: pd.DataFrame, context: "AnalysisContext" = None, **kwargs
+    ):
         utils.logger.info("============================================")
         utils.logger.info("=== Setting up Analysis Data")
         utils.logger.info("============================================")
@@ -62,22 +74,9 @@ class AnalysisData:
             )
             return
 
-        # cannot do event rate and another parameter at the same time
-        # since event rate is calculated in windows
-        if (
-            "event_rate" in analysis_info["parameters"]
-            and len(analysis_info["parameters"]) > 1
-        ):
-            utils.logger.error(
-                "Cannot get event rate and another parameter at the same time!\n \
-                Event rate has to be calculated based on time windows, so the other parameter has to be thrown away.\
-                Contact developers if you want, for example, to keep that parameter, but look at mean in the windows of event rate."
-            )
-            return
-
         # time window must be provided for event rate
         if (
-            analysis_info["parameters"][0] == "event_rate"
+            "event_rate" in analysis_info["parameters"]
             and not analysis_info["time_window"]
         ):
             utils.logger.error(
@@ -90,6 +89,7 @@ class AnalysisData:
         self.evt_type = analysis_info["event_type"]
         self.time_window = analysis_info["time_window"]
         self.variation = analysis_info["variation"]
+        self.channel_stats = kwargs.get("channel_stats") or {}
 
         # -------------------------------------------------------------------------
         # subselect data
@@ -109,140 +109,110 @@ class AnalysisData:
         if "flag_pulser" in sub_data:
             params_to_get.append("flag_pulser")
 
-        # if special parameter, get columns needed to calculate it
-        for param in self.parameters:
-            if param in utils.SPECIAL_PARAMETERS:
-                # ignore if none are needed
-                params_to_get += (
-                    utils.SPECIAL_PARAMETERS[param]
-                    if utils.SPECIAL_PARAMETERS[param]
-                    else []
-                )
-            else:
-                # otherwise just load it
-                params_to_get.append(param)
+        # columns of the parameters, or needed to calculate them if derived (see derived.resolve())
+        params_to_get += derived.get_columns(self.parameters)
 
         # avoid repetition
         params_to_get = list(np.unique(params_to_get))
 
-        self.data = sub_data[params_to_get].copy()
-
         # -------------------------------------------------------------------------
 
-        # selec phy/puls/all events
-        bad = self.select_events()
-        if bad:
+        # selec phy/puls/all events, sorted by channel and time
+        # (columns are shared with other AnalysisData of the same context, not copied)
+        self.context = AnalysisContext(sub_data) if context is None else context
+        self.data = self.context.get_data(self.evt_type, params_to_get)
+        if self.data is None:
+            utils.logger.error(self.__doc__)
             return
 
-        # calculate if special parameter
+        # calculate if derived parameter
         self.special_parameter()
 
         # calculate channel mean
         self.channel_mean()
 
+        # calculate event rate, and mean of other parameters, in time windows
+        self.time_windows()
+
         # calculate variation if needed - only works after channel mean
         self.calculate_variation()
 
-        # -------------------------------------------------------------------------
+    def special_parameter(self):
+        # derived parameters calculated event by event from their expressions in par-settings.json
+        self.data = derived.calculate(self.data, self.parameters)
+
+    def time_windows(self):
+        """
+        Replace events with time windows if event rate is asked: count events in each window to get the rate,
+        and take the mean of the other parameters in the same windows (all parameters then share one time grid).
+
+        Channel means of the other parameters stay the ones of the events (see channel_mean()),
+        the channel mean of the event rate is its mean over time windows.
+        """
+        if "event_rate" not in self.parameters:
+            return
 
-        self.data = self.data.sort_values(["channel", "datetime"])
-
-    def select_events(self):
-        # do we want to keep all, phy or pulser events?
-        if self.evt_type == "pulser":
-            utils.logger.info("... keeping only pulser events")
-            self.data = self.data[self.data["flag_pulser"]]
-        elif self.evt_type == "phy":
-            utils.logger.info("... keeping only physical (non-pulser) events")
-            self.data = self.data[~self.data["flag_pulser"]]
-        elif self.evt_type == "K_lines":
-            utils.logger.info("... selecting K lines in physical (non-pulser) events")
-            self.data = self.data[~self.data["flag_pulser"]]
-            energy = utils.SPECIAL_PARAMETERS["K_lines"][0]
-            self.data = self.data[
-                (self.data[energy] > 1430) & (self.data[energy] < 1575)
-            ]
-        elif self.evt_type == "all":
-            utils.logger.info("... keeping all (pulser + non-pulser) events")
-        else:
-            utils.logger.error("Invalid event type!")
-            utils.logger.error(self.__doc__)
-            return "bad"
+        # --- count number of events in given time windows, all channels at once,
+        # and take the mean of other parameters in the same windows, with the same bin numbers
+        # windows start with the first event of each channel, same as resample(origin="start")
+        other = [param for param in self.parameters if param != "event_rate"]
+        bins = binning.bin_in_time(
+            self.data["channel"],
+            self.data["datetime"],
+            self.time_window,
+            self.data[other] if other else None,
+        )
 
-    def special_parameter(self):
-        for param in self.parameters:
-            if param == "wf_max_rel":
-                # calculate wf max relative to baseline
-                self.data["wf_max_rel"] = self.data["wf_max"] - self.data["baseline"]
-            elif param == "event_rate":
-                # ! sorry need to jump through a lot of hoops here ! bare with me....
-
-                # --- count number of events in given time windows
-                # - count() returns count of rows for each column - redundant, same value in each (unless we have NaN)
-                # just want one column 'event_rate' -> pick 'channel' since it's never NaN, so correct count; rename to event rate
-                # - this is now a resampled dataframe with column event rate, and multiindex channel, datetime -> put them back as columns with reset index
-                event_rate = (
-                    self.data.set_index("datetime")
-                    .groupby("channel")
-                    .resample(self.time_window, origin="start")
-                    .count()["channel"]
-                    .to_frame(name="event_rate")
-                    .reset_index()
-                )
+        # --- divide count by the time covered by each window to get Hz
+        # the last window of the data is usually not complete -> divide by its actual length,
+        # and put the value in the middle of the part that is covered
+        seconds = bins["duration"].dt.total_seconds()
+        windows = pd.DataFrame(
+            {
+                "channel": bins["channel"],
+                "datetime": bins["start"] + bins["duration"] / 2,
+                "event_rate": bins["count"] / seconds.where(seconds > 0),
+            }
+        )
+        for param in other:
+            windows[param] = bins[param + "_mean"].to_numpy()
 
-                # divide event count in each time window by sampling window in seconds to get Hz
-                dt_seconds = get_seconds(self.time_window)
-                event_rate["event_rate"] = event_rate["event_rate"] / dt_seconds
-
-                # --- get rid of last value
-                # as the data range does not equally divide by the time window, the count in the last "window" will be smaller
-                # as it corresponds to, in reality, smaller window
-                # since we divided by the window, the rate then will appear as smaller
-                # it's too complicated to fix that, so I will just get rid of the last row
-                event_rate = event_rate.iloc[:-1]
-
-                # --- shift timestamp
-                # the resulting table will start with the first timestamp of the original table
-                # I want to shift the time values by the half the time window, so that the event rate value corresponds to the middle of the time window
-                event_rate["datetime"] = (
-                    event_rate["datetime"] + pd.Timedelta(self.time_window) / 2
-                )
+        # --- now put back in location position and name, and channel means of other parameters
+        # group original table by channel and pick first occurrence to get the channel map (ignore other columns)
+        info_columns = ["name", "location", "position"] + [
+            param + "_mean" for param in other
+        ]
+        channel_info = self.data.groupby("channel")[info_columns].first()
+        self.data = channels.ChannelLookup(channel_info).attach(windows, info_columns)
 
-                # --- now have to jump through hoops to put back in location position and name
-                # - group original table by channel and pick first occurrence to get the channel map (ignore other columns)
-                # - reindex to match event rate table index
-                # - put the columns in with concat
-                event_rate = event_rate.set_index("channel")
-                self.data = pd.concat(
-                    [
-                        event_rate,
-                        self.data.groupby("channel")
-                        .first()
-                        .reindex(event_rate.index)[["name", "location", "position"]],
-                    ],
-                    axis=1,
-                )
-                # put the channel back as column
-                self.data = self.data.reset_index()
+        # event rate table has its own rows (time windows)
+        channel_mean = self.data.groupby("channel")["event_rate"].mean()
+        channels.ChannelLookup(channel_mean.rename("event_rate_mean")).attach(self.data)
 
     def channel_mean(self):
         utils.logger.info("... getting channel mean")
-        # series with index channel, columns of parameters containing mean of each channel
-        channel_mean = self.data.groupby("channel").mean(numeric_only=True)[
-            self.parameters
-        ]
-        # rename columns to be param_mean
-        channel_mean = channel_mean.rename(
-            columns={param: param + "_mean" for param in self.parameters}
-        )
-        # add it as column for convenience - repeating redundant information, but convenient
-        self.data = self.data.set_index("channel")
-        # self.data['mean'] = channel_mean.reindex(self.data.index)
-        self.data = pd.concat(
-            [self.data, channel_mean.reindex(self.data.index)], axis=1
-        )
-        # put channel back in
-        self.data = self.data.reset_index()
+        for param in self.parameters:
+            if param == "event_rate":
+                # calculated in time windows, see time_windows()
+                continue
+            elif param in self.channel_stats:
+                # statistics accumulated over previous data: add only the new events
+                channel_mean = (
+                    self.channel_stats[param]
+                    .update(
+                        self.data["channel"], self.data[param], self.data["datetime"]
+                    )
+                    .mean
+                )
+            else:
+                # same for all plots of this parameter and event type -> calculated once in the context
+                channel_mean = self.context.get_channel_mean(
+                    self.evt_type, param, self.data[param]
+                )
+            # add it as column param_mean for convenience - repeating redundant information, but convenient
+            channels.ChannelLookup(channel_mean.rename(param + "_mean")).attach(
+                self.data
+            )
 
     def calculate_variation(self):
         if self.variation:
@@ -255,22 +225,126 @@ class AnalysisData:
 
 
 # -------------------------------------------------------------------------
-# helper function
+# event selections shared by several AnalysisData
+# -------------------------------------------------------------------------
+
+
+class AnalysisContext:
+    """
+    Event selections of one subsystem's data, shared by all AnalysisData made from it (e.g. all plots of a subsystem).
+
+    For each event type, the selected events are found once and sorted by channel and time,
+    each column is gathered once for these events, and channel statistics are calculated once per parameter.
+    AnalysisData objects get DataFrames made of these shared columns instead of copies of the subsystem data,
+    so that many plots of the same subsystem cost about as much as one.
+    If all events are selected and already in order, the columns of the subsystem data are used directly.
+
+    sub_data [DataFrame]: subsystem data (with pulser flag, if event types other than 'all' are needed)
+
+    >>> context = AnalysisContext(geds.data)
+    >>> baseline = AnalysisData(geds.data, context, parameters='baseline', event_type='pulser')
+    """
+
+    def __init__(self, sub_data: pd.DataFrame):
+        self.sub_data = sub_data
+        # {event type: row positions of selected events in sub_data, sorted by channel and time}
+        self.rows = {}
+        # {event type: True if rows are all rows in original order}
+        self.all_rows = {}
+        # {(event type, column): column values of selected events}
+        self.columns = {}
+        # {(event type, parameter): ChannelStats}
+        self.stats = {}
+
+    def get_rows(self, evt_type: str):
+        """Return row positions of events of given type, sorted by channel and time; None if event type is invalid."""
+        if evt_type not in self.rows:
+            mask = get_event_mask(self.sub_data, evt_type)
+            if mask is None:
+                return
+
+            rows = np.flatnonzero(mask)
+            channel = self.sub_data["channel"].to_numpy()[rows]
+            time = event_time.to_ns(self.sub_data["datetime"])[rows]
+            rows = rows[np.lexsort((time, channel))]
+
+            self.rows[evt_type] = rows
+            self.all_rows[evt_type] = len(rows) == len(self.sub_data) and bool(
+                (rows == np.arange(len(rows))).all()
+            )
+
+        return self.rows[evt_type]
+
+    def get_column(self, evt_type: str, column: str):
+        """Return values of given column of subsystem data for events of given type (see get_rows())."""
+        key = (evt_type, column)
+        if key not in self.columns:
+            rows = self.get_rows(evt_type)
+            values = self.sub_data[column].array
+            self.columns[key] = values if self.all_rows[evt_type] else values.take(rows)
+        return self.columns[key]
+
+    def get_data(self, evt_type: str, columns: list):
+        """Return DataFrame with given columns for events of given type, sharing its columns with the context; None if event type is invalid."""
+        if self.get_rows(evt_type) is None:
+            return
+        return pd.DataFrame(
+            {column: self.get_column(evt_type, column) for column in columns},
+            copy=False,
+        )
+
+    def get_channel_stats(self, evt_type: str, param: str, values) -> ChannelStats:
+        """
+        Return statistics (count, mean, M2, min, max) of given parameter for each channel, for events of given type.
+
+        values: parameter values of the events of given type, in the order of get_rows()
+            (calculated by the caller if it's a derived parameter, e.g. wf_max_rel)
+        """
+        key = (evt_type, param)
+        if key not in self.stats:
+            self.stats[key] = ChannelStats.from_values(
+                self.get_column(evt_type, "channel"),
+                values,
+                self.get_column(evt_type, "datetime"),
+            )
+        return self.stats[key]
+
+    def get_channel_mean(self, evt_type: str, param: str, values) -> pd.Series:
+        """Return mean of given parameter for each channel, for events of given type; see get_channel_stats()."""
+        return self.get_channel_stats(evt_type, param, values).mean
+
+
+# -------------------------------------------------------------------------
+# helper functions
 # -------------------------------------------------------------------------
 
 
-def get_seconds(time_window: str):
+def get_event_mask(data: pd.DataFrame, evt_type: str):
+    """
+    Return boolean array selecting events of given type: pulser/phy/all/K_lines (see settings/event-types.json).
+
+    Returns None if event type is invalid.
     """
-    Convert sampling format used for DataFrame.resample() to int representing seconds.
+    event_selection = selection.get_event_selection(evt_type)
+    if event_selection is None:
+        return
 
-    Needed for event rate calculation.
+    utils.logger.info(f"... {event_selection.get('description', evt_type)}")
+    return selection.get_mask(
+        data,
+        event_selection,
+        data["flag_pulser"] if "pulser" in event_selection else None,
+    )
+
+
+def select_events(data: pd.DataFrame, evt_type: str):
+    """
+    Keep only events of given type: pulser/phy/all/K_lines.
 
-    >>> get_seconds('30T')
-    1800
+    Returns subselected data, or None if event type is invalid.
     """
-    # correspondence of symbol to seconds, T = minutes
-    str_to_seconds = {"S": 1, "T": 60, "H": 60 * 60, "D": 24 * 60 * 60}
-    # unit of this time window
-    time_unit = time_window[-1]
+    mask = get_event_mask(data, evt_type)
+    if mask is None:
+        return
 
-    return int(time_window.rstrip(time_unit)) * str_to_seconds[time_unit]
+    return data if evt_type == "all" else data[mask]
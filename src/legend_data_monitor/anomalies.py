@@ -0,0 +1,278 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from . import analysis_data, utils
+
+# default settings, can be changed in config field 'anomalies'
+SETTINGS = {
+    # number of events (or time windows, for event rate) in the rolling windows
+    "window": 101,
+    # minimum number of values in a window to calculate its statistics
+    "min_periods": 20,
+    # events further than this from the rolling median, in robust standard deviations, are outliers
+    "z_threshold": 6,
+    # changes of the rolling median larger than this, in robust standard deviations, are steps
+    "step_threshold": 3,
+}
+
+# -------------------------------------------------------------------------
+# detection for all channels at once
+# -------------------------------------------------------------------------
+
+
+def detect_anomalies(
+    analysis, subsystem_type: str, param: str = None, **settings
+) -> pd.DataFrame:
+    """
+    Look for outliers, steps and threshold crossings in a parameter of given analysis data, for all channels at once.
+
+    analysis: AnalysisData (or streaming.PlotAggregates, pyramid.PyramidData)
+    subsystem_type: geds/spms/pulser, for the limits of the parameter in par-settings.json
+    param: [optional] parameter to look at. Default: first parameter of the analysis data
+    settings: see SETTINGS
+
+    Works on parameter values (absolute values, if variation was calculated), event by event in time order:
+        - robust z-score: distance of each value from the median of the previous `window` values,
+            in robust standard deviations of the channel (from the median difference between consecutive values)
+        - step score: difference between the median of the next `window` values (this one included) and of the previous ones,
+            in the same units; the largest one of each channel is reported
+        - drift: relative change between the medians of the first and last `window` values of each channel, in %
+        - threshold crossings: values outside the "limit" of the parameter for this subsystem in par-settings.json
+    All channels go through the same rolling windows in one pass: channels are put one after the other,
+    separated by window - 1 NaN values, so that no window sees values of two channels.
+
+    Returns DataFrame with one row per channel (see report columns below);
+    empty if there is no data, or if it is not a time series (e.g. histogram counts of streaming.PlotAggregates).
+    """
+    settings = {**SETTINGS, **settings}
+    window = int(settings["window"])
+    param = param or analysis.parameters[0]
+
+    data = analysis.data
+    if data.empty or "datetime" not in data:
+        return pd.DataFrame()
+    data = data.sort_values(["channel", "datetime"], kind="stable")
+    values = data[param].to_numpy(dtype=float)
+    if analysis.variation and param != "event_rate":
+        # back to absolute values, variation was calculated from the channel mean
+        values = (values / 100 + 1) * data[param + "_mean"].to_numpy(dtype=float)
+
+    # -------------------------------------------------------------------------
+    # rolling statistics
+    # -------------------------------------------------------------------------
+
+    codes, channels = pd.factorize(data["channel"].to_numpy(), sort=True)
+    gap = window - 1
+    # position of each value in the array with gaps between channels (and before the first one)
+    position = np.arange(len(values)) + (codes + 1) * gap
+    padded = np.full(len(values) + (len(channels) + 1) * gap, np.nan)
+    padded[position] = values
+
+    median = (
+        pd.Series(padded)
+        .rolling(window, min_periods=settings["min_periods"])
+        .median()
+        .to_numpy()
+    )
+
+    # noise of each channel from differences of consecutive values, not affected by steps and slow drifts:
+    # for gaussian noise, median(|x[i] - x[i-1]|) = 0.6745 * sqrt(2) * sigma
+    difference = np.abs(np.diff(padded))[position[1:] - 1]
+    same_channel = codes[1:] == codes[:-1]
+    sigma = (
+        pd.Series(difference[same_channel])
+        .groupby(codes[1:][same_channel])
+        .median()
+        .reindex(range(len(channels)))
+        .to_numpy()
+        / 0.9539
+    )
+    sigma[sigma <= 0] = np.nan
+    sigma = sigma[codes]
+
+    # median of the previous values, and of the next ones (this one included)
+    before = median[position - 1]
+    after = np.full(len(values), np.nan)
+    has_after = position + gap < len(padded)
+    after[has_after] = median[position[has_after] + gap]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z_score = (values - before) / sigma
+        step_score = (after - before) / sigma
+
+    # -------------------------------------------------------------------------
+    # per channel report
+    # -------------------------------------------------------------------------
+
+    times = data["datetime"].reset_index(drop=True)
+    low, high = utils.PLOT_INFO.get(param, {}).get("limit", {}).get(subsystem_type) or [
+        None,
+        None,
+    ]
+    outlier = np.abs(z_score) > settings["z_threshold"]
+    below = values < low if low is not None else np.zeros(len(values), dtype=bool)
+    above = values > high if high is not None else np.zeros(len(values), dtype=bool)
+
+    events = pd.DataFrame(
+        {
+            "code": codes,
+            "value": values,
+            "z": np.abs(z_score),
+            "step": np.abs(step_score),
+            "outlier": outlier,
+            "below": below,
+            "above": above,
+            "outlier_time": times.where(outlier),
+            "crossing_time": times.where(below | above),
+        }
+    )
+    grouped = events.groupby("code")
+    report = grouped.agg(
+        events=("value", "count"),
+        median=("value", "median"),
+        max_z=("z", "max"),
+        outliers=("outlier", "sum"),
+        first_outlier=("outlier_time", "min"),
+        max_step=("step", "max"),
+        below_limit=("below", "sum"),
+        above_limit=("above", "sum"),
+        first_crossing=("crossing_time", "min"),
+    )
+
+    # --- largest step of each channel: when, and how large
+    found = report["max_step"].notna().to_numpy()
+    largest = events["step"].fillna(-1).groupby(events["code"]).idxmax().to_numpy()
+    report["step_time"] = times.to_numpy()[largest]
+    report["step_size"] = (after - before)[largest]
+    report.loc[~found, ["step_time", "step_size"]] = np.nan
+
+    # --- drift from the first to the last full window of each channel
+    first = np.r_[0, np.cumsum(np.bincount(codes))[:-1]]
+    last = first + report["events"].to_numpy() - 1
+    first_window = median[position[np.minimum(first + gap, last)]]
+    last_window = median[position[last]]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        report["drift"] = (last_window - first_window) / np.abs(first_window) * 100
+
+    report["flagged"] = (
+        (report["outliers"] > 0)
+        | (report["max_step"] > settings["step_threshold"])
+        | (report["below_limit"] > 0)
+        | (report["above_limit"] > 0)
+    )
+
+    # --- channel info
+    report.insert(0, "channel", channels[report.index])
+    info = data.groupby("channel")[["name", "location", "position"]].first()
+    report = report.reset_index(drop=True).join(info, on="channel")
+    report.insert(1, "parameter", param)
+    report.insert(2, "event_type", analysis.evt_type)
+
+    return report[
+        ["channel", "name", "location", "position", "parameter", "event_type"]
+        + [
+            "events",
+            "median",
+            "drift",
+            "max_z",
+            "outliers",
+            "first_outlier",
+            "max_step",
+            "step_size",
+            "step_time",
+            "below_limit",
+            "above_limit",
+            "first_crossing",
+            "flagged",
+        ]
+    ]
+
+
+# -------------------------------------------------------------------------
+# report of a subsystem
+# -------------------------------------------------------------------------
+
+
+def detect_subsystem_anomalies(
+    subsystem,
+    plots: dict,
+    report_path: str,
+    analyses: dict = None,
+    settings: dict = None,
+    context: analysis_data.AnalysisContext = None,
+) -> dict:
+    """
+    Look for anomalies in the data of all given plots of given subsystem, and save a report, without plotting anything.
+
+    plots: dict of format {<plot title>: <plot settings>} from the config
+    report_path: JSON file of the report, format {<plot title>: [<one dict per channel and parameter, see detect_anomalies()>]}
+    analyses: [optional] data already prepared for the plots, see plotting.make_subsystem_plots()
+    settings: [optional] see SETTINGS
+    context: [optional] event selections shared with the plots of the subsystem, see analysis_data.AnalysisContext
+
+    Flagged channels are listed as warnings, so that alerts can be raised before the plots are made.
+    Returns dict of format {<plot title>: report DataFrame}.
+    """
+    utils.logger.info("... looking for anomalies")
+    settings = settings or {}
+    if context is None:
+        context = analysis_data.AnalysisContext(subsystem.data)
+
+    reports = {}
+    for plot_title, plot_settings in plots.items():
+        if analyses and plot_title in analyses:
+            prepared = analyses[plot_title]
+        else:
+            prepared = analysis_data.AnalysisData(
+                subsystem.data, context, selection=dict(plot_settings)
+            )
+        # one report for all parameters of the plot, one row per channel and parameter
+        param_reports = []
+        for param in utils.get_plot_parameters(plot_settings):
+            analysis = prepared[param] if isinstance(prepared, dict) else prepared
+            # not a time series, e.g. histogram counts aggregated in streaming mode
+            if "datetime" not in analysis.data:
+                utils.logger.info(
+                    f"No event times for {param} in '{plot_title}', no anomalies looked for"
+                )
+                continue
+            report = detect_anomalies(analysis, subsystem.type, param, **settings)
+            if not report.empty:
+                param_reports.append(report)
+        reports[plot_title] = (
+            pd.concat(param_reports, ignore_index=True)
+            if param_reports
+            else pd.DataFrame()
+        )
+
+        if reports[plot_title].empty:
+            continue
+        flagged = reports[plot_title][reports[plot_title]["flagged"]]
+        if len(flagged):
+            utils.logger.warning(
+                f"Anomalies in '{plot_title}' for channels: "
+                + ", ".join(
+                    f"{x['name']} (ch {x['channel']})" for _, x in flagged.iterrows()
+                )
+            )
+
+    # write to temporary file first, another process might be reading it
+    tmp_path = f"{report_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(
+            {
+                plot_title: json.loads(
+                    report.to_json(orient="records", date_format="iso")
+                )
+                for plot_title, report in reports.items()
+            },
+            f,
+            indent=1,
+        )
+    os.replace(tmp_path, report_path)
+    utils.logger.info("Anomaly report saved in: " + report_path)
+
+    return reports
@@ -0,0 +1,203 @@
+import numpy as np
+import pandas as pd
+
+# aggregates of parameter values in each time window, see aggregate()
+AGGREGATES = ["count", "sum", "mean", "min", "max", "std"]
+
+# -------------------------------------------------------------------------
+# binning events of all channels in time windows in one pass
+# -------------------------------------------------------------------------
+
+
+def bin_in_time(
+    channel,
+    time,
+    time_window: str,
+    values=None,
+    origin: pd.Series = None,
+    end=None,
+) -> pd.DataFrame:
+    """
+    Count events (and aggregate parameter values, if given) in time windows, for all channels at once.
+
+    channel: channel of each event
+    time: time of each event (datetime Series)
+    time_window: length of time windows, format as for DataFrame.resample() e.g. '10T'
+    values: [optional] parameter value of each event; NaN values are ignored.
+        DataFrame for several parameters: all of them are aggregated in the same windows, with the same bin numbers
+    origin: [optional] start of first time window of each channel (Series indexed by channel).
+        Default: first event of each channel, same as DataFrame.resample(origin='start')
+    end: [optional] end of the time covered by the data (Timestamp). Default: last event
+
+    Each event gets an integer window number (time - origin) // time_window, computed on int64 nanoseconds;
+    all reductions are then done with np.bincount over the (channel, window) bins.
+
+    Returns DataFrame with one row per channel and window, from the first to the last window with events
+    of each channel (empty windows in between included, same as DataFrame.resample()), and columns:
+        - channel, window (number of time windows since origin)
+        - start: start of window, duration: part of the window covered by the data
+            (shorter than time_window for a last partial window, cut at end)
+        - count: number of events; number of non-NaN values if values are given
+        - if values are given: sum, mean, min, max, std (NaN for empty windows; std with ddof=1 like pandas)
+    If values is a DataFrame, count is the number of events, and each of its columns gets columns
+    <column>_count, <column>_sum, <column>_mean, <column>_min, <column>_max, <column>_std.
+    """
+    dt = pd.Timedelta(time_window).value
+
+    channel = np.asarray(channel)
+    times = pd.DatetimeIndex(time)
+    tz = times.tz
+    times = times.asi8
+
+    columns = ["channel", "window", "start", "duration", "count"]
+    if isinstance(values, pd.DataFrame):
+        columns += [f"{col}_{x}" for col in values for x in AGGREGATES]
+    elif values is not None:
+        columns += AGGREGATES[1:]
+    if not len(channel):
+        return pd.DataFrame(columns=columns)
+
+    # -------------------------------------------------------------------------
+    # window number of each event
+    # -------------------------------------------------------------------------
+
+    channels, ch_idx = np.unique(channel, return_inverse=True)
+    if origin is None:
+        first = np.full(len(channels), np.iinfo(np.int64).max)
+        np.minimum.at(first, ch_idx, times)
+    else:
+        first = pd.DatetimeIndex(origin.reindex(channels)).asi8
+    window = (times - first[ch_idx]) // dt
+
+    # --- range of windows of each channel -> flat bin number over all channels
+    first_window = np.full(len(channels), np.iinfo(np.int64).max)
+    np.minimum.at(first_window, ch_idx, window)
+    last_window = np.full(len(channels), np.iinfo(np.int64).min)
+    np.maximum.at(last_window, ch_idx, window)
+    n_windows = last_window - first_window + 1
+    offset = np.concatenate([[0], np.cumsum(n_windows)[:-1]])
+    n_bins = int(n_windows.sum())
+    flat = offset[ch_idx] + window - first_window[ch_idx]
+
+    # -------------------------------------------------------------------------
+    # bins
+    # -------------------------------------------------------------------------
+
+    bin_window = (
+        np.arange(n_bins)
+        - np.repeat(offset, n_windows)
+        + np.repeat(first_window, n_windows)
+    )
+    start = np.repeat(first, n_windows) + bin_window * dt
+    end = times.max() if end is None else pd.Timestamp(end).value
+    duration = np.clip(end - start, 0, dt)
+
+    bins = pd.DataFrame(
+        {
+            "channel": np.repeat(channels, n_windows),
+            "window": bin_window,
+            "start": pd.DatetimeIndex(start, tz="UTC").tz_convert(tz)
+            if tz
+            else pd.DatetimeIndex(start),
+            "duration": pd.to_timedelta(duration),
+        }
+    )
+
+    # -------------------------------------------------------------------------
+    # aggregate values
+    # -------------------------------------------------------------------------
+
+    if values is None:
+        bins["count"] = np.bincount(flat, minlength=n_bins)
+    elif isinstance(values, pd.DataFrame):
+        # all parameters in the same bins: bin numbers computed once
+        bins["count"] = np.bincount(flat, minlength=n_bins)
+        for col in values:
+            for name, x in aggregate(flat, values[col], n_bins).items():
+                bins[f"{col}_{name}"] = x
+    else:
+        for name, x in aggregate(flat, values, n_bins).items():
+            bins[name] = x
+
+    return bins
+
+
+def aggregate(flat: np.ndarray, values, n_bins: int) -> dict:
+    """
+    Aggregate given values in given flat bin numbers (one per value) with np.bincount.
+
+    Returns dict {<name>: array of length n_bins} for each name of AGGREGATES; NaN values are ignored,
+    count is the number of non-NaN values (NaN statistics for empty bins; std with ddof=1 like pandas).
+    """
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    flat, values = flat[valid], values[valid]
+
+    count = np.bincount(flat, minlength=n_bins)
+    total = np.bincount(flat, weights=values, minlength=n_bins)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        # second pass around the mean, more precise than from the sum of squares
+        squares = np.bincount(
+            flat, weights=(values - mean[flat]) ** 2, minlength=n_bins
+        )
+        std = np.sqrt(squares / (count - 1))
+    std[count < 2] = np.nan
+
+    minimum = np.full(n_bins, np.inf)
+    np.minimum.at(minimum, flat, values)
+    maximum = np.full(n_bins, -np.inf)
+    np.maximum.at(maximum, flat, values)
+    minimum[count == 0] = np.nan
+    maximum[count == 0] = np.nan
+
+    return {
+        "count": count,
+        "sum": total,
+        "mean": mean,
+        "min": minimum,
+        "max": maximum,
+        "std": std,
+    }
+
+
+# -------------------------------------------------------------------------
+# decimation of lines to draw
+# -------------------------------------------------------------------------
+
+
+def decimate_min_max(x, y, n_buckets: int) -> np.ndarray:
+    """
+    Return positions of the points needed to draw the line through given points at a resolution of n_buckets pixels.
+
+    x: x values, sorted
+    y: y values; NaN values are dropped
+    n_buckets: number of buckets (pixel columns) the x range is divided into
+
+    In each bucket, the first, last, minimum and maximum points are kept (M4 decimation):
+    the line drawn through them covers the same pixels as the full line, spikes included.
+    All points are kept if there are no more than 4 per bucket.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    if len(x) <= 4 * n_buckets:
+        return np.arange(len(x))
+
+    valid = np.flatnonzero(~np.isnan(y))
+    x, y = x[valid], y[valid]
+    if not len(x):
+        return valid
+
+    # bucket of each point, contiguous since x is sorted
+    span = x[-1] - x[0]
+    bucket = np.minimum(
+        ((x - x[0]) / (span if span else 1) * n_buckets).astype(np.int64),
+        n_buckets - 1,
+    )
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(x)] - 1
+    # sorted by y within each bucket -> minimum at the start, maximum at the end of the bucket
+    by_value = np.lexsort((y, bucket))
+
+    keep = np.unique(np.concatenate([starts, ends, by_value[starts], by_value[ends]]))
+    return valid[keep]
@@ -0,0 +1,276 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from . import utils
+
+# -------------------------------------------------------------------------
+
+
+class DataCache:
+    """
+    Content-addressed on-disk cache of data loaded from LH5 files with the DataLoader.
+
+    One cache entry holds the (already renamed and cleaned up) columns of one tier of one file,
+    loaded for a given list of channels at a given level (table the rows come from: hit, or dsp if no hit tier is loaded),
+    and is stored as a Feather file.
+    Entries are keyed by file path, file modification time, level, tier, channel list and column set,
+    so that a reprocessed file or a different channel selection never returns stale data,
+    and all entries read together for a file (same level and channels) have the same rows in the same order.
+    A tier file that does not exist is never found in the cache.
+    An SQLite index keeps track of the entries, their size and last access,
+    and is safe to use from several processes at the same time.
+
+    path [str]: cache directory, will be created if it does not exist
+    max_size [float]: maximum size of the cache in GB; least recently used entries are removed beyond that.
+        Default: 10
+
+    In the config, given as e.g.
+        "cache": {"path": "/path/to/cache", "max_size": 50}
+    """
+
+    def __init__(self, path: str, max_size: float = 10):
+        self.path = path
+        self.max_size = max_size * 1024**3
+        os.makedirs(self.path, exist_ok=True)
+
+        with self.connect() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, file TEXT, mtime REAL, tier TEXT, channels TEXT, "
+                "columns TEXT, size INTEGER, last_access REAL, level TEXT)"
+            )
+            # caches made before the level was part of the key: their entries are never found, and evicted in time
+            columns = [row[1] for row in con.execute("PRAGMA table_info(entries)")]
+            if "level" not in columns:
+                con.execute("ALTER TABLE entries ADD COLUMN level TEXT")
+
+    def connect(self):
+        return sqlite3.connect(os.path.join(self.path, "index.sqlite"), timeout=60)
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key + ".feather")
+
+    # -------------------------------------------------------------------------
+    # low level: single entries
+    # -------------------------------------------------------------------------
+
+    def find(self, file: str, level: str, tier: str, channels: list) -> dict:
+        """Return dict {column: key} of columns of given file, level, tier and channel list already in the cache."""
+        mtime = get_mtime(file)
+        if mtime is None:
+            return {}
+        found = {}
+        with self.connect() as con:
+            rows = con.execute(
+                "SELECT key, columns FROM entries WHERE file=? AND mtime=? AND level=? AND tier=? AND channels=?",
+                (file, mtime, level, tier, json.dumps(channels)),
+            ).fetchall()
+        for key, columns in rows:
+            for col in json.loads(columns):
+                found.setdefault(col, key)
+        return found
+
+    def read(self, key: str, columns: list) -> pd.DataFrame:
+        """Read given columns of the cache entry with given key."""
+        return pd.read_feather(self.entry_path(key), columns=columns)
+
+    def write(
+        self, data: pd.DataFrame, file: str, level: str, tier: str, channels: list
+    ) -> str:
+        """
+        Store data of given file, level, tier and channel list as a new cache entry, and return its key.
+
+        Data of a tier file that does not exist (no modification time) is stored too, to be read back in this run,
+        but will not be found later (see find()).
+        """
+        mtime = get_mtime(file)
+        columns = sorted(col for col in data.columns if col != "channel")
+        key = hashlib.sha1(
+            json.dumps([file, mtime, level, tier, channels, columns]).encode()
+        ).hexdigest()
+
+        # write to temporary file first, another process might be reading the same entry
+        entry_path = self.entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+        data.reset_index(drop=True).to_feather(tmp_path)
+        os.replace(tmp_path, entry_path)
+
+        with self.connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    file,
+                    mtime,
+                    tier,
+                    json.dumps(channels),
+                    json.dumps(columns),
+                    os.path.getsize(entry_path),
+                    time.time(),
+                    level,
+                ),
+            )
+        return key
+
+    def touch(self, keys: list):
+        """Update last access time of given entries."""
+        with self.connect() as con:
+            con.executemany(
+                "UPDATE entries SET last_access=? WHERE key=?",
+                [(time.time(), key) for key in keys],
+            )
+
+    def evict(self):
+        """Remove least recently used entries until the cache is below its maximum size."""
+        with self.connect() as con:
+            rows = con.execute(
+                "SELECT key, size FROM entries ORDER BY last_access DESC"
+            ).fetchall()
+            total = 0
+            to_remove = []
+            for key, size in rows:
+                total += size
+                if total > self.max_size:
+                    to_remove.append(key)
+            if not to_remove:
+                return
+
+            utils.logger.info(
+                f"...... removing {len(to_remove)} old entries from cache"
+            )
+            con.executemany(
+                "DELETE FROM entries WHERE key=?", [(key,) for key in to_remove]
+            )
+
+        for key in to_remove:
+            try:
+                os.remove(self.entry_path(key))
+            except FileNotFoundError:
+                pass
+
+    # -------------------------------------------------------------------------
+    # high level: replacement for DataLoader.load()
+    # -------------------------------------------------------------------------
+
+    def load(self, dl, dbconfig: dict, selector=None) -> pd.DataFrame:
+        """
+        Load data for files and columns selected in given DataLoader, reading from the cache where possible.
+
+        dl: DataLoader with files and output already set
+        dbconfig: DataLoader DB config it was created with
+        selector: [optional] function returning boolean array of rows to keep, applied to each file read from the cache
+
+        Only the columns missing from the cache are loaded with the DataLoader, and only for the files they are missing in;
+        they are then stored in the cache for the next time.
+        Returns the same DataFrame as DataLoader.load() with columns <tier>_idx and file removed,
+        and <tier>_table renamed to channel; empty (with these columns) if there are no files.
+        """
+        level = "hit" if "hit" in dbconfig["columns"] else "dsp"
+        channels = dbconfig["tables"][level]
+        files = dl.get_file_list()
+        if files.empty:
+            return pd.DataFrame(
+                columns=["channel"]
+                + [col for columns in dbconfig["columns"].values() for col in columns]
+            )
+
+        # -------------------------------------------------------------------------
+        # find out what is already cached
+        # -------------------------------------------------------------------------
+
+        # {file index: {tier: path}}
+        paths = {}
+        # {file index: {tier: {column: key}}}
+        cached = {}
+        # {tuple of missing columns: [file indices]}
+        to_load = {}
+        for idx, row in files.iterrows():
+            paths[idx] = {}
+            cached[idx] = {}
+            missing = []
+            for tier, columns in dbconfig["columns"].items():
+                paths[idx][tier] = os.path.join(
+                    dbconfig["data_dir"],
+                    dbconfig["tier_dirs"][tier].lstrip("/"),
+                    row[f"{tier}_file"].lstrip("/"),
+                )
+                cached[idx][tier] = self.find(paths[idx][tier], level, tier, channels)
+                missing += [col for col in columns if col not in cached[idx][tier]]
+            if missing:
+                to_load.setdefault(tuple(missing), []).append(idx)
+
+        utils.logger.info(
+            f"...... {len(files) - sum(len(x) for x in to_load.values())}/{len(files)} files fully cached"
+        )
+
+        # -------------------------------------------------------------------------
+        # load missing columns of missing files and store them
+        # -------------------------------------------------------------------------
+
+        all_files = dl.file_list
+        for missing, file_list in to_load.items():
+            dl.file_list = file_list
+            dl.set_output(fmt="pd.DataFrame", columns=list(missing))
+            data = dl.load()
+            data = data.drop(f"{level}_idx", axis=1).rename(
+                columns={f"{level}_table": "channel"}
+            )
+
+            for idx in file_list:
+                # also store files without any event for our channels, so that we don't look for them again
+                data_file = data[data["file"] == idx].drop("file", axis=1)
+                for tier, columns in dbconfig["columns"].items():
+                    tier_missing = [col for col in columns if col in missing]
+                    if tier_missing:
+                        key = self.write(
+                            data_file[["channel"] + tier_missing],
+                            paths[idx][tier],
+                            level,
+                            tier,
+                            channels,
+                        )
+                        cached[idx][tier].update({col: key for col in tier_missing})
+        dl.file_list = all_files
+
+        # -------------------------------------------------------------------------
+        # read everything from cache
+        # -------------------------------------------------------------------------
+
+        data = []
+        used_keys = []
+        for idx in files.index:
+            # group columns by the entry they are in
+            entries = {}
+            for tier, columns in dbconfig["columns"].items():
+                for col in columns:
+                    entries.setdefault(cached[idx][tier][col], []).append(col)
+            # all entries of a file have the same level and channels, so the same rows in the same order
+            # -> channel only needed once
+            entries[next(iter(entries))].insert(0, "channel")
+            data_file = pd.concat(
+                [self.read(key, columns) for key, columns in entries.items()],
+                axis=1,
+            )
+            data.append(
+                data_file if selector is None else data_file[selector(data_file)]
+            )
+            used_keys += list(entries)
+
+        self.touch(used_keys)
+        self.evict()
+
+        return pd.concat(data, ignore_index=True)
+
+
+def get_mtime(file: str):
+    """Return modification time of given file, None if it does not exist."""
+    try:
+        return os.path.getmtime(file)
+    except FileNotFoundError:
+        return
@@ -0,0 +1,242 @@
+import os
+import re
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from . import utils
+
+# default location of the catalog
+CATALOG_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "legend-data-monitor", "catalog.sqlite"
+)
+
+# format <exp>-<period>-<run>-<type>-<timestamp>-tier_<tier>.lh5
+FILE_NAME = re.compile(
+    r"^(?P<exp>[^-]+)-(?P<period>[^-]+)-(?P<run>[^-]+)-(?P<type>[^-]+)-(?P<timestamp>\d{8}T\d{6}Z)-tier_(?P<tier>\w+)\.lh5$"
+)
+
+# -------------------------------------------------------------------------
+
+
+class FileCatalog:
+    """
+    Persistent catalog of the LH5 files of a production, to avoid walking the production tree at every run.
+
+    Files are expected in <root>/<tier>/<type>/<period>/<run>/<exp>-<period>-<run>-<type>-<timestamp>-tier_<tier>.lh5.
+    The catalog (SQLite) keeps experiment, period, run, type, timestamp, tier, path and size of each file,
+    as well as the modification time of each run directory: when updating, only the directories
+    down to run level are listed, and only run directories that changed since the last update are rescanned.
+    One catalog file can hold several productions.
+
+    root [str]: tier directory of the production, <path>/<version>/generated/tier
+    path [str]: [optional] SQLite file of the catalog. Default: CATALOG_PATH
+
+    In the config, the catalog file is given as e.g.
+        "catalog": "/path/to/catalog.sqlite"
+    """
+
+    def __init__(self, root: str, path: str = None):
+        self.root = os.path.abspath(root)
+        self.path = path or CATALOG_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # data types already updated by this object
+        self.updated = set()
+
+        with self.connect() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "root TEXT, dir TEXT, tier TEXT, exp TEXT, period TEXT, run TEXT, type TEXT, "
+                "timestamp TEXT, file TEXT, size INTEGER, PRIMARY KEY (root, tier, file))"
+            )
+            con.execute(
+                "CREATE INDEX IF NOT EXISTS files_time ON files (root, type, timestamp)"
+            )
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS dirs ("
+                "root TEXT, dir TEXT, type TEXT, mtime REAL, PRIMARY KEY (root, dir))"
+            )
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    # -------------------------------------------------------------------------
+    # updating
+    # -------------------------------------------------------------------------
+
+    def update(self, datatype: str):
+        """Rescan run directories of given data type ('phy', 'cal') that changed since the last update."""
+        if datatype in self.updated:
+            return
+
+        def subdirs(path):
+            if not os.path.isdir(path):
+                return []
+            return sorted(entry.name for entry in os.scandir(path) if entry.is_dir())
+
+        # --- current run directories, relative to root: tier/type/period/run
+        run_dirs = {}
+        for tier in subdirs(self.root):
+            type_dir = os.path.join(self.root, tier, datatype)
+            for period in subdirs(type_dir):
+                for run in subdirs(os.path.join(type_dir, period)):
+                    run_dir = os.path.join(tier, datatype, period, run)
+                    run_dirs[run_dir] = os.stat(
+                        os.path.join(self.root, run_dir)
+                    ).st_mtime
+
+        with self.connect() as con:
+            known = dict(
+                con.execute(
+                    "SELECT dir, mtime FROM dirs WHERE root=? AND type=?",
+                    (self.root, datatype),
+                ).fetchall()
+            )
+            changed = [x for x in run_dirs if known.get(x) != run_dirs[x]]
+            removed = [x for x in known if x not in run_dirs]
+            if changed or removed:
+                utils.logger.info(
+                    f"...... updating file catalog: {len(changed)} new or changed, {len(removed)} removed run directories"
+                )
+
+            for run_dir in changed + removed:
+                con.execute(
+                    "DELETE FROM files WHERE root=? AND dir=?", (self.root, run_dir)
+                )
+                con.execute(
+                    "DELETE FROM dirs WHERE root=? AND dir=?", (self.root, run_dir)
+                )
+
+            for run_dir in changed:
+                tier = run_dir.split(os.sep)[0]
+                rows = []
+                for entry in os.scandir(os.path.join(self.root, run_dir)):
+                    info = FILE_NAME.match(entry.name)
+                    if info is None or info["tier"] != tier:
+                        continue
+                    # same format as <tier>_file in the DataLoader FileDB: path relative to tier directory
+                    file = "/" + os.path.join(*run_dir.split(os.sep)[1:], entry.name)
+                    rows.append(
+                        (
+                            self.root,
+                            run_dir,
+                            tier,
+                            info["exp"],
+                            info["period"],
+                            info["run"],
+                            info["type"],
+                            info["timestamp"],
+                            file,
+                            entry.stat().st_size,
+                        )
+                    )
+                con.executemany(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                con.execute(
+                    "INSERT INTO dirs VALUES (?, ?, ?, ?)",
+                    (self.root, run_dir, datatype, run_dirs[run_dir]),
+                )
+
+        self.updated.add(datatype)
+
+    # -------------------------------------------------------------------------
+    # lookups
+    # -------------------------------------------------------------------------
+
+    def get_first_timestamp(self, datatype: str, run: str) -> str:
+        """Return timestamp of the first file of given data type in given run (format rXXX), None if there are none."""
+        self.update(datatype)
+        with self.connect() as con:
+            (first_timestamp,) = con.execute(
+                "SELECT MIN(timestamp) FROM files WHERE root=? AND type=? AND run=?",
+                (self.root, datatype, run),
+            ).fetchone()
+        return first_timestamp
+
+    def get_files(
+        self, datatype: str, timerange: dict, file_format: dict
+    ) -> pd.DataFrame:
+        """
+        Return table of files of given data type in given time range, in the format of the DataLoader FileDB.
+
+        timerange: time range as returned by utils.get_query_timerange()
+        file_format: {tier: file name template} from the DataLoader DB config, first tier is the lowest one.
+
+        One row per file of the lowest tier, with columns exp, period, run, type, timestamp,
+        <tier>_file and <tier>_size for each tier, and file_status (bit for each tier if its file exists),
+        sorted by timestamp.
+        """
+        self.update(datatype)
+        selection, args = get_time_selection(timerange)
+
+        tiers = list(file_format)
+        key = ["exp", "period", "run", "type", "timestamp"]
+        with self.connect() as con:
+            files = pd.DataFrame(
+                con.execute(
+                    f"SELECT tier, file, size, {', '.join(key)} FROM files "
+                    f"WHERE root=? AND type=? AND tier IN ({', '.join('?' * len(tiers))}) AND {selection}",
+                    [self.root, datatype] + tiers + args,
+                ).fetchall(),
+                columns=["tier", "file", "size"] + key,
+            )
+
+        # --- same as FileDB: rows from lowest tier files, file names of other tiers from their template
+        table = files.loc[files["tier"] == tiers[0], key]
+        table = table.sort_values("timestamp", ignore_index=True)
+        sizes = files.set_index(["tier", "file"])["size"]
+        table["file_status"] = 0
+        for i, tier in enumerate(tiers):
+            table[f"{tier}_file"] = [
+                file_format[tier].format(**row) for row in table[key].to_dict("records")
+            ]
+            size = sizes.reindex(
+                pd.MultiIndex.from_arrays([[tier] * len(table), table[f"{tier}_file"]])
+            ).to_numpy(dtype=float)
+            table[f"{tier}_size"] = np.nan_to_num(size).astype(int)
+            table["file_status"] |= (~np.isnan(size)).astype(int) << (
+                len(tiers) - i - 1
+            )
+
+        return table
+
+    def get_time_range(self, datatype: str, timerange: dict) -> tuple:
+        """
+        Return (start, end) Timestamps of the time covered by the files of given data type in given time range.
+
+        A file covers the time from its timestamp to the timestamp of the next file;
+        end is None if the last selected file is the last one in the catalog. (None, None) if no files are selected.
+        """
+        self.update(datatype)
+        selection, args = get_time_selection(timerange)
+        with self.connect() as con:
+            first, last = con.execute(
+                f"SELECT MIN(timestamp), MAX(timestamp) FROM files WHERE root=? AND type=? AND {selection}",
+                [self.root, datatype] + args,
+            ).fetchone()
+            if first is None:
+                return None, None
+            (following,) = con.execute(
+                "SELECT MIN(timestamp) FROM files WHERE root=? AND type=? AND timestamp > ?",
+                (self.root, datatype, last),
+            ).fetchone()
+
+        def to_time(timestamp):
+            return pd.to_datetime(timestamp, format="%Y%m%dT%H%M%SZ", utc=True)
+
+        return to_time(first), None if following is None else to_time(following)
+
+
+def get_time_selection(timerange: dict) -> tuple:
+    """Return SQL condition and its arguments selecting files in given time range (see utils.get_query_timerange())."""
+    time_word = list(timerange.keys())[0]
+    if "start" in timerange[time_word]:
+        selection = f"{time_word} >= ? AND {time_word} <= ?"
+        args = [timerange[time_word]["start"], timerange[time_word]["end"]]
+    else:
+        selection = f"{time_word} IN ({', '.join('?' * len(timerange[time_word]))})"
+        args = list(timerange[time_word])
+    return selection, args
@@ -0,0 +1,116 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+# -------------------------------------------------------------------------
+# per-channel information
+# -------------------------------------------------------------------------
+
+
+class ChannelLookup:
+    """
+    Lookup table of per-channel information, backed by arrays indexed directly by channel number.
+
+    Used to add channel map info (or any other per-channel value, e.g. channel mean) to event data:
+    values are gathered for each event with an integer take, instead of reindexing the channel table
+    to the event index and concatenating, which copies the whole event table.
+
+    table [DataFrame or Series]: one row per channel, with channel number as column 'channel' or as index
+
+    >>> ChannelLookup(channel_map).attach(data, ['name', 'location', 'position'])
+    """
+
+    def __init__(self, table):
+        if isinstance(table, pd.Series):
+            table = table.to_frame()
+        if "channel" in table:
+            table = table.set_index("channel")
+        self.table = table
+
+        channels = table.index.to_numpy(dtype=np.int64)
+        # row in table of each channel number, -1 if channel is not in table
+        self.rows = np.full(
+            channels.max() + 1 if len(channels) else 0, -1, dtype=np.intp
+        )
+        self.rows[channels] = np.arange(len(channels))
+
+    def get_rows(self, channels) -> np.ndarray:
+        """Return row in table of each given channel, -1 if not in table."""
+        channels = np.asarray(channels, dtype=np.int64)
+        known = (channels >= 0) & (channels < len(self.rows))
+        rows = np.full(len(channels), -1, dtype=np.intp)
+        rows[known] = self.rows[channels[known]]
+        return rows
+
+    def take(self, column: str, rows: np.ndarray):
+        """Return values of given column for given table rows (see get_rows()), NaN for -1."""
+        values = self.table[column].array
+        # categorical columns only take their integer codes
+        if (rows < 0).any():
+            return values.take(rows, allow_fill=True)
+        return values.take(rows)
+
+    def map(self, channels, column: str):
+        """Return values of given column for each of given channels."""
+        return self.take(column, self.get_rows(channels))
+
+    def attach(self, data: pd.DataFrame, columns: list = None) -> pd.DataFrame:
+        """Add given columns of the table (default: all) to data based on its column 'channel', in place."""
+        columns = self.table.columns if columns is None else columns
+        rows = self.get_rows(data["channel"])
+        for col in columns:
+            data[col] = self.take(col, rows)
+        return data
+
+
+def compact_dtypes(data: pd.DataFrame, columns: list = None) -> pd.DataFrame:
+    """
+    Convert given columns (default: all) to compact types, in place.
+
+    Strings or mixed values -> categorical; integer numbers (possibly stored as float or object) -> smallest integer type.
+    Columns that are already categorical, as well as non-integer floats, are left as they are.
+    """
+    columns = data.columns if columns is None else columns
+    for col in columns:
+        if isinstance(data[col].dtype, pd.CategoricalDtype):
+            continue
+        if pd.api.types.is_integer_dtype(data[col]):
+            data[col] = pd.to_numeric(data[col], downcast="integer")
+            continue
+        # numeric values might come as object or float after the mapping
+        numeric = pd.to_numeric(data[col], errors="coerce")
+        if numeric.notna().all() and (numeric % 1 == 0).all():
+            data[col] = pd.to_numeric(numeric, downcast="integer")
+        elif not pd.api.types.is_float_dtype(data[col]):
+            data[col] = data[col].astype("category")
+
+    return data
+
+
+def get_repeated_memory_usage(table: pd.DataFrame, channels) -> int:
+    """
+    Return memory (bytes, as DataFrame.memory_usage(deep=True)) that the columns of given per-channel table
+    would take if repeated for each of given channels as they are, i.e. without compact types.
+
+    table: one row per channel, with channel number as column 'channel' or as index (not counted)
+
+    Used to show the memory saved by ChannelLookup and compact_dtypes(), without building the repeated columns.
+    """
+    if "channel" in table:
+        table = table.set_index("channel")
+    row_size = np.zeros(len(table))
+    for col in table:
+        values = table[col].to_numpy()
+        if values.dtype == object:
+            # pointer + Python object of each value, as counted by memory_usage(deep=True)
+            row_size += 8 + np.array([sys.getsizeof(x) for x in values])
+        else:
+            row_size += values.dtype.itemsize
+    counts = pd.Series(channels).value_counts()
+    return int(
+        (
+            pd.Series(row_size, index=table.index).reindex(counts.index).fillna(0)
+            * counts
+        ).sum()
+    )
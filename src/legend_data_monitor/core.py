@@ -1,10 +1,34 @@
 import json
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from . import plotting, subsystem, utils
+import pandas as pd
 
+from . import (
+    analysis_data,
+    anomalies,
+    cache,
+    plotting,
+    pyramid,
+    rendering,
+    streaming,
+    subsystem,
+    utils,
+)
 
-def control_plots(user_config_path: str):
+
+def control_plots(user_config_path: str, parallel: bool = None, workers: int = None):
+    """
+    Load data and make plots for all subsystems requested in the given config file.
+
+    By default, all subsystems are loaded together in one pass over the files (see subsystem.get_subsystems_data()),
+    then pulser events are flagged and plots are made one subsystem after the other.
+    If ``parallel`` is True, pulser is loaded first to flag pulser events, and the remaining subsystems are then
+    loaded and plotted in a process pool of ``workers`` processes (default: one per subsystem, limited by the number of CPUs).
+    If not given, ``parallel`` and ``workers`` are taken from the config fields of the same name.
+    In streaming mode (config field 'streaming'), each subsystem is also loaded on its own, see load_and_plot_subsystem().
+    With config field 'from_pyramid', only vs time plots are made from saved pyramids, see plot_subsystem_from_pyramid().
+    """
     # -------------------------------------------------------------------------
     # Read user settings
     # -------------------------------------------------------------------------
@@ -70,58 +94,285 @@ def control_plots(user_config_path: str):
     pdf_basepath = os.path.join(output_paths["pdf_files"], "par_vs_time", pdf_basename)
 
     # -------------------------------------------------------------------------
-    # Get pulser first - needed to flag pulser events
+    # Set up on-disk cache of loaded data, if asked
     # -------------------------------------------------------------------------
 
-    # put it in a dict, so that later, if pulser is also wanted to be plotted, we don't have to load it twice
-    subsystems = {"pulser": subsystem.Subsystem("pulser", dataset=config["dataset"])}
-    # get list of all parameters needed for all requested plots, if any
-    parameters = utils.get_all_plot_parameters("pulser", config)
-    # get data for these parameters and time range given in the dataset
-    # (if no parameters given to plot, baseline and wfmax will always be loaded to flag pulser events anyway)
-    subsystems["pulser"].get_data(parameters)
-    utils.logger.debug(subsystems["pulser"].data)
-
-    # -------------------------------------------------------------------------
+    data_cache = cache.DataCache(**config["cache"]) if "cache" in config else None
 
     # What subsystems do we want to plot?
     subsystems_to_plot = list(config["subsystems"].keys())
+    # pulser is always needed to flag pulser events, the others still need to be flagged
+    subsystems_to_flag = [system for system in subsystems_to_plot if system != "pulser"]
 
-    for system in subsystems_to_plot:
+    if config.get("from_pyramid"):
         # -------------------------------------------------------------------------
-        # set up subsystem
+        # Only vs time plots from saved pyramids, no data is loaded
         # -------------------------------------------------------------------------
 
-        # set up if wasn't already set up (meaning, not pulser, previously already set up)
-        if system not in subsystems:
-            # Subsystem: knows its channel map & software status (On/Off channels)
-            subsystems[system] = subsystem.Subsystem(system, dataset=config["dataset"])
-            # get list of parameters needed for all requested plots, if any
-            parameters = utils.get_all_plot_parameters(system, config)
-            # get data for these parameters and dataset range
-            subsystems[system].get_data(parameters)
-            utils.logger.debug(subsystems[system].data)
-            # flag pulser events for future parameter data selection
-            subsystems[system].flag_pulser_events(subsystems["pulser"])
+        for system in subsystems_to_plot:
+            plot_subsystem_from_pyramid(system, config, pdf_basepath)
+        utils.logger.info("D O N E")
+        return
 
+    # CLI options have priority over config settings
+    parallel = config.get("parallel", False) if parallel is None else parallel
+    workers = config.get("workers") if workers is None else workers
+
+    if (parallel or config.get("streaming")) and subsystems_to_flag:
         # -------------------------------------------------------------------------
-        # make subsystem plots
+        # Get pulser first - needed to flag pulser events
         # -------------------------------------------------------------------------
 
-        # - currently one PDF file per subsystem, even though path to par_vs_time
-        pdf_path = pdf_basepath + "_" + system + ".pdf"
+        pulser = set_up_subsystem("pulser", config)
+        # get list of all parameters needed for all requested plots, if any
+        parameters = utils.get_all_plot_parameters("pulser", config)
+        # get data for these parameters and time range given in the dataset
+        # (if no parameters given to plot, baseline and wfmax will always be loaded to flag pulser events anyway)
+        pulser.get_data(parameters, cache=data_cache)
+        utils.logger.debug(pulser.data)
 
-        # - set up log file
-        # file handler
-        file_handler = utils.logging.FileHandler(pdf_basepath + "_" + system + ".log")
-        file_handler.setLevel(utils.logging.DEBUG)
-        # add to logger
-        utils.logger.addHandler(file_handler)
+        # only the timestamps of flagged pulser events are needed to flag the other subsystems
+        pulser_timestamps = pulser.get_pulser_timestamps()
 
+        # -------------------------------------------------------------------------
+        # Each subsystem is loaded, flagged and plotted on its own
         # -------------------------------------------------------------------------
 
-        plotting.make_subsystem_plots(
-            subsystems[system], config["subsystems"][system], pdf_path
+        if parallel:
+            # one worker per subsystem is enough, unless asked for fewer
+            workers = min(workers or os.cpu_count(), len(subsystems_to_flag))
+            utils.logger.info(
+                f"Loading and plotting {subsystems_to_flag} in parallel with {workers} workers"
+            )
+
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(
+                        load_and_plot_subsystem,
+                        system,
+                        config,
+                        pulser_timestamps,
+                        pdf_basepath,
+                        data_cache,
+                    )
+                    for system in subsystems_to_flag
+                ]
+                # pulser data is already here, plot it while the workers are busy
+                if "pulser" in subsystems_to_plot:
+                    plot_subsystem(pulser, config, pdf_basepath)
+                # re-raise any exception that happened in a worker
+                for future in as_completed(futures):
+                    future.result()
+        else:
+            for system in subsystems_to_plot:
+                if system == "pulser":
+                    plot_subsystem(pulser, config, pdf_basepath)
+                else:
+                    load_and_plot_subsystem(
+                        system, config, pulser_timestamps, pdf_basepath, data_cache
+                    )
+    else:
+        # -------------------------------------------------------------------------
+        # Load all subsystems in one go - each file is opened once per tier
+        # -------------------------------------------------------------------------
+
+        # Subsystem: knows its channel map & software status (On/Off channels)
+        subsystems = {
+            system: set_up_subsystem(system, config)
+            for system in ["pulser"] + subsystems_to_flag
+        }
+        # get list of all parameters needed for all requested plots, if any
+        # (if no parameters given to plot for pulser, baseline and wfmax will always be loaded to flag pulser events anyway)
+        parameters = {
+            system: utils.get_all_plot_parameters(system, config)
+            for system in subsystems
+        }
+        # get data for these parameters and time range given in the dataset
+        subsystem.get_subsystems_data(
+            list(subsystems.values()), parameters, cache=data_cache
         )
 
+        for system in subsystems_to_plot:
+            utils.logger.debug(subsystems[system].data)
+            # flag pulser events for future parameter data selection
+            if system != "pulser":
+                subsystems[system].flag_pulser_events(subsystems["pulser"])
+            plot_subsystem(subsystems[system], config, pdf_basepath)
+
     utils.logger.info("D O N E")
+
+
+def load_and_plot_subsystem(
+    system: str,
+    config: dict,
+    pulser_timestamps: pd.Series,
+    pdf_basepath: str,
+    data_cache: cache.DataCache = None,
+):
+    """
+    Set up given subsystem, load its data, flag pulser events and make its plots.
+
+    Only needs the timestamps of flagged pulser events instead of the full pulser Subsystem,
+    so that it can be sent to a worker process with little overhead.
+    If the config field 'streaming' is true, data is loaded in chunks of 'files_per_chunk' files (default: 10)
+    and only aggregated for the plots, instead of kept in memory (see streaming.stream_subsystem_plots()).
+    """
+    # -------------------------------------------------------------------------
+    # set up subsystem
+    # -------------------------------------------------------------------------
+
+    # Subsystem: knows its channel map & software status (On/Off channels)
+    sub = set_up_subsystem(system, config)
+
+    if config.get("streaming"):
+        # go through data chunk by chunk, keeping only what's needed for the plots
+        analyses = streaming.stream_subsystem_plots(
+            sub,
+            config["subsystems"][system],
+            pulser_timestamps,
+            cache=data_cache,
+            files_per_chunk=config.get("files_per_chunk", 10),
+            stats_dir=config.get("channel_stats"),
+            pyramid_dir=config.get("pyramid"),
+            histo_dir=config.get("histograms"),
+        )
+        plot_subsystem(sub, config, pdf_basepath, analyses)
+        return
+
+    # get list of parameters needed for all requested plots, if any
+    parameters = utils.get_all_plot_parameters(system, config)
+    # get data for these parameters and dataset range
+    # (events no plot needs, e.g. pulser events if only physical events are plotted, are dropped while loading)
+    sub.get_data(parameters, cache=data_cache, pulser_timestamps=pulser_timestamps)
+    utils.logger.debug(sub.data)
+    # flag pulser events for future parameter data selection
+    sub.flag_pulser_events(pulser_timestamps)
+
+    plot_subsystem(sub, config, pdf_basepath)
+
+
+def plot_subsystem_from_pyramid(system: str, config: dict, pdf_basepath: str):
+    """
+    Make the vs time plots of given subsystem from the pyramids saved in the directory of config field 'pyramid'.
+
+    The raw data is not loaded: the time range of the dataset is taken from the file catalog,
+    and time window means (or event rates) from the coarsest pyramid level fitting each plot's time window.
+    Plots with other styles are skipped.
+    """
+    if not config.get("pyramid"):
+        utils.logger.error(
+            "Provide the directory of saved pyramids in config field 'pyramid'!"
+        )
+        return
+
+    sub = set_up_subsystem(system, config)
+    start, end = sub.catalog.get_time_range(sub.datatype, sub.timerange)
+    if start is None:
+        utils.logger.warning(
+            "No files of the dataset in the file catalog, plotting the full time range of the pyramids"
+        )
+
+    analyses = {}
+    for plot_title, plot_settings in config["subsystems"][system].items():
+        if plot_settings["plot_style"] != "vs time":
+            utils.logger.warning(
+                f"Plot '{plot_title}' cannot be made from the pyramid, skipping it!"
+            )
+            continue
+        # one PyramidData per parameter of the plot
+        analyses[plot_title] = {
+            param: pyramid.PyramidData(
+                {**plot_settings, "parameters": param},
+                sub.channel_map,
+                pyramid.get_pyramid_path(
+                    config["pyramid"], sub, param, plot_settings["event_type"]
+                ),
+                start,
+                end,
+            )
+            for param in utils.get_plot_parameters(plot_settings)
+        }
+
+    plot_subsystem(sub, config, pdf_basepath, analyses)
+
+
+def plot_subsystem(
+    sub: subsystem.Subsystem, config: dict, pdf_basepath: str, analyses: dict = None
+):
+    """
+    Make all plots requested in the config for given subsystem and save them in one PDF file.
+
+    analyses: [optional] data already prepared for the plots, see plotting.make_subsystem_plots();
+        only plots in there will be made
+    """
+    # - currently one PDF file per subsystem, even though path to par_vs_time
+    pdf_path = pdf_basepath + "_" + sub.type + ".pdf"
+
+    # - set up log file
+    # file handler
+    file_handler = utils.logging.FileHandler(pdf_basepath + "_" + sub.type + ".log")
+    file_handler.setLevel(utils.logging.DEBUG)
+    # add to logger
+    utils.logger.addHandler(file_handler)
+
+    # -------------------------------------------------------------------------
+
+    plots = config["subsystems"][sub.type]
+    if analyses is not None:
+        plots = {plot_title: plots[plot_title] for plot_title in analyses}
+    elif sub.data.empty:
+        utils.logger.warning(f"No {sub.type} data to plot, skipping it!")
+        return
+
+    # event selections and channel means shared by the anomaly report and the plots
+    context = analysis_data.AnalysisContext(sub.data)
+
+    # - anomaly report, before any plot is made
+    if config.get("anomalies"):
+        anomalies.detect_subsystem_anomalies(
+            sub,
+            plots,
+            os.path.join(
+                config["output"],
+                "json_files",
+                os.path.basename(pdf_basepath) + "_" + sub.type + "_anomalies.json",
+            ),
+            analyses,
+            config["anomalies"] if isinstance(config["anomalies"], dict) else None,
+            context=context,
+        )
+
+    plotting.make_subsystem_plots(
+        sub,
+        plots,
+        pdf_path,
+        analyses,
+        context=context,
+        stats_dir=config.get("channel_stats"),
+        pyramid_dir=config.get("pyramid"),
+        histo_dir=config.get("histograms"),
+        render_workers=config.get("render_workers"),
+        render_cache=rendering.RenderCache(**config["render_cache"])
+        if "render_cache" in config
+        else None,
+    )
+
+
+def set_up_subsystem(system: str, config: dict) -> subsystem.Subsystem:
+    """
+    Set up Subsystem of given type for the dataset in the config, with options from the config.
+
+    Event types of its plots are given, so that events no plot needs are dropped while loading.
+    """
+    return subsystem.Subsystem(
+        system,
+        dataset=config["dataset"],
+        float32=config.get("float32", False),
+        metadata_cache=config.get("metadata_cache"),
+        catalog=config.get("catalog"),
+        pulser_tolerance=config.get("pulser_tolerance", 0),
+        event_types=[
+            plot_settings["event_type"]
+            for plot_settings in config["subsystems"].get(system, {}).values()
+        ],
+    )
@@ -0,0 +1,154 @@
+import ast
+import typing
+
+from . import utils
+
+# pandas is only needed for type hints: checking a config (run.py --check-config) must not import it
+if typing.TYPE_CHECKING:
+    import pandas as pd
+
+# -------------------------------------------------------------------------
+# derived parameters: defined as expressions in par-settings.json
+# -------------------------------------------------------------------------
+
+# A parameter is derived if its entry in settings/par-settings.json has an "expression",
+# e.g. "wf_max_rel": {..., "expression": "wf_max - baseline"}.
+# Expressions use the syntax of DataFrame.eval() (arithmetic, comparisons, functions like abs, log, sqrt)
+# and can refer to loaded parameters as well as other derived parameters:
+# the columns to load and the order of calculation are resolved from the dependency graph (see resolve()).
+# A new monitoring quantity then only needs an entry in par-settings.json.
+
+# calculated in time windows by AnalysisData instead of event by event, no columns needed
+WINDOW_PARAMETERS = ["event_rate"]
+
+
+def get_expression(param: str):
+    """Return expression of given parameter, None if it is not derived."""
+    return utils.PLOT_INFO.get(param, {}).get("expression")
+
+
+def get_inputs(expression: str) -> list:
+    """
+    Return names of parameters used in given expression, in order of appearance.
+
+    >>> get_inputs('abs(wf_max - baseline) / baseline')
+    ['wf_max', 'baseline']
+    """
+    tree = ast.parse(expression, mode="eval")
+    functions = {
+        node.func.id
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+    }
+    names = [
+        node.id
+        for node in sorted(
+            (node for node in ast.walk(tree) if isinstance(node, ast.Name)),
+            key=lambda node: node.col_offset,
+        )
+        if node.id not in functions
+    ]
+    return list(dict.fromkeys(names))
+
+
+def resolve(parameters) -> tuple:
+    """
+    Resolve given parameters into columns to load and derived parameters to calculate.
+
+    Returns (columns, derived): columns to load (not derived), and derived parameters in order of calculation
+    (each one after the derived parameters it depends on).
+    Parameters of WINDOW_PARAMETERS need no columns and are in neither.
+    Derived parameters with a circular definition are left out, with an error.
+    """
+    if isinstance(parameters, str):
+        parameters = [parameters]
+
+    columns, derived = [], []
+
+    # depth-first, returns False if the parameter cannot be resolved
+    def visit(param: str, path: list) -> bool:
+        if param in columns or param in derived or param in WINDOW_PARAMETERS:
+            return True
+        if param in path:
+            utils.logger.error(
+                "Circular definition of derived parameters: "
+                + " -> ".join(path + [param])
+            )
+            return False
+        expression = get_expression(param)
+        if expression is None:
+            columns.append(param)
+            return True
+        resolved = [visit(name, path + [param]) for name in get_inputs(expression)]
+        if not all(resolved):
+            return False
+        derived.append(param)
+        return True
+
+    for param in parameters:
+        visit(param, [])
+
+    return columns, derived
+
+
+def get_columns(parameters) -> list:
+    """Return columns needed to be loaded to get given parameters (derived or not)."""
+    return resolve(parameters)[0]
+
+
+def check_parameter(param: str) -> bool:
+    """Check that the expression of given parameter (and of derived parameters it depends on) can be parsed and has no cycles."""
+    seen = []
+    to_check = [param]
+    while to_check:
+        name = to_check.pop()
+        expression = get_expression(name)
+        if expression is None or name in seen:
+            continue
+        seen.append(name)
+        try:
+            to_check += get_inputs(expression)
+        except SyntaxError:
+            utils.logger.error(
+                f"Invalid expression '{expression}' of derived parameter {name} in par-settings.json!"
+            )
+            return False
+
+    columns, derived = resolve(param)
+    # a parameter in a cycle is never resolved
+    return param in columns + derived + WINDOW_PARAMETERS
+
+
+# -------------------------------------------------------------------------
+# calculation
+# -------------------------------------------------------------------------
+
+
+def calculate(data: "pd.DataFrame", parameters) -> "pd.DataFrame":
+    """
+    Add columns of given derived parameters (and of derived parameters they depend on) to data, and return it.
+
+    Each expression is evaluated on whole columns with DataFrame.eval() (numexpr if available).
+    Parameters that are not derived are left as they are.
+    """
+    for param in resolve(parameters)[1]:
+        data[param] = data.eval(get_expression(param))
+
+    return data
+
+
+def evaluate(data: "pd.DataFrame", expression: str) -> "pd.Series":
+    """
+    Return values of given expression (e.g. just a parameter name) for events in data, without adding columns to data.
+
+    Derived parameters used in the expression and missing in data are calculated on the way.
+
+    >>> energy = evaluate(data, 'K_lines')
+    >>> in_window = evaluate(data, '(K_lines > 1430) & (K_lines < 1575)')
+    """
+    inputs = get_inputs(expression)
+    missing = [name for name in inputs if name not in data]
+    if missing:
+        columns = resolve(missing)[0] + [name for name in inputs if name in data]
+        data = calculate(data[list(dict.fromkeys(columns))].copy(), missing)
+    return data.eval(expression)
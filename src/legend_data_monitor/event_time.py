@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+# -------------------------------------------------------------------------
+# one representation of event times for the whole pipeline
+# -------------------------------------------------------------------------
+
+# Event times are converted once, when data is loaded, from the float UTC timestamps (seconds) of the lh5 files
+# to the 'datetime' column of type datetime64[ns, UTC], which is stored as int64 nanoseconds since the unix epoch.
+# Everything that works on times (pulser matching, time windows, sorting, plotting) takes the int64 values
+# of that column with to_ns(), without a copy and without Python datetime objects;
+# plot styles convert them to matplotlib date numbers with array math when drawing (see plot_styles.to_plot_time()).
+
+NS_PER_SECOND = 10**9
+
+
+def seconds_to_ns(timestamp) -> np.ndarray:
+    """
+    Convert UTC timestamps in seconds since the unix epoch (float, as in lh5 files) to int64 nanoseconds.
+
+    Same rounding as pd.to_datetime(timestamp, unit='s'), without its overhead.
+    """
+    return (np.asarray(timestamp, dtype=float) * NS_PER_SECOND).round().astype(np.int64)
+
+
+def from_seconds(timestamp) -> pd.Series:
+    """Convert UTC timestamps in seconds since the unix epoch to datetime64[ns, UTC] (see seconds_to_ns())."""
+    index = timestamp.index if isinstance(timestamp, pd.Series) else None
+    return pd.Series(
+        pd.DatetimeIndex(seconds_to_ns(timestamp).view("M8[ns]")).tz_localize("UTC"),
+        index=index,
+    )
+
+
+def to_ns(times) -> np.ndarray:
+    """
+    Return times as int64 nanoseconds since the unix epoch (UTC).
+
+    times: datetime Series/array (tz-aware or naive UTC), or already int64 nanoseconds;
+        no copy for a datetime64[ns] column
+    """
+    if isinstance(times, np.ndarray) and times.dtype == np.int64:
+        return times
+    return pd.DatetimeIndex(times).asi8
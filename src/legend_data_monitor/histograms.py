@@ -0,0 +1,242 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from . import stats, utils
+
+# number of bins if not given in par-settings.json
+DEFAULT_BINS = 50
+
+# -------------------------------------------------------------------------
+
+
+class ChannelHistograms:
+    """
+    Histogram counts of one parameter for all channels, as a channel x bin table.
+
+    All channels are histogrammed in one pass (see from_values()): each value gets a flat bin number
+    channel * n_bins + bin, and counts are taken with one np.bincount.
+    Channels can have different bin edges (e.g. each its own data range), but all have the same number of bins.
+
+    Counts with the same bins can be merged (added) without going back to the data,
+    so that histograms with fixed bins (see get_histo_bins()) can be updated chunk by chunk and saved between runs.
+    Like stats.ChannelStats, the time of the last event included is kept, and only later events are added (see update()).
+
+    counts [DataFrame]: [optional] counts indexed by channel, one column per bin
+    edges [DataFrame]: [optional] bin edges indexed by channel, one column per edge
+    end [Timestamp]: [optional] time of the last event included
+
+    >>> bins = get_histo_bins('cuspEmax_ctc_cal')
+    >>> histos = ChannelHistograms.load('histograms/l200-v01.06-phy-geds-cuspEmax_ctc_cal-phy.json')
+    >>> histos.update(data['channel'], data['cuspEmax_ctc_cal'], bins, data['datetime'])
+    >>> x, y = histos.steps(1104000)
+    """
+
+    def __init__(
+        self, counts: pd.DataFrame = None, edges: pd.DataFrame = None, end=None
+    ):
+        empty = pd.DataFrame(index=pd.Index([], name="channel"))
+        self.counts = empty if counts is None else counts
+        self.edges = empty if edges is None else edges
+        self.end = end
+
+    @classmethod
+    def from_values(cls, channel, values, bins: tuple, time=None):
+        """
+        Histograms of given parameter values of given channels (with their times, if they should be kept track of).
+
+        bins: (number of bins, [x_min, x_max]) as returned by get_histo_bins();
+            x_min and x_max are numbers, or Series indexed by channel for a different range per channel
+
+        Same bins as np.histogram(): values outside the range and NaN values are not counted,
+        the last bin includes its upper edge, and a range with x_min = x_max is widened by 0.5 on both sides.
+        """
+        no_bins, (x_min, x_max) = bins
+        codes, uniques = pd.factorize(np.asarray(channel), sort=True)
+        values = np.asarray(values, dtype=float)
+        n = len(uniques)
+
+        # --- range of each channel
+        lows, highs = (
+            x.reindex(uniques).to_numpy(dtype=float)
+            if isinstance(x, pd.Series)
+            else np.full(n, x, dtype=float)
+            for x in (x_min, x_max)
+        )
+        same = lows == highs
+        lows[same] -= 0.5
+        highs[same] += 0.5
+        edges = np.linspace(lows, highs, no_bins + 1, axis=1)
+
+        # --- bin of each value
+        inside = (values >= lows[codes]) & (values <= highs[codes])
+        codes, values = codes[inside], values[inside]
+        lows, highs = lows[codes], highs[codes]
+        index = ((values - lows) / (highs - lows) * no_bins).astype(np.int64)
+        index = np.minimum(index, no_bins - 1)
+        # same corrections as np.histogram for values rounded into the wrong bin
+        index[values < edges[codes, index]] -= 1
+        above = (values >= edges[codes, index + 1]) & (index != no_bins - 1)
+        index[above] += 1
+
+        counts = np.bincount(codes * no_bins + index, minlength=n * no_bins)
+        end = pd.Series(time).max() if time is not None and len(time) else None
+        return cls(
+            pd.DataFrame(
+                counts.reshape(n, no_bins), index=pd.Index(uniques, name="channel")
+            ),
+            pd.DataFrame(edges, index=pd.Index(uniques, name="channel")),
+            end,
+        )
+
+    # -------------------------------------------------------------------------
+    # merging
+    # -------------------------------------------------------------------------
+
+    def merge(self, other: "ChannelHistograms") -> "ChannelHistograms":
+        """
+        Return histograms of the data of both self and other.
+
+        Channels in both must have the same bins; if not, an error is printed and self is returned unchanged.
+        """
+        common = self.counts.index.intersection(other.counts.index)
+        if len(common) and (
+            self.edges.shape[1] != other.edges.shape[1]
+            or not np.allclose(
+                self.edges.loc[common], other.edges.loc[common], equal_nan=True
+            )
+        ):
+            utils.logger.error("Cannot merge histograms with different bins!")
+            return ChannelHistograms(self.counts, self.edges, self.end)
+
+        counts = self.counts.add(other.counts, fill_value=0).astype(int)
+        edges = self.edges.combine_first(other.edges)
+        ends = [end for end in [self.end, other.end] if end is not None]
+        return ChannelHistograms(counts, edges, max(ends) if ends else None)
+
+    def update(self, channel, values, bins: tuple, time=None):
+        """
+        Add given parameter values of given channels with given bins (see from_values()), and return self.
+
+        If times are given and histograms already include events up to self.end, only later events are added
+        (see stats.get_later_events()).
+        """
+        if time is not None and self.end is not None:
+            later = stats.get_later_events(time, self.end, "histograms")
+            channel = np.asarray(channel)[later]
+            values = np.asarray(values)[later]
+            time = pd.Series(time)[later]
+        merged = self.merge(ChannelHistograms.from_values(channel, values, bins, time))
+        self.counts, self.edges, self.end = merged.counts, merged.edges, merged.end
+        return self
+
+    # -------------------------------------------------------------------------
+    # results
+    # -------------------------------------------------------------------------
+
+    def steps(self, channel) -> tuple:
+        """
+        Return x and y arrays drawing the histogram of given channel as a step line, closed down to 0 at both ends.
+
+        Same shape as plt.hist(histtype='step'), without histogramming again.
+        """
+        edges = self.edges.loc[channel].to_numpy()
+        counts = self.counts.loc[channel].to_numpy()
+        return np.repeat(edges, 2), np.concatenate([[0], np.repeat(counts, 2), [0]])
+
+    def centers(self) -> pd.DataFrame:
+        """Return bin centers indexed by channel, one column per bin."""
+        edges = self.edges.to_numpy()
+        return pd.DataFrame(
+            (edges[:, 1:] + edges[:, :-1]) / 2, index=self.edges.index
+        ).reindex(self.counts.index)
+
+    # -------------------------------------------------------------------------
+    # saving
+    # -------------------------------------------------------------------------
+
+    def save(self, path: str):
+        """Save histograms as JSON file."""
+        channels = {
+            str(channel): {
+                "edges": self.edges.loc[channel].tolist(),
+                "counts": self.counts.loc[channel].astype(int).tolist(),
+            }
+            for channel in self.counts.index
+        }
+        histos = {
+            "end": None if self.end is None else self.end.isoformat(),
+            "channels": channels,
+        }
+
+        # write to temporary file first, another process might be reading it
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(histos, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """Load histograms saved with save(); empty histograms if the file does not exist yet."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            histos = json.load(f)
+
+        index = pd.Index([int(ch) for ch in histos["channels"]], name="channel")
+        channels = histos["channels"].values()
+        counts = pd.DataFrame([ch["counts"] for ch in channels], index=index)
+        edges = pd.DataFrame([ch["edges"] for ch in channels], index=index)
+        end = None if histos["end"] is None else pd.Timestamp(histos["end"])
+        return cls(counts, edges, end)
+
+
+# -------------------------------------------------------------------------
+# helper functions
+# -------------------------------------------------------------------------
+
+
+def get_histo_bins(
+    parameter: str, x_min=None, x_max=None, variation: bool = False
+) -> tuple:
+    """
+    Get number of bins and range [x_min, x_max] of histogram of given parameter.
+
+    Bins are taken from the 'histogram' entry of the parameter in par-settings.json, if present:
+        - "range": [x_min, x_max] fixed range (needed e.g. for cuspEmax, with geant outliers the normal histo cannot be viewed)
+        - "bin_width": bin width within the fixed range, or "bins": number of bins (default: DEFAULT_BINS)
+    Without fixed range, the given data range is taken (numbers, or Series indexed by channel);
+    returns None if range is not fixed and data range is not provided.
+    The fixed range is in units of the parameter, and is not used for variation (%).
+
+    >>> get_histo_bins('cuspEmax_ctc_cal')
+    (1000, [0, 2500])
+    """
+    spec = {} if variation else utils.PLOT_INFO[parameter].get("histogram", {})
+    if "range" in spec:
+        x_min, x_max = spec["range"]
+    elif x_min is None:
+        return None
+
+    if "bin_width" in spec and "range" in spec:
+        no_bins = int((x_max - x_min) / spec["bin_width"])
+    else:
+        no_bins = spec.get("bins", DEFAULT_BINS)
+
+    return no_bins, [x_min, x_max]
+
+
+def get_histogram_path(histo_dir: str, subsystem, parameter: str, evt_type: str) -> str:
+    """
+    Return path of saved histograms of given parameter and event type for given Subsystem.
+
+    Format: <histo_dir>/<experiment>-<version>-<data type>-<subsystem>-<parameter>-<event type>.json
+    Only histograms with fixed bins can be saved and merged between runs.
+    """
+    return os.path.join(
+        histo_dir,
+        f"{subsystem.experiment}-{subsystem.version}-{subsystem.datatype}-{subsystem.type}-{parameter}-{evt_type}.json",
+    )
@@ -0,0 +1,166 @@
+import getpass
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+
+import pandas as pd
+
+from . import utils
+
+# -------------------------------------------------------------------------
+# LEGEND metadata: only loaded when really needed, since reading (or cloning) the repository takes a while
+# -------------------------------------------------------------------------
+
+LEGEND_META = None
+
+# default directory for cached metadata lookups
+CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "legend-data-monitor", "metadata"
+)
+
+
+def get_legend_meta():
+    """Return LegendMetadata object, created at first call."""
+    global LEGEND_META
+    if LEGEND_META is None:
+        from legendmeta import LegendMetadata
+
+        utils.logger.info("... loading LEGEND metadata")
+        LEGEND_META = LegendMetadata()
+    return LEGEND_META
+
+
+def get_metadata_path() -> str:
+    """Return directory of the metadata checkout used by LegendMetadata(), without importing it."""
+    return os.environ.get("LEGEND_METADATA") or os.path.join(
+        tempfile.gettempdir(), "legend-metadata-" + getpass.getuser()
+    )
+
+
+def get_metadata_version(path: str):
+    """
+    Return version of the metadata checkout in given directory: commit of HEAD if it is a git repository,
+    otherwise latest modification time of its files. None if it does not exist (yet).
+    """
+    if not os.path.isdir(path):
+        return
+    try:
+        head = subprocess.run(
+            ["git", "-C", path, "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+        )
+    except FileNotFoundError:
+        # git not installed
+        head = None
+    if head is not None and head.returncode == 0:
+        return head.stdout.strip()
+
+    return max(
+        (
+            os.path.getmtime(os.path.join(root, file))
+            for root, _, files in os.walk(path)
+            for file in files
+        ),
+        default=None,
+    )
+
+
+# -------------------------------------------------------------------------
+# cached lookups
+# -------------------------------------------------------------------------
+
+
+def load_cached(kind: str, timestamp: str, system, query, cache_dir=None):
+    """
+    Return result of a metadata query, from the disk cache if it was already done before.
+
+    kind: name of the lookup, e.g. 'channelmap'
+    timestamp: timestamp the metadata is valid for, format 'YYYYMMDDThhmmssZ'
+    system: data type the metadata is valid for ('phy', 'cal'), None if not system dependent
+    query: function without arguments doing the query, returning something that can be stored as JSON
+    cache_dir: [optional] directory of the cache. Default: CACHE_DIR
+
+    Entries also depend on the metadata checkout, its location and version (see get_metadata_version()),
+    so that they are looked up again after the metadata was updated (e.g. git pull).
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    meta_path = get_metadata_path()
+    key = hashlib.sha1(
+        json.dumps(
+            [kind, timestamp, system, meta_path, get_metadata_version(meta_path)]
+        ).encode()
+    ).hexdigest()
+    path = os.path.join(cache_dir, f"{kind}-{key}.json")
+
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+
+    result = query()
+
+    # write to temporary file first, another process might be reading the same entry
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(result, f)
+    os.replace(tmp_path, path)
+
+    return result
+
+
+def get_channel_records(timestamp: str, cache_dir=None) -> pd.DataFrame:
+    """
+    Return full channel map at given timestamp as a table, one row per channel.
+
+    Columns: name, system, channel (FlashCam channel), string, fiber, position, barrel, cc4_id, cc4_channel,
+    None where not applicable for the system.
+    """
+
+    def query():
+        full_channel_map = get_legend_meta().hardware.configuration.channelmaps.on(
+            timestamp=timestamp
+        )
+        records = []
+        for entry, entry_info in full_channel_map.items():
+            # skip 'BF' don't even know what it is
+            if "BF" in entry:
+                continue
+            location = entry_info.get("location", {})
+            cc4 = entry_info.get("electronics", {}).get("cc4", {})
+            records.append(
+                {
+                    "name": entry_info["name"],
+                    "system": entry_info["system"],
+                    "channel": entry_info["daq"]["fcid"],
+                    "string": location.get("string"),
+                    "fiber": location.get("fiber"),
+                    "position": location.get("position"),
+                    "barrel": location.get("barrel"),
+                    "cc4_id": cc4.get("id"),
+                    "cc4_channel": cc4.get("channel"),
+                }
+            )
+        return records
+
+    return pd.DataFrame(load_cached("channelmap", timestamp, None, query, cache_dir))
+
+
+def get_channel_status(timestamp: str, system: str, cache_dir=None) -> pd.Series:
+    """Return software status (On/Off) of all channels at given timestamp for given data type, indexed by channel."""
+
+    def query():
+        full_status_map = get_legend_meta().dataprod.config.on(
+            timestamp=timestamp, system=system
+        )["hardware_configuration"]["channel_map"]
+        # convert string channel ('ch005') to integer (5)
+        return {
+            int(channel[2:]): info["software_status"]
+            for channel, info in full_status_map.items()
+        }
+
+    status = load_cached("status", timestamp, system, query, cache_dir)
+    # JSON keys are always strings
+    return pd.Series({int(ch): value for ch, value in status.items()}, dtype=object)
@@ -6,11 +6,18 @@
 
 from math import ceil
 
+import numpy as np
+import pandas as pd
+from matplotlib import colormaps
 from matplotlib.axes import Axes
-from matplotlib.dates import DateFormatter, date2num
+from matplotlib.dates import DateFormatter, get_epoch
 from matplotlib.figure import Figure
 from matplotlib.ticker import FixedLocator
-from pandas import DataFrame, Timedelta
+from pandas import DataFrame
+
+from . import binning, event_time, histograms
+
+NS_PER_DAY = 86400 * event_time.NS_PER_SECOND
 
 
 def plot_vs_time(
@@ -21,39 +28,50 @@ def plot_vs_time(
     # -------------------------------------------------------------------------
 
     # need to plot this way, and not data_position.plot(...) because the datetime column is of type Timestamp
-    # plotting this way, to_pydatetime() converts it to type datetime which is needed for DateFormatter
-    # changing the type of the column itself with the table does not work
+    # -> plot matplotlib date numbers, as needed for DateFormatter (converted once, also used for the ticks)
     data_channel = data_channel.sort_values("datetime")
-    ax.plot(
-        data_channel["datetime"].dt.to_pydatetime(),
-        data_channel[plot_info["parameter"]],
-        zorder=0,
-        color=color if plot_info["parameter"] == "event_rate" else "darkgray",
-    )
+    times = to_plot_time(data_channel["datetime"])
+    values = data_channel[plot_info["parameter"]].to_numpy()
+
+    # the page cannot show more than a few points per pixel: only draw first, last, min and max in each pixel column,
+    # so that the line looks the same, spikes included
+    # (no raw events if the data is already aggregated in time windows, e.g. in streaming mode: only the means are drawn)
+    if not plot_info.get("aggregated"):
+        keep = binning.decimate_min_max(times, values, get_pixel_budget(ax, plot_info))
+        ax.plot(
+            times[keep],
+            values[keep],
+            zorder=0,
+            color=color if plot_info["parameter"] == "event_rate" else "darkgray",
+        )
 
     # -------------------------------------------------------------------------
     # plot resampled average
     # -------------------------------------------------------------------------
 
-    # unless event rate - already resampled and counted in some time window
+    # unless event rate - already counted in time windows
     if not plot_info["parameter"] == "event_rate":
-        # resample in given time window, as start pick the first timestamp in table
-        resampled = (
-            data_channel.set_index("datetime")
-            .resample(plot_info["time_window"], origin="start")
-            .mean(numeric_only=True)
-        )
-        # will have datetime as index after resampling -> put back
-        resampled = resampled.reset_index()
-        # the timestamps in the resampled table will start from the first timestamp, and go with sampling intervals
-        # I want to shift them by half sampling window, so that the resampled value is plotted in the middle time window in which it was calculated
-        resampled["datetime"] = (
-            resampled["datetime"] + Timedelta(plot_info["time_window"]) / 2
-        )
+        # mean in given time windows starting with the first event of the channel,
+        # calculated for all channels at once in plotting.make_subsystem_plots() if possible
+        resampled = plot_info.get("resampled")
+        if resampled is None:
+            resampled = binning.bin_in_time(
+                data_channel["channel"],
+                data_channel["datetime"],
+                plot_info["time_window"],
+                data_channel[plot_info["parameter"]],
+            )
+        else:
+            resampled = resampled[
+                resampled["channel"] == data_channel["channel"].iloc[0]
+            ]
+        # plot each mean in the middle of the time window in which it was calculated
+        # (of the covered part, for the last window)
+        resampled_time = resampled["start"] + resampled["duration"] / 2
 
         ax.plot(
-            resampled["datetime"].dt.to_pydatetime(),
-            resampled[plot_info["parameter"]],
+            to_plot_time(resampled_time),
+            resampled["mean"],
             color=color,
             zorder=1,
             marker="o",
@@ -69,16 +87,10 @@ def plot_vs_time(
     every_10th_index_step = ceil(len(data_channel) / 10.0)
     # get corresponding time points
     # if there are less than 10 points in total in the frame, the step will be 0 -> take all points
-    timepoints = (
-        data_channel.iloc[::every_10th_index_step]["datetime"]
-        if every_10th_index_step
-        else data_channel["datetime"]
-    )
+    timepoints = times[::every_10th_index_step] if every_10th_index_step else times
 
     # set ticks and date format
-    ax.xaxis.set_major_locator(
-        FixedLocator([date2num(x) for x in timepoints.dt.to_pydatetime()])
-    )
+    ax.xaxis.set_major_locator(FixedLocator(timepoints))
     ax.xaxis.set_major_formatter(DateFormatter("%Y\n%m/%d\n%H:%M"))
 
     # --- set labels
@@ -89,37 +101,29 @@ def plot_vs_time(
 def plot_histo(
     data_channel: DataFrame, fig: Figure, ax: Axes, plot_info: dict, color=None
 ):
-    # --- histo range
-    # !! in the future take from par-settings
-    # needed for cuspEmax because with geant outliers not possible to view normal histo
-    hrange = {"keV": [0, 2500]}
-    # take full range if not specified
-    x_min = (
-        hrange[plot_info["unit"]][0]
-        if plot_info["unit"] in hrange
-        else data_channel[plot_info["parameter"]].min()
-    )
-    x_max = (
-        hrange[plot_info["unit"]][1]
-        if plot_info["unit"] in hrange
-        else data_channel[plot_info["parameter"]].max()
-    )
+    # -------------------------------------------------------------------------
+    # histogram counts of all channels, calculated in one pass in plotting.make_subsystem_plots() if possible
+    # -------------------------------------------------------------------------
 
-    # --- bin width
-    bwidth = {"keV": 2.5}  # what to do with binning???
-    bin_width = bwidth[plot_info["unit"]] if plot_info["unit"] in bwidth else None
-    no_bins = int((x_max - x_min) / bin_width) if bin_width else 50
+    histos = plot_info.get("histograms")
+    if histos is None:
+        values = data_channel[plot_info["parameter"]]
+        histos = histograms.ChannelHistograms.from_values(
+            data_channel["channel"],
+            values,
+            histograms.get_histo_bins(
+                plot_info["parameter"],
+                values.min(),
+                values.max(),
+                plot_info.get("variation", False),
+            ),
+        )
 
     # -------------------------------------------------------------------------
 
-    data_channel[plot_info["parameter"]].plot.hist(
-        bins=no_bins,
-        range=[x_min, x_max],
-        histtype="step",
-        linewidth=1.5,
-        ax=ax,
-        color=color,
-    )
+    # draw precomputed steps instead of histogramming again
+    x, y = histos.steps(data_channel["channel"].iloc[0])
+    ax.plot(x, y, linewidth=1.5, color=color)
 
     # -------------------------------------------------------------------------
 
@@ -131,7 +135,7 @@ def plot_scatter(
     data_channel: DataFrame, fig: Figure, ax: Axes, plot_info: dict, color=None
 ):
     ax.scatter(
-        data_channel["datetime"].dt.to_pydatetime(),
+        to_plot_time(data_channel["datetime"]),
         data_channel[plot_info["parameter"]],
         color=color,
     )
@@ -143,17 +147,129 @@ def plot_scatter(
 def plot_heatmap(
     data_channel: DataFrame, fig: Figure, ax: Axes, plot_info: dict, color=None
 ):
-    # here will be a function to plot a SiPM heatmap
-    pass
+    # -------------------------------------------------------------------------
+    # one channel x time window image of all channels given (e.g. all channels of a string, see AXIS_STYLES)
+    # instead of one line per channel
+    # -------------------------------------------------------------------------
+
+    # one row per channel, in the order of the data (sorted by the plot structure)
+    channel_info = data_channel.drop_duplicates("channel")
+    channels = pd.Index(channel_info["channel"])
+
+    # mean in time windows common to all channels,
+    # calculated for all channels at once in plotting.make_subsystem_plots() if possible
+    table = plot_info.get("heatmap")
+    if table is None:
+        table = bin_heatmap(data_channel, plot_info)
+    table = table[table["channel"].isin(channels)]
+    if table.empty:
+        return
+
+    # --- fill the image in one go: row of each channel, column of each window
+    first = table["window"].min()
+    columns = table["window"].to_numpy() - first
+    image = np.full((len(channels), columns.max() + 1), np.nan)
+    image[channels.get_indexer(table["channel"]), columns] = table["value"].to_numpy()
+
+    # -------------------------------------------------------------------------
+    # draw
+    # -------------------------------------------------------------------------
+
+    # x axis in matplotlib date numbers, from the start of the first window to the end of the last one
+    left = to_plot_time(table["start"]).min()
+    window_days = pd.Timedelta(plot_info["time_window"]).value / NS_PER_DAY
+    right = left + image.shape[1] * window_days
+
+    # color scale not set by a few outliers; windows without events are gray
+    values = image[np.isfinite(image)]
+    vmin, vmax = np.percentile(values, [1, 99]) if len(values) else (None, None)
+    cmap = colormaps["viridis"].copy()
+    cmap.set_bad("lightgray")
+
+    heatmap = ax.imshow(
+        image,
+        aspect="auto",
+        interpolation="nearest",
+        extent=[left, right, len(channels) - 0.5, -0.5],
+        cmap=cmap,
+        vmin=vmin,
+        vmax=vmax,
+    )
+
+    # -------------------------------------------------------------------------
+    # beautification
+    # -------------------------------------------------------------------------
+
+    ax.set_yticks(np.arange(len(channels)))
+    ax.set_yticklabels(channel_info["name"])
+    ax.xaxis.set_major_formatter(DateFormatter("%Y\n%m/%d\n%H:%M"))
+    fig.colorbar(
+        heatmap, ax=ax, label=f"{plot_info['label']} [{plot_info['unit_label']}]"
+    )
+    fig.supxlabel("UTC Time")
+
+
+# -------------------------------------------------------------------------------
+# helper functions
+# -------------------------------------------------------------------------------
+
+
+def to_plot_time(times) -> np.ndarray:
+    """
+    Convert datetime column (or int64 nanoseconds, see event_time.py) to matplotlib date numbers (in UTC).
+
+    Days since the matplotlib epoch, same as date2num(), calculated from the int64 nanoseconds with array math only.
+    """
+    epoch = np.datetime64(get_epoch(), "ns").astype(np.int64)
+    return (event_time.to_ns(times) - epoch) / NS_PER_DAY
+
+
+def bin_heatmap(data: DataFrame, plot_info: dict) -> DataFrame:
+    """
+    Mean of the parameter in time windows common to all channels of given data, for all channels in one pass.
+
+    Windows start with the first event of all channels (instead of each channel's own first event, see binning.bin_in_time()),
+    so that window numbers are the columns of a channel x time window image.
+    For event rate (already in time windows) this is the mean of the event rates in each window.
+
+    Returns DataFrame with columns channel, window, start, value (NaN for empty windows).
+    """
+    channels = data["channel"].unique()
+    bins = binning.bin_in_time(
+        data["channel"],
+        data["datetime"],
+        plot_info["time_window"],
+        data[plot_info["parameter"]],
+        origin=pd.Series(data["datetime"].min(), index=channels),
+    )
+    return bins[["channel", "window", "start", "mean"]].rename(
+        columns={"mean": "value"}
+    )
+
+
+def get_pixel_budget(ax: Axes, plot_info: dict) -> int:
+    """
+    Return number of pixel columns to decimate lines to (see binning.decimate_min_max()).
+
+    Given by plot setting 'pixels' if present in plot_info, otherwise the width of the axes in pixels at the figure resolution.
+    """
+    if plot_info.get("pixels"):
+        return int(plot_info["pixels"])
+    return max(int(ax.get_window_extent().width), 1)
 
 
 # -------------------------------------------------------------------------------
 # mapping user keywords to plot style functions
 # -------------------------------------------------------------------------------
 
+# when adding a style, add its name to utils.PLOT_STYLES too
 PLOT_STYLE = {
     "vs time": plot_vs_time,
     "histogram": plot_histo,
     "scatter": plot_scatter,
     "heatmap": plot_heatmap,
 }
+
+# styles drawing all channels of an axis at once: called once per axis with the data of all its channels,
+# instead of once per channel
+AXIS_STYLES = ["heatmap"]
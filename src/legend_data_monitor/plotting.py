@@ -1,10 +1,14 @@
 import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.ticker import MaxNLocator
 from pandas import DataFrame
 from seaborn import color_palette
 
-from . import analysis_data, utils
+from . import analysis_data, binning, channels, histograms, pyramid, stats, utils
 from .plot_styles import *
+from .plot_styles import AXIS_STYLES, bin_heatmap
+from .rendering import PageRenderer, RenderCache
 from .subsystem import Subsystem
 
 # -------------------------------------------------------------------------
@@ -12,6 +16,9 @@ from .subsystem import Subsystem
 # global variable to be filled later with colors based on number of channels
 COLORS = []
 
+# number of fibers per row of subplots in the top bottom structure
+FIBER_COLUMNS = 5
+
 # -------------------------------------------------------------------------
 # main plotting function(s)
 # -------------------------------------------------------------------------
@@ -21,8 +28,45 @@ COLORS = []
 # for example, this structure won't work to plot one parameter VS the other
 
 
-def make_subsystem_plots(subsystem: Subsystem, plots: dict, pdf_path: str):
-    pdf = PdfPages(pdf_path)
+def make_subsystem_plots(
+    subsystem: Subsystem,
+    plots: dict,
+    pdf_path: str,
+    analyses: dict = None,
+    context: analysis_data.AnalysisContext = None,
+    stats_dir: str = None,
+    pyramid_dir: str = None,
+    histo_dir: str = None,
+    render_workers: int = None,
+    render_cache: RenderCache = None,
+):
+    """
+    Make all given plots for given subsystem and save them in one PDF file.
+
+    analyses: [optional] dict of format {<plot title>: <analysis data>} with data already prepared for (some of) the plots,
+        or {<plot title>: {<parameter>: <analysis data>}} for data prepared one parameter at a time
+        e.g. streaming.PlotAggregates; otherwise AnalysisData is created from subsystem data
+    A plot with several parameters gets one AnalysisData for all of them (one selection of events),
+    and its pages are made for each parameter in turn.
+    context: [optional] event selections and channel means shared with other passes over the subsystem data
+        (e.g. anomalies.detect_subsystem_anomalies()), see analysis_data.AnalysisContext
+    stats_dir: [optional] directory of channel statistics saved between runs (see stats.ChannelStats);
+        if given, channel mean and variation are calculated over all data seen so far, not only this data
+    pyramid_dir: [optional] directory of time series pyramids saved between runs (see pyramid.TimePyramid);
+        if given, pyramids of vs time plots are updated with this data, and time window means are read from them
+    histo_dir: [optional] directory of histograms saved between runs (see histograms.ChannelHistograms);
+        if given, saved histograms with fixed bins are updated with the counts of this data
+    render_workers: [optional] number of processes to draw the pages in (e.g. one per string), see rendering.PageRenderer;
+        pages are drawn one after the other if not given
+    render_cache: [optional] pages drawn in earlier runs, taken from there if their data and settings did not change
+    """
+    pdf = PageRenderer(pdf_path, render_workers, render_cache)
+
+    # event selections and channel means shared by all plots of this subsystem
+    if context is None:
+        context = analysis_data.AnalysisContext(subsystem.data)
+    # place of each SiPM in the grids of the barrel structures, same for all plots of this subsystem
+    barrel_layout = get_barrel_layout(subsystem.channel_map)
 
     # for param in subsys.parameters:
     for plot_title in plots:
@@ -47,62 +91,172 @@ def make_subsystem_plots(subsystem: Subsystem, plots: dict, pdf_path: str):
         # -------------------------------------------------------------------------
 
         # --- AnalysisData:
-        # - select parameter of interest
+        # - select parameter(s) of interest
         # - subselect type of events (pulser/phy/all/klines)
         # - calculate variation from mean, if asked
-        data_analysis = analysis_data.AnalysisData(
-            subsystem.data, selection=plot_settings
-        )
-        utils.logger.debug(data_analysis.data)
-
-        # -------------------------------------------------------------------------
-        # set up plot info
-        # -------------------------------------------------------------------------
-
-        # --- color settings using a pre-defined palette
-        # num colors needed = max number of channels per string
-        # - find number of unique positions in each string
-        # - get maximum occurring
-        max_ch_per_string = (
-            data_analysis.data.groupby("location")["position"].nunique().max()
-        )
-        global COLORS
-        COLORS = color_palette("hls", max_ch_per_string).as_hex()
-
-        # --- information needed for plot structure
-        # ! currently "parameters" is one parameter !
-        # subject to change if one day want to plot multiple in one plot
-        plot_info = {
-            "title": plot_title,
-            "subsystem": subsystem.type,
-            "locname": {"geds": "string", "spms": "fiber", "pulser": "aux"}[
-                subsystem.type
-            ],
-            "unit": utils.PLOT_INFO[plot_settings["parameters"]]["unit"],
-            "plot_style": plot_settings["plot_style"],
-        }
-
-        # --- information needed for plot style
-        plot_info["parameter"] = plot_settings[
-            "parameters"
-        ]  # could be multiple in the future!
-        plot_info["label"] = utils.PLOT_INFO[plot_info["parameter"]]["label"]
-        # unit label should be % if variation was asked
-        plot_info["unit_label"] = (
-            "%" if plot_settings["variation"] else plot_info["unit"]
-        )
-        # time window might be needed fort he vs time function
-        plot_info["time_window"] = plot_settings["time_window"]
-
-        # -------------------------------------------------------------------------
-        # call chosen plot structure
-        # -------------------------------------------------------------------------
-
-        # choose plot function based on user requested structure e.g. per channel or all ch together
-        plot_structure = PLOT_STRUCTURE[plot_settings["plot_structure"]]
+        # all parameters of the plot are taken from the same selection of events, then plotted one after the other
+        parameters = utils.get_plot_parameters(plot_settings)
+        time_pyramids = {}
+        if analyses and plot_title in analyses:
+            prepared = analyses[plot_title]
+        else:
+            # statistics of previous runs, if asked
+            channel_stats = {}
+            stats_paths = {}
+            if stats_dir:
+                for param in parameters:
+                    if param == "event_rate":
+                        continue
+                    stats_paths[param] = stats.get_stats_path(
+                        stats_dir, subsystem, param, plot_settings["event_type"]
+                    )
+                    channel_stats[param] = stats.ChannelStats.load(stats_paths[param])
+
+            prepared = analysis_data.AnalysisData(
+                subsystem.data,
+                context,
+                selection=plot_settings,
+                channel_stats=channel_stats,
+            )
 
-        utils.logger.debug("Plot structure: " + plot_settings["plot_structure"])
-        plot_structure(data_analysis, plot_info, pdf)
+            for param, stats_path in stats_paths.items():
+                channel_stats[param].save(stats_path)
+
+            # aggregates in time windows of several resolutions kept between runs, if asked
+            if pyramid_dir and plot_settings["plot_style"] == "vs time":
+                for param in parameters:
+                    time_pyramids[param] = pyramid.update_pyramid(
+                        pyramid.get_pyramid_path(
+                            pyramid_dir, subsystem, param, plot_settings["event_type"]
+                        ),
+                        subsystem.data,
+                        context,
+                        {**plot_settings, "parameters": param},
+                    )
+
+        for param in parameters:
+            # data prepared in streaming mode or from pyramids comes as one object per parameter
+            data_analysis = prepared[param] if isinstance(prepared, dict) else prepared
+            time_pyramid = time_pyramids.get(param)
+            utils.logger.debug(data_analysis.data)
+            if data_analysis.data.empty:
+                utils.logger.warning(
+                    f"No data for {param} in '{plot_title}', skipping it!"
+                )
+                continue
+
+            # -------------------------------------------------------------------------
+            # set up plot info
+            # -------------------------------------------------------------------------
+
+            # --- color settings using a pre-defined palette
+            # num colors needed = max number of channels per string
+            # - find number of unique positions in each string
+            # - get maximum occurring
+            max_ch_per_string = (
+                data_analysis.data.groupby("location", observed=True)["position"]
+                .nunique()
+                .max()
+            )
+            global COLORS
+            COLORS = color_palette("hls", max_ch_per_string).as_hex()
+
+            # --- information needed for plot structure
+            # one parameter at a time; title tells them apart if the plot has several
+            plot_info = {
+                "title": plot_title
+                if len(parameters) == 1
+                else f"{plot_title} - {utils.PLOT_INFO[param]['label']}",
+                "subsystem": subsystem.type,
+                "locname": {"geds": "string", "spms": "fiber", "pulser": "aux"}[
+                    subsystem.type
+                ],
+                "unit": utils.PLOT_INFO[param]["unit"],
+                "plot_style": plot_settings["plot_style"],
+            }
+
+            # --- information needed for plot style
+            plot_info["parameter"] = param
+            plot_info["label"] = utils.PLOT_INFO[plot_info["parameter"]]["label"]
+            # unit label should be % if variation was asked
+            plot_info["unit_label"] = (
+                "%" if plot_settings["variation"] else plot_info["unit"]
+            )
+            # time window might be needed fort he vs time function
+            plot_info["time_window"] = plot_settings["time_window"]
+            # [optional] number of pixel columns to decimate lines to in the vs time function
+            plot_info["pixels"] = plot_settings.get("pixels")
+            # mean in time windows for the vs time style: all channels at once, each channel then picks its own
+            if (
+                plot_info["plot_style"] == "vs time"
+                and plot_info["parameter"] != "event_rate"
+            ):
+                # already aggregated in time windows in streaming mode: not binned again
+                plot_info["resampled"] = getattr(data_analysis, "resampled", None)
+                plot_info["aggregated"] = plot_info["resampled"] is not None
+                if time_pyramid is not None:
+                    # from the coarsest pyramid level fitting the time window (windows aligned to full hours etc.)
+                    plot_info["resampled"] = time_pyramid.read(
+                        plot_info["time_window"],
+                        data_analysis.data["datetime"].min(),
+                        data_analysis.data["datetime"].max(),
+                    )
+                    if (
+                        plot_info["resampled"] is not None
+                        and plot_settings["variation"]
+                    ):
+                        channel_mean = data_analysis.data.groupby("channel")[
+                            plot_info["parameter"] + "_mean"
+                        ].first()
+                        plot_info["resampled"]["mean"] = (
+                            plot_info["resampled"]["mean"]
+                            / channel_mean.reindex(
+                                plot_info["resampled"]["channel"]
+                            ).values
+                            - 1
+                        ) * 100
+                if plot_info["resampled"] is None:
+                    plot_info["resampled"] = binning.bin_in_time(
+                        data_analysis.data["channel"],
+                        data_analysis.data["datetime"],
+                        plot_info["time_window"],
+                        data_analysis.data[plot_info["parameter"]],
+                    )
+
+            # barrel grids for the SiPM structures
+            if plot_settings["plot_structure"] in utils.SIPM_STRUCTURES:
+                plot_info["barrel_layout"] = barrel_layout
+
+            # channel x time window means for the heatmap style: all channels at once, each axis then draws its channels
+            if plot_info["plot_style"] == "heatmap":
+                plot_info["heatmap"] = bin_heatmap(data_analysis.data, plot_info)
+
+            # histogram counts for the histogram style: all channels at once, each channel then draws its own
+            if plot_info["plot_style"] == "histogram":
+                plot_info["variation"] = plot_settings["variation"]
+                # already counted chunk by chunk in streaming mode
+                plot_info["histograms"] = getattr(data_analysis, "histograms", None)
+                if plot_info["histograms"] is None:
+                    plot_info["histograms"] = make_histograms(
+                        data_analysis.data,
+                        param,
+                        plot_settings["variation"],
+                        histograms.get_histogram_path(
+                            histo_dir, subsystem, param, plot_settings["event_type"]
+                        )
+                        if histo_dir
+                        else None,
+                    )
+
+            # -------------------------------------------------------------------------
+            # call chosen plot structure
+            # -------------------------------------------------------------------------
+
+            # choose plot function based on user requested structure e.g. per channel or all ch together
+            plot_structure = PLOT_STRUCTURE[plot_settings["plot_structure"]]
+
+            utils.logger.debug("Plot structure: " + plot_settings["plot_structure"])
+            plot_structure(data_analysis, plot_info, pdf)
 
         # make a special status plot
         # if "status" in subsys.plots[plot] and subsys.plots[plot]['status']:
@@ -114,6 +268,36 @@ def make_subsystem_plots(subsystem: Subsystem, plots: dict, pdf_path: str):
     utils.logger.info("- - - - - - - - - - - - - - - - - - - - - - -")
 
 
+def make_histograms(
+    data: DataFrame, param: str, variation: bool = False, histo_path: str = None
+) -> histograms.ChannelHistograms:
+    """
+    Histogram given parameter for all channels of given AnalysisData.data in one pass.
+
+    Bins are fixed if given in par-settings.json for this parameter (see histograms.get_histo_bins()),
+    otherwise each channel gets its own data range.
+    histo_path: [optional] file of histograms saved between runs; if bins are fixed, this data is added and the file saved
+    """
+    bins = histograms.get_histo_bins(param, variation=variation)
+    fixed = bins is not None
+    if not fixed:
+        by_channel = data.groupby("channel")[param]
+        bins = histograms.get_histo_bins(
+            param, by_channel.min(), by_channel.max(), variation=True
+        )
+
+    histos = histograms.ChannelHistograms.from_values(
+        data["channel"], data[param], bins
+    )
+
+    if histo_path and fixed:
+        histograms.ChannelHistograms.load(histo_path).update(
+            data["channel"], data[param], bins, data["datetime"]
+        ).save(histo_path)
+
+    return histos
+
+
 # -------------------------------------------------------------------------------
 # different plot structure functions, defining figures and subplot layouts
 # -------------------------------------------------------------------------------
@@ -121,97 +305,97 @@ def make_subsystem_plots(subsystem: Subsystem, plots: dict, pdf_path: str):
 # See mapping user plot structure keywords to corresponding functions in the end of this file
 
 
-def plot_per_ch(data_analysis: DataFrame, plot_info: dict, pdf: PdfPages):
-    # --- choose plot function based on user requested style e.g. vs time or histogram
-    plot_style = PLOT_STYLE[plot_info["plot_style"]]
+def plot_per_ch(data_analysis: DataFrame, plot_info: dict, pdf: PageRenderer):
     utils.logger.debug("Plot style: " + plot_info["plot_style"])
     data_analysis.data = data_analysis.data.sort_values(["location", "position"])
 
     # -------------------------------------------------------------------------------
 
-    # separate figure for each string/fiber ("location")
-    for location, data_location in data_analysis.data.groupby("location"):
-        utils.logger.debug(f"... {plot_info['locname']} {location}")
+    # separate figure for each string/fiber ("location"), drawn from the data of this location only
+    # (observed=True: location might be categorical, no need for empty figures of locations not in this selection)
+    for location, data_location in data_analysis.data.groupby(
+        "location", observed=True
+    ):
+        pdf.add_page(
+            plot_location_per_ch,
+            data_location,
+            location,
+            get_channels_plot_info(plot_info, data_location["channel"]),
+            COLORS,
+        )
 
-        # -------------------------------------------------------------------------------
-        # create plot structure: 1 column, N rows with subplot for each channel
-        # -------------------------------------------------------------------------------
-
-        # number of channels in this string/fiber
-        numch = len(data_location["channel"].unique())
-        # create corresponding number of subplots for each channel, set constrained layout to accommodate figure suptitle
-        fig, axes = plt.subplots(
-            nrows=numch,
-            ncols=1,
-            figsize=(10, numch * 3),
-            sharex=True,
-            constrained_layout=True,
-        )  # , sharey=True)
-        # in case of pulser, axes will be not a list but one axis -> convert to list
-        if numch == 1:
-            axes = [axes]
-
-        # -------------------------------------------------------------------------------
-        # plot
-        # -------------------------------------------------------------------------------
-
-        ax_idx = 0
-        # plot one channel on each axis, ordered by position
-        for position, data_channel in data_location.groupby("position"):
-            utils.logger.debug(f"...... position {position}")
-
-            # plot selected style on this axis
-            plot_style(data_channel, fig, axes[ax_idx], plot_info, color=COLORS[ax_idx])
-
-            # --- add summary to axis
-            # name, position and mean are unique for each channel - take first value
-            t = data_channel.iloc[0][
-                ["channel", "position", "name", plot_info["parameter"] + "_mean"]
-            ]
-            text = (
-                t["name"]
-                + "\n"
-                + f"channel {t['channel']}\n"
-                + f"position {t['position']}\n"
-                + f"mean {round(t[plot_info['parameter']+'_mean'],3)} [{plot_info['unit']}]"
-            )
-            axes[ax_idx].text(1.01, 0.5, text, transform=axes[ax_idx].transAxes)
 
-            # add grid
-            axes[ax_idx].grid("major", linestyle="--")
-            # remove automatic y label since there will be a shared one
-            axes[ax_idx].set_ylabel("")
+def plot_location_per_ch(
+    data_location: DataFrame, location, plot_info: dict, colors: list
+) -> Figure:
+    """Figure of given string/fiber ("location") with one subplot for each channel, see plot_per_ch()."""
+    # --- choose plot function based on user requested style e.g. vs time or histogram
+    plot_style = PLOT_STYLE[plot_info["plot_style"]]
+    utils.logger.debug(f"... {plot_info['locname']} {location}")
 
-            ax_idx += 1
+    # -------------------------------------------------------------------------------
+    # create plot structure: 1 column, N rows with subplot for each channel
+    # -------------------------------------------------------------------------------
 
-        # -------------------------------------------------------------------------------
+    # number of channels in this string/fiber
+    numch = len(data_location["channel"].unique())
+    # create corresponding number of subplots for each channel, set constrained layout to accommodate figure suptitle
+    fig, axes = plt.subplots(
+        nrows=numch,
+        ncols=1,
+        figsize=(10, numch * 3),
+        sharex=True,
+        constrained_layout=True,
+    )  # , sharey=True)
+    # in case of pulser, axes will be not a list but one axis -> convert to list
+    if numch == 1:
+        axes = [axes]
 
-        fig.suptitle(f"{plot_info['subsystem']} - {plot_info['title']}")
-        axes[0].set_title(f"{plot_info['locname']} {location}")
+    # -------------------------------------------------------------------------------
+    # plot
+    # -------------------------------------------------------------------------------
 
-        plt.savefig(pdf, format="pdf")
-        # figures are retained until explicitly closed; close to not consume too much memory
-        plt.close()
+    ax_idx = 0
+    # plot one channel on each axis, ordered by position
+    for position, data_channel in data_location.groupby("position", observed=True):
+        utils.logger.debug(f"...... position {position}")
+
+        # plot selected style on this axis
+        plot_style(data_channel, fig, axes[ax_idx], plot_info, color=colors[ax_idx])
+
+        # --- add summary to axis
+        # name, position and mean are unique for each channel - take first value
+        t = data_channel.iloc[0][
+            ["channel", "position", "name", plot_info["parameter"] + "_mean"]
+        ]
+        text = (
+            t["name"]
+            + "\n"
+            + f"channel {t['channel']}\n"
+            + f"position {t['position']}\n"
+            + f"mean {round(t[plot_info['parameter']+'_mean'],3)} [{plot_info['unit']}]"
+        )
+        axes[ax_idx].text(1.01, 0.5, text, transform=axes[ax_idx].transAxes)
+
+        # add grid
+        axes[ax_idx].grid("major", linestyle="--")
+        # remove automatic y label since there will be a shared one
+        axes[ax_idx].set_ylabel("")
+
+        ax_idx += 1
+
+    # -------------------------------------------------------------------------------
+
+    fig.suptitle(f"{plot_info['subsystem']} - {plot_info['title']}")
+    axes[0].set_title(f"{plot_info['locname']} {location}")
+
+    return fig
 
 
 # technically per location
-def plot_per_string(data_analysis: DataFrame, plot_info: dict, pdf: PdfPages):
-    # --- choose plot function based on user requested style e.g. vs time or histogram
-    plot_style = PLOT_STYLE[plot_info["plot_style"]]
+def plot_per_string(data_analysis: DataFrame, plot_info: dict, pdf: PageRenderer):
     utils.logger.debug("Plot style: " + plot_info["plot_style"])
 
-    # --- create plot structure
-    # number of strings/fibers
-    no_location = len(data_analysis.data["location"].unique())
-    # set constrained layout to accommodate figure suptitle
-    fig, axes = plt.subplots(
-        no_location,
-        figsize=(10, no_location * 3),
-        sharex=True,
-        sharey=True,
-        constrained_layout=True,
-    )
-
     # -------------------------------------------------------------------------------
     # create label of format hardcoded for geds sXX-pX-chXXX-name
     # -------------------------------------------------------------------------------
@@ -222,30 +406,59 @@ def plot_per_string(data_analysis: DataFrame, plot_info: dict, pdf: PdfPages):
         lambda x: f"p{x[0]}-ch{str(x[1]).zfill(3)}-{x[2]}", axis=1
     )
     # put it in the table
-    data_analysis.data = data_analysis.data.set_index("channel")
-    data_analysis.data["label"] = labels["label"]
-    data_analysis.data = data_analysis.data.sort_values("label")
+    channels.ChannelLookup(labels).attach(data_analysis.data, ["label"])
+    data_analysis.data = data_analysis.data.sort_values(["location", "label"])
+
+    # one figure for all strings/fibers
+    pdf.add_page(plot_all_per_string, data_analysis.data, plot_info, COLORS)
+
+
+def plot_all_per_string(data: DataFrame, plot_info: dict, colors: list) -> Figure:
+    """Figure with one subplot for each string/fiber ("location") with all its channels, see plot_per_string()."""
+    # --- choose plot function based on user requested style e.g. vs time or histogram
+    plot_style = PLOT_STYLE[plot_info["plot_style"]]
+
+    # --- create plot structure
+    # number of strings/fibers
+    no_location = len(data["location"].unique())
+    # set constrained layout to accommodate figure suptitle
+    # (no shared y axis for styles with one row per channel, e.g. heatmap)
+    fig, axes = plt.subplots(
+        no_location,
+        figsize=(10, no_location * 3),
+        sharex=True,
+        sharey=plot_info["plot_style"] not in AXIS_STYLES,
+        constrained_layout=True,
+        squeeze=False,
+    )
+    axes = axes[:, 0]
 
     # -------------------------------------------------------------------------------
     # plot
     # -------------------------------------------------------------------------------
 
-    data_analysis.data = data_analysis.data.sort_values(["location", "label"])
     # new subplot for each string
     ax_idx = 0
-    for location, data_location in data_analysis.data.groupby("location"):
+    for location, data_location in data.groupby("location", observed=True):
         utils.logger.debug(f"... {plot_info['locname']} {location}")
 
+        axes[ax_idx].set_title(f"{plot_info['locname']} {location}")
+        axes[ax_idx].set_ylabel("")
+
+        # all channels of the string at once
+        if plot_info["plot_style"] in AXIS_STYLES:
+            plot_style(data_location, fig, axes[ax_idx], plot_info)
+            ax_idx += 1
+            continue
+
         # new color for each channel
         col_idx = 0
         labels = []
         for label, data_channel in data_location.groupby("label"):
-            plot_style(data_channel, fig, axes[ax_idx], plot_info, COLORS[col_idx])
+            plot_style(data_channel, fig, axes[ax_idx], plot_info, colors[col_idx])
             labels.append(label)
             col_idx += 1
 
-        axes[ax_idx].set_title(f"{plot_info['locname']} {location}")
-        axes[ax_idx].set_ylabel("")
         axes[ax_idx].legend(labels=labels, loc="center left", bbox_to_anchor=(1, 0.5))
         ax_idx += 1
 
@@ -253,9 +466,31 @@ def plot_per_string(data_analysis: DataFrame, plot_info: dict, pdf: PdfPages):
 
     fig.suptitle(f"{plot_info['subsystem']} - {plot_info['title']}")
     # fig.supylabel(f'{plotdata.param.label} [{plotdata.param.unit_label}]') # --> plot style
-    plt.savefig(pdf, format="pdf")
-    # figures are retained until explicitly closed; close to not consume too much memory
-    plt.close()
+    return fig
+
+
+def get_channels_plot_info(plot_info: dict, channel) -> dict:
+    """
+    Return plot info with the tables prepared for all channels (time window means, heatmap, histograms) cut to given channels.
+
+    Keeps what is sent to a rendering worker (see rendering.PageRenderer) down to the data of its page.
+    """
+    channel = channel.unique()
+    plot_info = plot_info.copy()
+    if plot_info.get("resampled") is not None:
+        resampled = plot_info["resampled"]
+        plot_info["resampled"] = resampled[resampled["channel"].isin(channel)]
+    if plot_info.get("heatmap") is not None:
+        heatmap = plot_info["heatmap"]
+        plot_info["heatmap"] = heatmap[heatmap["channel"].isin(channel)]
+    if plot_info.get("histograms") is not None:
+        histos = plot_info["histograms"]
+        plot_info["histograms"] = histograms.ChannelHistograms(
+            histos.counts[histos.counts.index.isin(channel)],
+            histos.edges[histos.edges.index.isin(channel)],
+            histos.end,
+        )
+    return plot_info
 
 
 # -------------------------------------------------------------------------------
@@ -263,28 +498,206 @@ def plot_per_string(data_analysis: DataFrame, plot_info: dict, pdf: PdfPages):
 # -------------------------------------------------------------------------------
 
 
-def plot_per_barrel(data_analysis: DataFrame, plot_info: dict, pdf: PdfPages):
-    # here will be a function plotting SiPMs with:
-    # - one figure for top and one for bottom SiPMs
-    # - each figure has subplots with N columns and M rows where N is the number of fibers, and M is the number of positions (top/bottom -> 2)
-    # this function will only work for SiPMs requiring a columns 'barrel' in the channel map
-    # add a check in config settings check to make sure geds are not called with this structure to avoid crash
-    pass
+def plot_per_barrel(data_analysis: DataFrame, plot_info: dict, pdf: PageRenderer):
+    """
+    One figure for each SiPM barrel, with a fixed grid of subplots: one row per position (top/bottom), one column per fiber.
+
+    Styles drawing all channels of an axis at once (e.g. heatmap) get one subplot per position with all its fibers.
+    Only for SiPMs: needs the barrel of each channel, see get_barrel_layout().
+    """
+    plot_barrels(data_analysis, plot_info, pdf, by_position=False)
 
 
 def plot_per_barrel_and_position(
-    data_analysis: DataFrame, plot_info: dict, pdf: PdfPages
+    data_analysis: DataFrame, plot_info: dict, pdf: PageRenderer
 ):
-    # here will be a function plotting SiPMs with:
-    # - one figure for each barrel-position combination (IB-top, IB-bottom, OB-top, OB-bottom; pr IB-top, OB-top, IB-bottom, OB-bottom)
-    # - subplots for each fiber
-    pass
+    """
+    One figure for each SiPM barrel and position (IB-top, IB-bottom, OB-top, OB-bottom),
+    with a fixed grid of subplots, one for each fiber (FIBER_COLUMNS per row).
+
+    Styles drawing all channels of an axis at once (e.g. heatmap) get one subplot with all fibers.
+    Only for SiPMs: needs the barrel of each channel, see get_barrel_layout().
+    """
+    plot_barrels(data_analysis, plot_info, pdf, by_position=True)
+
+
+def plot_barrels(
+    data_analysis: DataFrame, plot_info: dict, pdf: PageRenderer, by_position: bool
+):
+    """Add pages of the SiPM barrel structures, see plot_per_barrel() and plot_per_barrel_and_position()."""
+    utils.logger.debug("Plot style: " + plot_info["plot_style"])
+
+    # place of each channel in the grids, from the channel map (see make_subsystem_plots())
+    plot_info = plot_info.copy()
+    layout = plot_info.pop("barrel_layout", None)
+    if layout is None:
+        utils.logger.error(
+            "Plot structures 'per barrel' and 'top bottom' need the barrel of each channel, only available for spms!"
+        )
+        return
+
+    # -------------------------------------------------------------------------------
+    # grid cell of each channel on its page
+    # -------------------------------------------------------------------------------
+
+    layout = layout.copy()
+    if by_position:
+        layout["page"] = layout.groupby(
+            ["barrel", "position_index"], sort=False
+        ).ngroup()
+        layout["row"], layout["column"] = divmod(layout["fiber_index"], FIBER_COLUMNS)
+    else:
+        layout["page"] = layout.groupby("barrel", sort=False).ngroup()
+        layout["row"] = layout["position_index"]
+        layout["column"] = layout["fiber_index"]
+    if plot_info["plot_style"] in AXIS_STYLES:
+        # one axis with all fibers of each position
+        layout["row"] = 0 if by_position else layout["position_index"]
+        layout["column"] = 0
+
+    # -------------------------------------------------------------------------------
+    # one page per barrel (and position)
+    # -------------------------------------------------------------------------------
+
+    # events in the order of the layout (stable: still in time order within each channel), grouped by page in one go
+    lookup = channels.ChannelLookup(layout)
+    rows = lookup.get_rows(data_analysis.data["channel"])
+    data = data_analysis.data.iloc[np.argsort(rows, kind="stable")]
+    pages = lookup.map(data["channel"], "page")
+
+    for page, data_page in data.groupby(pages.to_numpy()):
+        cells = layout[layout["page"] == page]
+        first = cells.iloc[0]
+        title = (
+            f"{first['barrel']} {first['position']}"
+            if by_position
+            else f"{first['barrel']}"
+        )
+        pdf.add_page(
+            plot_barrel,
+            data_page,
+            title,
+            cells.drop(columns="page"),
+            get_channels_plot_info(plot_info, data_page["channel"]),
+            COLORS,
+        )
+
+
+def plot_barrel(
+    data_page: DataFrame, title: str, cells: DataFrame, plot_info: dict, colors: list
+) -> Figure:
+    """Figure with a fixed grid of subplots of given cells (layout of the channels of this page), see plot_barrels()."""
+    # --- choose plot function based on user requested style e.g. vs time or histogram
+    plot_style = PLOT_STYLE[plot_info["plot_style"]]
+    axis_style = plot_info["plot_style"] in AXIS_STYLES
+    utils.logger.debug(f"... barrel {title}")
+
+    # -------------------------------------------------------------------------------
+    # create plot structure: same grid for all styles of this layout, shared axes
+    # -------------------------------------------------------------------------------
+
+    nrows = cells["row"].max() + 1
+    ncols = cells["column"].max() + 1
+    fig, axes = plt.subplots(
+        nrows=nrows,
+        ncols=ncols,
+        figsize=(10 if axis_style else max(10, 3 * ncols), 3 * nrows),
+        sharex=True,
+        sharey=not axis_style,
+        constrained_layout=True,
+        squeeze=False,
+    )
+
+    # -------------------------------------------------------------------------------
+    # plot
+    # -------------------------------------------------------------------------------
+
+    lookup = channels.ChannelLookup(cells)
+    places = [
+        np.asarray(lookup.map(data_page["channel"], column), dtype=int)
+        for column in ["row", "column"]
+    ]
+    for (row, column), data_cell in data_page.groupby(places, sort=False):
+        ax = axes[row, column]
+        if axis_style:
+            # all fibers of this position at once
+            plot_style(data_cell, fig, ax, plot_info)
+            continue
+        for channel, data_channel in data_cell.groupby("channel", sort=False):
+            # one color per position
+            color = colors[cells.loc[channel, "position_index"] % len(colors)]
+            plot_style(data_channel, fig, ax, plot_info, color=color)
+
+    # -------------------------------------------------------------------------------
+    # beautification
+    # -------------------------------------------------------------------------------
+
+    # few ticks in narrow subplots (shared x axis -> same locator for all)
+    if ncols > 1:
+        axes[0, 0].xaxis.set_major_locator(MaxNLocator(3))
+
+    used = np.zeros((nrows, ncols), dtype=bool)
+    for (row, column), cell in cells.groupby(["row", "column"]):
+        used[row, column] = True
+        ax = axes[row, column]
+        if axis_style:
+            ax.set_title(f"{cell['barrel'].iloc[0]} {cell['position'].iloc[0]}")
+        else:
+            ax.set_title(
+                f"{cell['fiber'].iloc[0]} {cell['position'].iloc[0]}\n"
+                + ", ".join(cell["name"].astype(str)),
+                fontsize=9,
+            )
+        ax.grid("major", linestyle="--")
+        # remove automatic y label since there will be a shared one
+        ax.set_ylabel("")
+    # grid places without channel in this layout (e.g. last row of fibers not full)
+    for ax in axes[~used]:
+        ax.set_axis_off()
+
+    fig.suptitle(f"{plot_info['subsystem']} - {plot_info['title']} - barrel {title}")
+    return fig
+
+
+def get_barrel_layout(channel_map: DataFrame) -> DataFrame:
+    """
+    Return place of each SiPM channel in the grids of the barrel structures, from given channel map.
+
+    One row per channel (indexed by channel) with name, barrel, fiber, position,
+    position_index (top 0, bottom 1, others after) and fiber_index (number of the fiber in its barrel, in order of name),
+    in order of barrel, position and fiber.
+    Calculated once for all plots of a subsystem; None if the channel map has no barrel (not spms).
+    """
+    if "barrel" not in channel_map or channel_map["barrel"].isna().all():
+        return
+
+    layout = channel_map[channel_map["barrel"].notna()]
+    layout = layout[["channel", "name", "barrel", "location", "position"]].rename(
+        columns={"location": "fiber"}
+    )
+
+    # top before bottom, any other position after them
+    positions = sorted(
+        layout["position"].unique(),
+        key=lambda position: (position != "top", position != "bottom", str(position)),
+    )
+    layout["position_index"] = layout["position"].map(
+        {position: idx for idx, position in enumerate(positions)}
+    )
+    layout["fiber_index"] = (
+        layout.groupby("barrel")["fiber"].rank(method="dense").astype(int) - 1
+    )
+
+    return layout.sort_values(["barrel", "position_index", "fiber_index"]).set_index(
+        "channel"
+    )
 
 
 # -------------------------------------------------------------------------------
 # mapping user keywords to plot style functions
 # -------------------------------------------------------------------------------
 
+# when adding a structure, add its name to utils.PLOT_STRUCTURES too
 PLOT_STRUCTURE = {
     "per channel": plot_per_ch,
     "per string": plot_per_string,
@@ -0,0 +1,356 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from . import analysis_data, binning, stats, utils
+
+# resolutions of the pyramid levels, from finest to coarsest
+LEVELS = ["1T", "10T", "1H", "1D"]
+
+# all time windows of the pyramid are aligned to this
+EPOCH = pd.Timestamp(0, tz="UTC")
+
+# -------------------------------------------------------------------------
+
+
+class TimePyramid:
+    """
+    Per-channel aggregates of one parameter (of one event type) in fixed time windows, at several resolutions, saved on disk.
+
+    For each level of LEVELS, the pyramid keeps count, mean, M2, min and max of the parameter (see stats.reduce_stats())
+    for each channel and time window; windows are aligned to EPOCH, so that data of different runs falls into the same windows.
+    For the event rate, only counts are kept.
+    Long-range trends can then be plotted from the coarsest level fitting the requested time window (see read()),
+    without going back to the raw data.
+
+    Like stats.ChannelStats, the pyramid keeps the time range of the events included,
+    and an update only adds events later than the ones already included.
+
+    path [str]: directory of the pyramid, one Feather file per level and pyramid.json with the time range
+
+    >>> pyramid = TimePyramid('pyramids/l200-v01.06-phy-geds-baseline-pulser')
+    >>> pyramid.update(data['channel'], data['datetime'], data['baseline'])
+    >>> pyramid.save()
+    >>> means = pyramid.read('1H', start, end)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # {level: table indexed by (channel, window), columns count, mean, m2, min, max}, read when needed
+        self.levels = {}
+
+        # time range of the events included
+        self.start = self.end = None
+        meta_path = os.path.join(self.path, "pyramid.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            self.start, self.end = pd.Timestamp(meta["start"]), pd.Timestamp(
+                meta["end"]
+            )
+
+    def level_path(self, level: str) -> str:
+        return os.path.join(self.path, f"{level}.feather")
+
+    def get_level(self, level: str) -> pd.DataFrame:
+        """Return table of given level, empty if nothing was saved yet."""
+        if level not in self.levels:
+            if os.path.exists(self.level_path(level)):
+                table = pd.read_feather(self.level_path(level))
+            else:
+                table = pd.DataFrame(
+                    columns=["channel", "window"] + stats.ChannelStats.COLUMNS
+                )
+            self.levels[level] = table.set_index(["channel", "window"])
+        return self.levels[level]
+
+    # -------------------------------------------------------------------------
+    # updating
+    # -------------------------------------------------------------------------
+
+    def update(self, channel, time, values=None):
+        """
+        Add events with given channels, times, and parameter values (None for the event rate) to the levels in memory.
+
+        Only events later than the ones already included are added (see stats.get_later_events()).
+        Nothing is written to disk: when updating chunk by chunk, call save() once after the last chunk.
+        """
+        channel = np.asarray(channel)
+        time = pd.Series(pd.DatetimeIndex(time))
+        if self.end is not None:
+            later = stats.get_later_events(time, self.end, f"pyramid {self.path}")
+            channel, time = channel[later], time[later]
+            values = None if values is None else np.asarray(values)[later]
+        if not len(channel):
+            return
+
+        origin = pd.Series(EPOCH, index=np.unique(channel))
+        for level in LEVELS:
+            bins = binning.bin_in_time(channel, time, level, values, origin=origin)
+            bins = bins[bins["count"] > 0]
+            if values is None:
+                bins = bins.assign(std=np.nan, mean=np.nan, min=np.nan, max=np.nan)
+            new = pd.DataFrame(
+                {
+                    "count": bins["count"].to_numpy(),
+                    "mean": bins["mean"].to_numpy(),
+                    # M2 from sample standard deviation, 0 for a single value
+                    "m2": np.nan_to_num(bins["std"].to_numpy() ** 2)
+                    * (bins["count"].to_numpy() - 1),
+                    "min": bins["min"].to_numpy(),
+                    "max": bins["max"].to_numpy(),
+                },
+                index=pd.MultiIndex.from_arrays(
+                    [bins["channel"].to_numpy(), bins["window"].to_numpy()],
+                    names=["channel", "window"],
+                ),
+            )
+            # nothing saved yet: empty table left out, concatenating it is deprecated in pandas
+            table = self.get_level(level)
+            table = pd.concat([table, new]) if len(table) else new
+            self.levels[level] = stats.reduce_stats(table, table.index)
+
+        self.start = time.min() if self.start is None else min(self.start, time.min())
+        self.end = time.max() if self.end is None else max(self.end, time.max())
+
+    def save(self):
+        """Write the levels read or updated so far, and the time range, to disk; nothing if the pyramid is empty."""
+        if self.end is None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        # write to temporary files first, another process might be reading them
+        for level, table in self.levels.items():
+            tmp_path = f"{self.level_path(level)}.{os.getpid()}.tmp"
+            table.reset_index().to_feather(tmp_path)
+            os.replace(tmp_path, self.level_path(level))
+        meta_path = os.path.join(self.path, "pyramid.json")
+        with open(f"{meta_path}.{os.getpid()}.tmp", "w") as f:
+            json.dump({"start": self.start.isoformat(), "end": self.end.isoformat()}, f)
+        os.replace(f"{meta_path}.{os.getpid()}.tmp", meta_path)
+
+    # -------------------------------------------------------------------------
+    # reading
+    # -------------------------------------------------------------------------
+
+    def read(self, time_window: str, start=None, end=None) -> pd.DataFrame:
+        """
+        Return aggregates in given time windows for all channels, from the coarsest level fitting the time window.
+
+        time_window: format as for DataFrame.resample() e.g. '1H'; should be a multiple of the finest level (LEVELS)
+        start, end: [optional] time range (Timestamps), by default all the time range in the pyramid
+
+        Windows are aligned to EPOCH (e.g. full hours), not to the first event like DataFrame.resample(origin='start').
+        Level windows overlapping the range edges are taken as a whole.
+        Returns DataFrame with one row per channel and time window with events, in the format of binning.bin_in_time():
+        columns channel, start and duration (of the part of the window within the time range), count, mean, std, min, max.
+        None if no level fits the time window or the pyramid is empty.
+        """
+        level = choose_level(time_window)
+        if level is None:
+            utils.logger.warning(
+                f"Time window {time_window} is not a multiple of any pyramid level {LEVELS}!"
+            )
+            return
+        if self.start is None:
+            return
+
+        dt = pd.Timedelta(time_window).value
+        level_dt = pd.Timedelta(level).value
+        start = max(self.start, to_utc(start) if start else self.start).value
+        end = min(self.end, to_utc(end) if end else self.end).value
+
+        table = self.get_level(level)
+        window_start = table.index.get_level_values("window").to_numpy() * level_dt
+        table = table[(window_start + level_dt > start) & (window_start <= end)]
+        window_start = table.index.get_level_values("window").to_numpy() * level_dt
+
+        # combine level windows into requested time windows
+        windows = stats.reduce_stats(
+            table,
+            pd.MultiIndex.from_arrays(
+                [table.index.get_level_values("channel"), window_start // dt],
+                names=["channel", "window"],
+            ),
+        )
+
+        # part of each time window that is within the time range
+        first = np.maximum(windows.index.get_level_values("window") * dt, start)
+        last = np.minimum((windows.index.get_level_values("window") + 1) * dt, end)
+        result = pd.DataFrame(
+            {
+                "channel": windows.index.get_level_values("channel"),
+                "start": pd.to_datetime(first, utc=True),
+                "duration": pd.to_timedelta(last - first),
+                "count": windows["count"].to_numpy(),
+                "mean": windows["mean"].to_numpy(),
+                "std": np.sqrt(
+                    windows["m2"] / (windows["count"] - 1).where(windows["count"] > 1)
+                ).to_numpy(),
+                "min": windows["min"].to_numpy(),
+                "max": windows["max"].to_numpy(),
+            }
+        )
+        return result
+
+    def channel_stats(self, start=None, end=None) -> stats.ChannelStats:
+        """
+        Return statistics of each channel in given time range (default: all).
+
+        Taken from the finest level if a time range is given (level windows overlapping the range edges as a whole),
+        otherwise from the coarsest one.
+        """
+        level = LEVELS[-1] if start is None and end is None else LEVELS[0]
+        table = self.get_level(level)
+        level_dt = pd.Timedelta(level).value
+        window_start = table.index.get_level_values("window").to_numpy() * level_dt
+        selected = np.full(len(table), True)
+        if start is not None:
+            selected &= window_start + level_dt > to_utc(start).value
+        if end is not None:
+            selected &= window_start <= to_utc(end).value
+        table = table[selected]
+        return stats.ChannelStats(
+            stats.reduce_stats(table, table.index.get_level_values("channel")),
+            self.end,
+        )
+
+
+# -------------------------------------------------------------------------
+
+
+class PyramidData:
+    """
+    Data of a vs time plot read from a saved TimePyramid instead of the raw data.
+
+    Like streaming.PlotAggregates, self.data has the same format as AnalysisData.data,
+    with one row per channel and time window instead of one row per event,
+    and self.resampled has the same windows in the format of binning.bin_in_time(), not to be binned again when plotting.
+    Empty if the pyramid has no data in the time range (the plot is then skipped).
+
+    plot_settings [dict]: settings of this plot from the config (single parameter, with time window)
+    channel_map [DataFrame]: channel map of the subsystem
+    path [str]: directory of the pyramid
+    start, end: [optional] time range to plot
+    """
+
+    def __init__(
+        self,
+        plot_settings: dict,
+        channel_map: pd.DataFrame,
+        path: str,
+        start=None,
+        end=None,
+    ):
+        param = plot_settings["parameters"]
+        self.parameters = [param]
+        self.evt_type = plot_settings["event_type"]
+        self.variation = plot_settings.get("variation", False)
+        self.time_window = plot_settings["time_window"]
+
+        self.resampled = None
+
+        pyramid = TimePyramid(path)
+        windows = pyramid.read(self.time_window, start, end)
+        if windows is None or windows.empty:
+            utils.logger.warning(f"Nothing to plot from the pyramid in {path}!")
+            self.data = pd.DataFrame(
+                columns=["channel", "datetime", param, param + "_mean"]
+                + ["name", "location", "position", "status"]
+            )
+            return
+
+        data = pd.DataFrame(
+            {
+                "channel": windows["channel"],
+                "datetime": windows["start"] + windows["duration"] / 2,
+            }
+        )
+        if param == "event_rate":
+            seconds = windows["duration"].dt.total_seconds()
+            data[param] = windows["count"] / seconds.where(seconds > 0)
+            # same as AnalysisData: mean of the event rate in time windows
+            channel_mean = data.groupby("channel")[param].mean()
+        else:
+            data[param] = windows["mean"]
+            channel_mean = pyramid.channel_stats(start, end).mean
+        data[param + "_mean"] = channel_mean.reindex(data["channel"]).values
+
+        if self.variation and param != "event_rate":
+            data[param] = (data[param] / data[param + "_mean"] - 1) * 100  # %
+        if param != "event_rate":
+            self.resampled = windows.assign(mean=data[param].to_numpy())
+
+        # add channel map info
+        self.data = data.merge(
+            channel_map[["channel", "name", "location", "position", "status"]],
+            on="channel",
+            how="left",
+        )
+
+
+# -------------------------------------------------------------------------
+# helper functions
+# -------------------------------------------------------------------------
+
+
+def update_pyramid(
+    path: str, sub_data: pd.DataFrame, context, plot_settings: dict
+) -> TimePyramid:
+    """
+    Update the pyramid of the parameter and event type of given plot with the events of given subsystem data, and save it.
+
+    context: analysis_data.AnalysisContext of the subsystem data
+
+    Returns the updated TimePyramid.
+    """
+    param = plot_settings["parameters"]
+    if param == "event_rate":
+        events = context.get_data(plot_settings["event_type"], ["channel", "datetime"])
+        values = None
+    else:
+        # absolute values, variation is calculated from the means when reading
+        events = analysis_data.AnalysisData(
+            sub_data, context, parameters=param, event_type=plot_settings["event_type"]
+        ).data
+        values = events[param]
+
+    pyramid = TimePyramid(path)
+    pyramid.update(events["channel"], events["datetime"], values)
+    pyramid.save()
+    return pyramid
+
+
+def choose_level(time_window: str):
+    """
+    Return the coarsest level of LEVELS that still fits given time window (the time window is a multiple of it).
+
+    None if the time window is shorter than the finest level or not a multiple of it.
+
+    >>> choose_level('30T')
+    '10T'
+    >>> choose_level('45T')
+    '1T'
+    """
+    dt = pd.Timedelta(time_window)
+    fitting = [level for level in LEVELS if dt % pd.Timedelta(level) == pd.Timedelta(0)]
+    return fitting[-1] if fitting else None
+
+
+def to_utc(time) -> pd.Timestamp:
+    """Convert to Timestamp in UTC; times without time zone are taken as UTC."""
+    time = pd.Timestamp(time)
+    return time.tz_localize("UTC") if time.tz is None else time.tz_convert("UTC")
+
+
+def get_pyramid_path(pyramid_dir: str, subsystem, parameter: str, evt_type: str) -> str:
+    """
+    Return directory of the pyramid of given parameter and event type for given Subsystem.
+
+    Format: <pyramid_dir>/<experiment>-<version>-<data type>-<subsystem>-<parameter>-<event type>
+    """
+    return os.path.join(
+        pyramid_dir,
+        f"{subsystem.experiment}-{subsystem.version}-{subsystem.datatype}-{subsystem.type}-{parameter}-{evt_type}",
+    )
@@ -0,0 +1,241 @@
+import hashlib
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from io import BytesIO
+
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_pdf import PdfPages
+from pypdf import PdfReader, PdfWriter
+
+from . import __version__, utils
+
+# increase when plot structures or styles change in a way the package version does not show (e.g. editable installs),
+# so that pages in render caches are drawn again
+STYLE_VERSION = 1
+
+# -------------------------------------------------------------------------
+
+
+class PageRenderer:
+    """
+    Pages of one PDF file, each drawn by a function returning a matplotlib Figure, kept in the order they are added.
+
+    Without workers, each figure is drawn and saved to the PDF right away (same as plt.savefig(PdfPages)).
+    With workers, figures are drawn and saved as one-page PDFs in a process pool,
+    and the pages are merged into the PDF file in their original order when closing.
+    Each page function then only gets the data it needs (e.g. one string), which is sent to its worker,
+    so the page functions and their arguments must be picklable (functions defined at module level).
+    With a render cache, pages drawn from the same function and arguments in an earlier run are taken from the cache
+    instead of being drawn again.
+
+    pdf_path [str]: path of the PDF file
+    workers [int]: [optional] number of worker processes to render pages in; serial if None or 1
+    cache [RenderCache]: [optional] cache of pages rendered in earlier runs
+
+    >>> pdf = PageRenderer('geds.pdf', workers=8)
+    >>> for location, data_location in data.groupby('location'):
+    >>>     pdf.add_page(plot_location, data_location, plot_info)
+    >>> pdf.close()
+    """
+
+    def __init__(self, pdf_path: str, workers: int = None, cache: "RenderCache" = None):
+        self.pdf_path = pdf_path
+        self.cache = cache
+        self.executor = None
+        self.pdf = None
+        # (cache key, rendered page or its future), in order
+        self.pages = []
+        self.cached = 0
+
+        if workers and workers > 1:
+            utils.logger.info(f"... rendering pages with {workers} workers")
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        elif cache is None:
+            self.pdf = PdfPages(pdf_path)
+
+    def add_page(self, function, *args):
+        """Add page with the figure returned by function(*args)."""
+        key = None
+        if self.cache is not None:
+            key = self.cache.get_key(function, *args)
+            page = self.cache.read(key)
+            if page is not None:
+                self.pages.append((None, page))
+                self.cached += 1
+                return
+
+        if self.pdf is not None:
+            fig = function(*args)
+            self.pdf.savefig(fig)
+            # figures are retained until explicitly closed; close to not consume too much memory
+            plt.close(fig)
+        elif self.executor is not None:
+            self.pages.append((key, self.executor.submit(render_page, function, *args)))
+        else:
+            self.pages.append((key, render_page(function, *args)))
+
+    def close(self):
+        """Write all pages to the PDF file."""
+        if self.pdf is not None:
+            self.pdf.close()
+            return
+
+        writer = PdfWriter()
+        for key, page in self.pages:
+            if isinstance(page, Future):
+                page = page.result()
+            # key only for pages not taken from the cache
+            if key is not None:
+                self.cache.write(key, page)
+            writer.append(PdfReader(BytesIO(page)))
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.cache is not None:
+            utils.logger.info(
+                f"... {self.cached} of {len(self.pages)} pages taken from render cache"
+            )
+            self.cache.evict()
+
+        # write to temporary file first, another process might be reading it
+        tmp_path = f"{self.pdf_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            writer.write(f)
+        os.replace(tmp_path, self.pdf_path)
+
+
+def render_page(function, *args) -> bytes:
+    """Draw the figure returned by function(*args) and return it as a one-page PDF."""
+    fig = function(*args)
+    buffer = BytesIO()
+    fig.savefig(buffer, format="pdf")
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+# -------------------------------------------------------------------------
+# cache of rendered pages
+# -------------------------------------------------------------------------
+
+
+class RenderCache:
+    """
+    Content-addressed on-disk cache of rendered plot pages, stored as one-page PDF files.
+
+    A page is keyed by a hash of everything it is drawn from: the page function, its arguments
+    (data slice of the page, plot info, colors; see update_hash()), and the versions of this package,
+    of matplotlib and STYLE_VERSION.
+    A later run with the same data and plot settings for a page (e.g. a string whose data did not change,
+    or plots not touched by a config change) gets the page from the cache instead of drawing it again.
+    The last access of a page is the modification time of its file, which is updated when it is read;
+    least recently used pages are removed beyond the maximum size.
+
+    path [str]: cache directory, will be created if it does not exist
+    max_size [float]: maximum size of the cache in GB. Default: 1
+
+    In the config, given as e.g.
+        "render_cache": {"path": "/path/to/render_cache", "max_size": 2}
+    """
+
+    def __init__(self, path: str, max_size: float = 1):
+        self.path = path
+        self.max_size = max_size * 1024**3
+        os.makedirs(self.path, exist_ok=True)
+
+    def get_key(self, function, *args) -> str:
+        """Return key of the page drawn by function(*args)."""
+        hasher = hashlib.sha1()
+        update_hash(
+            hasher, [__version__, matplotlib.__version__, STYLE_VERSION, function]
+        )
+        update_hash(hasher, args)
+        return hasher.hexdigest()
+
+    def page_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key + ".pdf")
+
+    def read(self, key: str):
+        """Return page with given key as bytes, None if it is not in the cache."""
+        page_path = self.page_path(key)
+        try:
+            with open(page_path, "rb") as f:
+                page = f.read()
+        except FileNotFoundError:
+            return
+        os.utime(page_path)
+        return page
+
+    def write(self, key: str, page: bytes):
+        """Store given page (bytes of a one-page PDF) with given key."""
+        # write to temporary file first, another process might be reading the same page
+        page_path = self.page_path(key)
+        os.makedirs(os.path.dirname(page_path), exist_ok=True)
+        tmp_path = f"{page_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(page)
+        os.replace(tmp_path, page_path)
+
+    def evict(self):
+        """Remove least recently used pages until the cache is below its maximum size."""
+        pages = []
+        for directory in os.scandir(self.path):
+            if directory.is_dir():
+                pages += [
+                    entry
+                    for entry in os.scandir(directory)
+                    if entry.name.endswith(".pdf")
+                ]
+        pages.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+
+        sizes = np.cumsum([entry.stat().st_size for entry in pages])
+        to_remove = [entry for entry, size in zip(pages, sizes) if size > self.max_size]
+        if not to_remove:
+            return
+
+        utils.logger.info(
+            f"...... removing {len(to_remove)} old pages from render cache"
+        )
+        for entry in to_remove:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def update_hash(hasher, obj):
+    """
+    Update given hashlib hasher with the content of given object.
+
+    DataFrame and Series are hashed by values (pd.util.hash_pandas_object), column names and dtypes;
+    their index only if it has a name (e.g. channel), so that the same data slice taken from different rows hashes the same.
+    Containers are hashed item by item, functions by name, objects by their attributes, anything else by repr().
+    """
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        columns = obj.columns if isinstance(obj, pd.DataFrame) else [obj.name]
+        hasher.update(repr(list(columns)).encode())
+        hasher.update(repr(list(np.atleast_1d(obj.dtypes))).encode())
+        hasher.update(
+            pd.util.hash_pandas_object(obj, index=obj.index.name is not None)
+            .to_numpy()
+            .tobytes()
+        )
+    elif isinstance(obj, np.ndarray):
+        hasher.update(repr((obj.dtype, obj.shape)).encode())
+        hasher.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        for key in sorted(obj, key=str):
+            update_hash(hasher, key)
+            update_hash(hasher, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        hasher.update(f"{type(obj).__name__}{len(obj)}".encode())
+        for item in obj:
+            update_hash(hasher, item)
+    elif callable(obj):
+        hasher.update(f"{obj.__module__}.{obj.__qualname__}".encode())
+    elif hasattr(obj, "__dict__"):
+        hasher.update(type(obj).__name__.encode())
+        update_hash(hasher, vars(obj))
+    else:
+        hasher.update(repr(obj).encode())
@@ -1,8 +1,8 @@
 from __future__ import annotations
 
 import argparse
-
-from . import control_plots
+import json
+import sys
 
 
 def main():
@@ -57,9 +57,50 @@ def main():
         "config_file", help="Name of the configuration file you want to use"
     )
 
+    # optional: load and plot subsystems in parallel (overrides config settings)
+    parser.add_argument(
+        "--parallel",
+        action="store_true",
+        default=None,
+        help="Load and plot subsystems in parallel worker processes",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes in parallel mode (default: one per subsystem)",
+    )
+
+    # optional: only check the config, without loading any data
+    parser.add_argument(
+        "--check-config",
+        action="store_true",
+        help="Only check plot settings of the configuration file and exit",
+    )
+
     # load input config file
     args = parser.parse_args()
     user_config = args.config_file
 
+    if args.check_config:
+        check_config(user_config)
+        return
+
+    # heavy imports (pygama, matplotlib, ...) only when we really need them
+    from .core import control_plots
+
     # start loading data & generating plota
-    control_plots.control_plots(user_config)
+    control_plots(user_config, parallel=args.parallel, workers=args.workers)
+
+
+def check_config(user_config_path: str):
+    """Check plot settings in given config file, exit with status 1 if invalid. Imports neither data nor plotting libraries."""
+    from . import utils
+
+    with open(user_config_path) as f:
+        config = json.load(f)
+
+    if not utils.check_plot_settings(config):
+        sys.exit(1)
+
+    utils.logger.info(f"Config {user_config_path} is valid")
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+from . import derived, utils
+
+# -------------------------------------------------------------------------
+# event selections as row predicates
+# -------------------------------------------------------------------------
+
+# Event types are defined in settings/event-types.json, each with (both optional):
+#   - "pulser": true to keep only pulser events, false to keep only non-pulser events
+#   - "cut": expression on (derived) parameters keeping events where it is true, e.g. "(K_lines > 1430) & (K_lines < 1575)"
+# The same selection is applied to analysis data (see get_mask()) and, combined over all plots of a subsystem,
+# to each file chunk during loading (see combine_selections()), so that rows no plot needs are never kept in memory.
+
+
+def get_event_selection(evt_type: str):
+    """Return selection of given event type, None (with an error) if it is invalid."""
+    if evt_type not in utils.EVENT_TYPES:
+        utils.logger.error(
+            f"Invalid event type {evt_type}! Available: {', '.join(utils.EVENT_TYPES)}"
+        )
+        return
+    return utils.EVENT_TYPES[evt_type]
+
+
+def get_cut_parameters(event_types) -> list:
+    """Return parameters used in the cuts of given event types, to be loaded (derived ones included, see derived.resolve())."""
+    parameters = []
+    for evt_type in event_types:
+        cut = utils.EVENT_TYPES.get(evt_type, {}).get("cut")
+        if cut:
+            parameters += derived.get_inputs(cut)
+    return list(dict.fromkeys(parameters))
+
+
+def combine_selections(event_types) -> dict:
+    """
+    Return selection keeping events of any of given event types.
+
+    Pulser flag is kept only if all event types ask for the same one, the cut only if all event types have one
+    (cuts are then joined with 'or'). Empty dict if all events are needed.
+
+    >>> combine_selections(['K_lines', 'phy'])
+    {'pulser': False}
+    """
+    selections = [utils.EVENT_TYPES.get(evt_type, {}) for evt_type in event_types]
+    if not selections:
+        return {}
+
+    combined = {}
+    pulser = {selection.get("pulser") for selection in selections}
+    if len(pulser) == 1 and None not in pulser:
+        combined["pulser"] = pulser.pop()
+    cuts = [selection.get("cut") for selection in selections]
+    if all(cuts):
+        cuts = list(dict.fromkeys(cuts))
+        combined["cut"] = (
+            cuts[0] if len(cuts) == 1 else " | ".join(f"({cut})" for cut in cuts)
+        )
+    return combined
+
+
+def get_mask(data: pd.DataFrame, selection: dict, flag_pulser=None) -> np.ndarray:
+    """
+    Return boolean array selecting events of data passing given selection.
+
+    flag_pulser: [optional] pulser flag of the events (boolean array);
+        if not given, the pulser part of the selection is not applied
+    """
+    mask = np.ones(len(data), dtype=bool)
+    if "pulser" in selection and flag_pulser is not None:
+        flag_pulser = np.asarray(flag_pulser, dtype=bool)
+        mask &= flag_pulser if selection["pulser"] else ~flag_pulser
+    if selection.get("cut"):
+        mask &= derived.evaluate(data, selection["cut"]).to_numpy(dtype=bool)
+    return mask
@@ -0,0 +1,249 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from . import utils
+
+# -------------------------------------------------------------------------
+
+
+class ChannelStats:
+    """
+    Mergeable per-channel statistics of one parameter: count, mean, M2 (sum of squared differences from the mean), min and max.
+
+    Statistics of separate pieces of data (files, chunks, runs) can be merged without going back to the data
+    (parallel algorithm of Chan et al., see reduce_stats()), so that they can be updated chunk by chunk and saved between runs.
+    NaN values are ignored.
+
+    To avoid counting events twice when updating saved statistics with a growing run,
+    the time of the last event included is kept, and only later events are added (see update()).
+
+    table [DataFrame]: [optional] statistics indexed by channel, columns count, mean, m2, min, max
+    end [Timestamp]: [optional] time of the last event included
+
+    >>> stats = ChannelStats.load('stats/l200-v01.06-phy-geds-baseline-pulser.json')
+    >>> stats.update(data['channel'], data['baseline'], data['datetime'])
+    >>> stats.save('stats/l200-v01.06-phy-geds-baseline-pulser.json')
+    """
+
+    COLUMNS = ["count", "mean", "m2", "min", "max"]
+
+    def __init__(self, table: pd.DataFrame = None, end=None):
+        self.table = (
+            pd.DataFrame(columns=self.COLUMNS, index=pd.Index([], name="channel"))
+            if table is None
+            else table[self.COLUMNS]
+        )
+        self.end = end
+
+    @classmethod
+    def from_values(cls, channel, values, time=None):
+        """Statistics of given parameter values of given channels (with their times, if they should be kept track of)."""
+        codes, uniques = pd.factorize(np.asarray(channel), sort=True)
+        values = np.asarray(values, dtype=float)
+        valid = ~np.isnan(values)
+        codes, values = codes[valid], values[valid]
+        n = len(uniques)
+
+        count = np.bincount(codes, minlength=n)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.bincount(codes, weights=values, minlength=n) / count
+        # second pass around the mean, more precise than from the sum of squares
+        m2 = np.bincount(codes, weights=(values - mean[codes]) ** 2, minlength=n)
+        minimum = np.full(n, np.inf)
+        np.minimum.at(minimum, codes, values)
+        maximum = np.full(n, -np.inf)
+        np.maximum.at(maximum, codes, values)
+        minimum[count == 0] = np.nan
+        maximum[count == 0] = np.nan
+
+        table = pd.DataFrame(
+            {"count": count, "mean": mean, "m2": m2, "min": minimum, "max": maximum},
+            index=pd.Index(uniques, name="channel"),
+        )
+        end = pd.Series(time).max() if time is not None and len(time) else None
+        return cls(table, end)
+
+    # -------------------------------------------------------------------------
+    # merging
+    # -------------------------------------------------------------------------
+
+    def merge(self, other: "ChannelStats") -> "ChannelStats":
+        """Return statistics of the data of both self and other."""
+        # empty operands (e.g. fresh statistics) left out, concatenating them is deprecated in pandas
+        table = pd.concat(
+            [table for table in [self.table, other.table] if len(table)] or [self.table]
+        )
+        ends = [end for end in [self.end, other.end] if end is not None]
+        return ChannelStats(
+            reduce_stats(table, table.index), max(ends) if ends else None
+        )
+
+    def update(self, channel, values, time=None):
+        """
+        Add given parameter values of given channels, and return self.
+
+        If times are given and statistics already include events up to self.end, only later events are added
+        (see get_later_events()).
+        """
+        if time is not None and self.end is not None:
+            later = get_later_events(time, self.end, "channel statistics")
+            channel = np.asarray(channel)[later]
+            values = np.asarray(values)[later]
+            time = pd.Series(time)[later]
+        merged = self.merge(ChannelStats.from_values(channel, values, time))
+        self.table, self.end = merged.table, merged.end
+        return self
+
+    # -------------------------------------------------------------------------
+    # results
+    # -------------------------------------------------------------------------
+
+    @property
+    def count(self) -> pd.Series:
+        return self.table["count"]
+
+    @property
+    def mean(self) -> pd.Series:
+        return self.table["mean"].astype(float)
+
+    @property
+    def variance(self) -> pd.Series:
+        """Sample variance (ddof=1, same as pandas), NaN for less than two values."""
+        return (self.table["m2"] / (self.table["count"] - 1)).where(
+            self.table["count"] > 1
+        )
+
+    @property
+    def std(self) -> pd.Series:
+        return np.sqrt(self.variance)
+
+    @property
+    def min(self) -> pd.Series:
+        return self.table["min"].astype(float)
+
+    @property
+    def max(self) -> pd.Series:
+        return self.table["max"].astype(float)
+
+    # -------------------------------------------------------------------------
+    # saving
+    # -------------------------------------------------------------------------
+
+    def save(self, path: str):
+        """Save statistics as JSON file."""
+        channels = {
+            str(channel): [None if pd.isna(x) else float(x) for x in row]
+            for channel, row in zip(self.table.index, self.table.to_numpy())
+        }
+        stats = {
+            "end": None if self.end is None else self.end.isoformat(),
+            "channels": channels,
+        }
+
+        # write to temporary file first, another process might be reading it
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(stats, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """Load statistics saved with save(); empty statistics if the file does not exist yet."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            stats = json.load(f)
+
+        table = pd.DataFrame.from_dict(
+            stats["channels"], orient="index", columns=cls.COLUMNS, dtype=float
+        )
+        table.index = pd.Index(table.index.astype(int), name="channel")
+        table["count"] = table["count"].astype(int)
+        end = None if stats["end"] is None else pd.Timestamp(stats["end"])
+        return cls(table, end)
+
+
+def get_later_events(time, end, name: str) -> np.ndarray:
+    """
+    Return boolean array, True for given event times later than end (last event included in saved aggregates).
+
+    Earlier events are not added, they might have been included already: if there are any
+    (e.g. an earlier time range is run again, or filled in later), a warning tells how many were left out
+    of given aggregates (name), which then have to be deleted and rebuilt to include them.
+    """
+    later = np.asarray(pd.Series(time) > end)
+    if not later.all():
+        utils.logger.warning(
+            f"{(~later).sum()} events not later than {end} are left out of {name} (only later events are added)!"
+        )
+    return later
+
+
+def reduce_stats(table: pd.DataFrame, keys) -> pd.DataFrame:
+    """
+    Combine rows of a statistics table (columns count, mean, m2, min, max) that have the same key.
+
+    keys: key of each row (array or Index, can be a MultiIndex)
+
+    Returns table with the same columns, indexed by the unique keys (sorted).
+    Rows with count 0 do not change the result; a NaN mean with non-zero count (only counts kept) gives NaN.
+    """
+    index = keys if isinstance(keys, pd.Index) else pd.Index(keys)
+    # group number of each row; grouping on the levels avoids building tuples for a MultiIndex
+    grouped = pd.DataFrame(
+        {i: index.get_level_values(i) for i in range(index.nlevels)}
+    ).groupby(list(range(index.nlevels)), sort=True)
+    codes = grouped.ngroup().to_numpy()
+    n = grouped.ngroups
+    # key of each group from its first row
+    first = np.empty(n, dtype=int)
+    first[codes[::-1]] = np.arange(len(codes))[::-1]
+    uniques = index[first]
+
+    count = table["count"].to_numpy(dtype=float)
+    has_values = count > 0
+    mean = np.where(has_values, table["mean"].to_numpy(dtype=float), 0)
+    m2 = np.where(has_values, table["m2"].to_numpy(dtype=float), 0)
+
+    total = np.bincount(codes, weights=count, minlength=n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        combined_mean = np.bincount(codes, weights=count * mean, minlength=n) / total
+    # M2 of each row + spread of the row means around the combined mean
+    combined_m2 = np.bincount(
+        codes, weights=m2 + count * (mean - combined_mean[codes]) ** 2, minlength=n
+    )
+
+    minimum = np.full(n, np.inf)
+    np.fmin.at(minimum, codes, table["min"].to_numpy(dtype=float))
+    maximum = np.full(n, -np.inf)
+    np.fmax.at(maximum, codes, table["max"].to_numpy(dtype=float))
+    minimum[np.isinf(minimum)] = np.nan
+    maximum[np.isinf(maximum)] = np.nan
+
+    return pd.DataFrame(
+        {
+            "count": total.astype(int),
+            "mean": combined_mean,
+            "m2": combined_m2,
+            "min": minimum,
+            "max": maximum,
+        },
+        index=uniques,
+    )
+
+
+def get_stats_path(stats_dir: str, subsystem, parameter: str, evt_type: str) -> str:
+    """
+    Return path of saved statistics of given parameter and event type for given Subsystem.
+
+    Format: <stats_dir>/<experiment>-<version>-<data type>-<subsystem>-<parameter>-<event type>.json
+    Statistics of different periods should be kept in different directories.
+    """
+    return os.path.join(
+        stats_dir,
+        f"{subsystem.experiment}-{subsystem.version}-{subsystem.datatype}-{subsystem.type}-{parameter}-{evt_type}.json",
+    )
@@ -0,0 +1,417 @@
+import numpy as np
+import pandas as pd
+
+from . import (
+    analysis_data,
+    binning,
+    channels,
+    derived,
+    histograms,
+    pyramid,
+    stats,
+    utils,
+)
+from .histograms import ChannelHistograms
+from .stats import ChannelStats
+from .subsystem import Subsystem
+
+# -------------------------------------------------------------------------
+# streaming mode: aggregate data chunk by chunk instead of keeping it all in memory
+# -------------------------------------------------------------------------
+
+
+def stream_subsystem_plots(
+    subsystem: Subsystem,
+    plots: dict,
+    pulser_timestamps: pd.Series,
+    cache=None,
+    files_per_chunk: int = 10,
+    stats_dir: str = None,
+    pyramid_dir: str = None,
+    histo_dir: str = None,
+) -> dict:
+    """
+    Go through the data of given subsystem chunk by chunk, and aggregate what is needed for given plots.
+
+    plots: dict of format {<plot title>: <plot settings>} from the config
+    pulser_timestamps: timestamps of pulser events, see Subsystem.get_pulser_timestamps()
+    cache: [optional] cache.DataCache object, see Subsystem.get_data()
+    files_per_chunk: number of files to load at once
+    stats_dir: [optional] directory of channel statistics saved between runs, see plotting.make_subsystem_plots()
+    pyramid_dir: [optional] directory of time series pyramids saved between runs, updated chunk by chunk for vs time plots
+    histo_dir: [optional] directory of histograms saved between runs, updated chunk by chunk for histograms with fixed bins
+
+    Returns dict of format {<plot title>: {<parameter>: PlotAggregates}}, to be given to plotting.make_subsystem_plots().
+    Histograms without fixed bins (see histograms.get_histo_bins()) or with variation need the channel range/mean first,
+    and are filled in a second pass over the data.
+    """
+    utils.logger.info("... streaming mode")
+
+    aggregates = {}
+    for plot_title, plot_settings in plots.items():
+        # raw events are not kept -> only time windows can be plotted vs time
+        if plot_settings["plot_style"] != "histogram" and not plot_settings.get(
+            "time_window"
+        ):
+            utils.logger.warning(
+                f"Plot '{plot_title}' needs 'time_window' to be aggregated in streaming mode, skipping it!"
+            )
+            continue
+        # one PlotAggregates per parameter of the plot
+        aggregates[plot_title] = {}
+        for param in utils.get_plot_parameters(plot_settings):
+            stats_path = None
+            if stats_dir and param != "event_rate":
+                stats_path = stats.get_stats_path(
+                    stats_dir, subsystem, param, plot_settings["event_type"]
+                )
+            pyramid_path = None
+            if pyramid_dir and plot_settings["plot_style"] == "vs time":
+                pyramid_path = pyramid.get_pyramid_path(
+                    pyramid_dir, subsystem, param, plot_settings["event_type"]
+                )
+            histo_path = None
+            if histo_dir and plot_settings["plot_style"] == "histogram":
+                histo_path = histograms.get_histogram_path(
+                    histo_dir, subsystem, param, plot_settings["event_type"]
+                )
+            aggregates[plot_title][param] = PlotAggregates(
+                {**plot_settings, "parameters": param},
+                subsystem.channel_map,
+                stats_path,
+                pyramid_path,
+                histo_path,
+            )
+
+    all_aggregates = [
+        agg
+        for plot_aggregates in aggregates.values()
+        for agg in plot_aggregates.values()
+    ]
+    parameters = [agg.parameter for agg in all_aggregates]
+
+    # -------------------------------------------------------------------------
+    # first pass: everything except histograms depending on full data
+    # -------------------------------------------------------------------------
+
+    for _ in subsystem.iterate_data(
+        parameters, cache, files_per_chunk, pulser_timestamps
+    ):
+        flag_pulser_events_in_chunk(subsystem, pulser_timestamps)
+        for agg in all_aggregates:
+            agg.add(subsystem.data)
+
+    # -------------------------------------------------------------------------
+    # second pass: remaining histograms
+    # -------------------------------------------------------------------------
+
+    second_pass = [agg for agg in all_aggregates if agg.needs_second_pass]
+    if second_pass:
+        utils.logger.info("... second pass for histograms")
+        for _ in subsystem.iterate_data(
+            parameters, cache, files_per_chunk, pulser_timestamps
+        ):
+            flag_pulser_events_in_chunk(subsystem, pulser_timestamps)
+            for agg in second_pass:
+                agg.add_histogram(subsystem.data)
+
+    for agg in all_aggregates:
+        agg.finalize()
+
+    return aggregates
+
+
+def flag_pulser_events_in_chunk(subsystem: Subsystem, pulser_timestamps: pd.Series):
+    """Flag pulser events in current chunk of subsystem data, using only pulser timestamps in the time range of this chunk."""
+    times = subsystem.data["datetime"]
+    tolerance = subsystem.pulser_tolerance
+    subsystem.flag_pulser_events(
+        pulser_timestamps[
+            pulser_timestamps.between(times.min() - tolerance, times.max() + tolerance)
+        ]
+    )
+
+
+class PlotAggregates:
+    """
+    Aggregates of the data needed for one plot, updated chunk by chunk.
+
+    Keeps, for each channel: statistics of the parameter (stats.ChannelStats);
+    number of events and sum of the parameter in time windows (same windows as binning.bin_in_time(),
+    assuming chunks come in time order); histogram counts for histogram plot style (histograms.ChannelHistograms).
+    Once all chunks have been added, finalize() puts them in self.data in the same format as AnalysisData.data
+    (one row per time window instead of one row per event), to be plotted with the usual plot structures and styles,
+    and for vs time plots the same windows in self.resampled, so that they are not binned in time again when plotting.
+
+    plot_settings [dict]: settings of this plot from the config (single parameter)
+    channel_map [DataFrame]: channel map of the subsystem
+    stats_path [str]: [optional] file of channel statistics saved between runs (see stats.ChannelStats);
+        if given, channel mean and variation are calculated over all data seen so far, and the file is updated in finalize()
+    pyramid_path [str]: [optional] directory of a pyramid.TimePyramid to update with each chunk, saved in finalize()
+    histo_path [str]: [optional] file of histograms saved between runs, updated with each chunk if bins are fixed
+    """
+
+    def __init__(
+        self,
+        plot_settings: dict,
+        channel_map: pd.DataFrame,
+        stats_path: str = None,
+        pyramid_path: str = None,
+        histo_path: str = None,
+    ):
+        self.parameter = plot_settings["parameters"]
+        self.parameters = [self.parameter]
+        self.evt_type = plot_settings["event_type"]
+        self.variation = plot_settings.get("variation", False)
+        self.time_window = plot_settings.get("time_window")
+        self.plot_style = plot_settings["plot_style"]
+        self.channel_map = channel_map
+        self.data = pd.DataFrame()
+        # mean in time windows in the format of binning.bin_in_time(), for vs time plots (see finalize())
+        self.resampled = None
+
+        # --- per channel: statistics of this data, and of all data so far if saved between runs
+        self.stats = ChannelStats()
+        self.stats_path = stats_path
+        self.history = ChannelStats.load(stats_path) if stats_path else None
+        self.pyramid = pyramid.TimePyramid(pyramid_path) if pyramid_path else None
+
+        # --- per channel and time window
+        # start of first time window of each channel
+        self.origin = None
+        # last event so far, end of the last (partial) time window
+        self.end = None
+        # index (channel, time window number), columns count & sum
+        self.windows = None
+
+        # --- histogram counts per channel
+        self.histograms = ChannelHistograms()
+        self.fixed_histo_bins = histograms.get_histo_bins(
+            self.parameter, variation=self.variation
+        )
+        # bins of each channel, known once the first chunk is histogrammed
+        self.histo_bins = self.fixed_histo_bins
+        # histograms of all data so far, only if bins are fixed
+        self.histo_path = histo_path if self.fixed_histo_bins else None
+        self.histo_history = (
+            ChannelHistograms.load(self.histo_path) if self.histo_path else None
+        )
+
+    @property
+    def channel_mean(self) -> pd.Series:
+        """Mean of the parameter for each channel, over all data so far if statistics are saved between runs."""
+        return (self.stats if self.history is None else self.history).mean
+
+    @property
+    def needs_second_pass(self):
+        return self.plot_style == "histogram" and self.fixed_histo_bins is None
+
+    def select(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Select events of requested type and calculate parameter, if derived."""
+        data = analysis_data.select_events(data, self.evt_type)
+        return derived.calculate(data.copy(), self.parameters)
+
+    # -------------------------------------------------------------------------
+    # adding chunks
+    # -------------------------------------------------------------------------
+
+    def add(self, data: pd.DataFrame):
+        """Add chunk of subsystem data."""
+        data = self.select(data)
+        if data.empty:
+            return
+
+        if self.parameter != "event_rate":
+            self.stats.update(data["channel"], data[self.parameter])
+            if self.history is not None:
+                self.history.update(
+                    data["channel"], data[self.parameter], data["datetime"]
+                )
+
+        if self.pyramid is not None:
+            self.pyramid.update(
+                data["channel"],
+                data["datetime"],
+                None if self.parameter == "event_rate" else data[self.parameter],
+            )
+
+        if self.time_window:
+            # first time window starts with the first event of each channel
+            first = data.groupby("channel")["datetime"].min()
+            self.origin = (
+                first if self.origin is None else self.origin.combine_first(first)
+            )
+            last = data["datetime"].max()
+            self.end = last if self.end is None else max(self.end, last)
+            bins = binning.bin_in_time(
+                data["channel"],
+                data["datetime"],
+                self.time_window,
+                None if self.parameter == "event_rate" else data[self.parameter],
+                origin=self.origin,
+            )
+            windows = bins.set_index(["channel", "window"])[
+                ["count"] if self.parameter == "event_rate" else ["count", "sum"]
+            ]
+            self.windows = merge_aggregates(self.windows, windows)
+
+        if self.plot_style == "histogram" and not self.needs_second_pass:
+            self.fill_histo(data)
+
+    def add_histogram(self, data: pd.DataFrame):
+        """Add chunk of subsystem data to histogram, in the second pass (after all chunks were added)."""
+        data = self.select(data)
+        if self.variation:
+            data = self.calculate_variation(data)
+        self.fill_histo(data)
+
+    def fill_histo(self, data: pd.DataFrame):
+        if self.histo_bins is None:
+            self.histo_bins = self.get_histo_bins()
+        self.histograms.update(data["channel"], data[self.parameter], self.histo_bins)
+        if self.histo_history is not None:
+            self.histo_history.update(
+                data["channel"], data[self.parameter], self.histo_bins, data["datetime"]
+            )
+
+    def get_histo_bins(self):
+        """Bins of each channel from its range over all the data (first pass), for histograms without fixed bins."""
+        x_min, x_max = self.stats.min, self.stats.max
+        if self.variation:
+            # variation from mean is monotonic, but reversed for negative mean
+            mean = self.channel_mean.reindex(x_min.index)
+            x_min, x_max = (x_min / mean - 1) * 100, (x_max / mean - 1) * 100
+            x_min, x_max = np.fmin(x_min, x_max), np.fmax(x_min, x_max)
+        return histograms.get_histo_bins(self.parameter, x_min, x_max, variation=True)
+
+    def calculate_variation(self, data: pd.DataFrame) -> pd.DataFrame:
+        mean = channels.ChannelLookup(self.channel_mean.rename("mean")).map(
+            data["channel"], "mean"
+        )
+        data[self.parameter] = (data[self.parameter] / mean - 1) * 100  # %
+        return data
+
+    # -------------------------------------------------------------------------
+    # final table
+    # -------------------------------------------------------------------------
+
+    def finalize(self):
+        """Build self.data from aggregates, in the same format as AnalysisData.data."""
+        if self.plot_style == "histogram":
+            data = self.histogram_table()
+        else:
+            data = self.time_window_table()
+            if self.parameter != "event_rate":
+                # windows are already aggregated: plotted as they are, not binned in time again
+                self.resampled = pd.DataFrame(
+                    {
+                        "channel": data["channel"],
+                        "start": data.pop("start"),
+                        "duration": data.pop("duration"),
+                        "count": data.pop("count"),
+                        "mean": data[self.parameter],
+                    }
+                )
+
+        if self.parameter == "event_rate":
+            # same as AnalysisData: mean of the event rate in time windows
+            channel_mean = data.groupby("channel")["event_rate"].mean()
+        else:
+            channel_mean = self.channel_mean
+            if self.history is not None:
+                self.history.save(self.stats_path)
+        if self.histo_history is not None:
+            self.histo_history.save(self.histo_path)
+        if self.pyramid is not None:
+            # updated chunk by chunk in memory, written once
+            self.pyramid.save()
+        data[self.parameter + "_mean"] = channel_mean.reindex(data["channel"]).values
+
+        # add channel map info
+        data = data.merge(
+            self.channel_map[["channel", "name", "location", "position", "status"]],
+            on="channel",
+            how="left",
+        )
+        self.data = data.sort_values(
+            ["channel", "datetime" if "datetime" in data else self.parameter]
+        )
+
+    def time_window_table(self) -> pd.DataFrame:
+        """
+        Table with one row per channel and time window, including empty windows like DataFrame.resample().
+
+        Each window is placed in the middle of the part covered by the data, like the means of binning.bin_in_time()
+        are plotted (see plot_styles.plot_vs_time()); start, duration and count of the windows are kept for finalize().
+        Empty (with the columns of AnalysisData.data) if no event was selected.
+        """
+        if self.windows is None:
+            utils.logger.warning(
+                f"No {self.evt_type} events for {self.parameter} in any chunk!"
+            )
+            return pd.DataFrame(
+                columns=["channel", "datetime", self.parameter]
+                + (
+                    []
+                    if self.parameter == "event_rate"
+                    else ["start", "duration", "count"]
+                )
+            )
+
+        dt = pd.Timedelta(self.time_window)
+        tables = []
+        for channel, windows in self.windows.groupby(level="channel"):
+            windows = windows.droplevel("channel")
+            windows = windows.reindex(
+                np.arange(windows.index.min(), windows.index.max() + 1),
+                fill_value=0,
+            )
+            start = pd.Series(self.origin[channel] + windows.index * dt)
+            # part of the window covered by data, shorter for the last window
+            duration = (self.end - start).clip(upper=dt)
+            # in the middle of the covered part of the time window
+            table = pd.DataFrame({"channel": channel, "datetime": start + duration / 2})
+            if self.parameter == "event_rate":
+                # in Hz
+                seconds = duration.dt.total_seconds()
+                table["event_rate"] = windows["count"].values / seconds.where(
+                    seconds > 0
+                )
+            else:
+                # mean in this time window, NaN if no events
+                table[self.parameter] = (
+                    windows["sum"] / windows["count"].replace(0, np.nan)
+                ).values
+                table["start"] = start
+                table["duration"] = duration
+                table["count"] = windows["count"].values
+            tables.append(table)
+
+        data = pd.concat(tables, ignore_index=True)
+
+        if self.variation and self.parameter != "event_rate":
+            data = self.calculate_variation(data)
+
+        return data
+
+    def histogram_table(self) -> pd.DataFrame:
+        """
+        Table with one row per channel and histogram bin, with bin centers as parameter value and column counts.
+
+        Plotted from self.histograms directly (see plot_styles.plot_histo()).
+        """
+        centers = self.histograms.centers()
+        return pd.DataFrame(
+            {
+                "channel": np.repeat(centers.index, centers.shape[1]),
+                self.parameter: centers.to_numpy().ravel(),
+                "counts": self.histograms.counts.to_numpy().ravel(),
+            }
+        )
+
+
+def merge_aggregates(old, new):
+    """Add aggregates (Series or DataFrame) of a new chunk to the ones of previous chunks."""
+    if old is None:
+        return new
+    return old.add(new, fill_value=0)
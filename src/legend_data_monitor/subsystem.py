@@ -4,12 +4,9 @@ from datetime import datetime
 
 import numpy as np
 import pandas as pd
-from legendmeta import LegendMetadata
-from pygama.flow import DataLoader
+from pygama.flow import DataLoader, FileDB
 
-from . import utils
-
-LEGEND_META = LegendMetadata()
+from . import catalog, channels, derived, event_time, metadata, selection, utils
 
 list_of_str = list[str]
 tuple_of_str = tuple[str]
@@ -36,6 +33,16 @@ class Subsystem:
                 3) 'runs': int or list of ints for run number(s)  e.g. 10 for r010
     Or input kwargs separately path=, version=, type=; start=&end=, or window=, or timestamps=, or runs=
 
+    float32= [optional] bool: store parameters as float32 instead of float64 to save memory. Default: False
+    metadata_cache= [optional] str: directory where channel map and status lookups are cached between runs.
+        Default: see metadata.CACHE_DIR
+    catalog= [optional] str: SQLite file of the catalog of production files. Default: see catalog.CATALOG_PATH
+    pulser_tolerance= [optional] str: maximum time difference to a pulser event for an event to be flagged as pulser,
+        e.g. '10us'. Default: 0 (exact match)
+    event_types= [optional] list of event types of all plots to be made (see settings/event-types.json).
+        If given, parameters needed for their cuts are loaded, and rows of events of none of these types
+        are dropped from each file chunk while loading (see get_load_mask()). Not applied to the pulser itself.
+
     Experiment is needed to know which channel belongs to the pulser Subsystem, AUX0 (L60) or AUX1 (L200)
     Selection range is needed for the channel map and status information at that time point, and should be the only information needed,
         however, pylegendmeta only allows query .on(timestamp=...) but not .on(run=...);
@@ -122,8 +129,32 @@ class Subsystem:
         # need to remember for DataLoader config
         self.path = data_info["path"]
         self.version = data_info["version"]
+        # need to remember for compacting data after loading
+        self.float32 = kwargs.get("float32", False)
+        # need to remember for channel map and status lookups
+        self.metadata_cache = kwargs.get("metadata_cache")
+        # need to remember for flagging pulser events
+        self.pulser_tolerance = pd.Timedelta(kwargs.get("pulser_tolerance", 0))
+        # need to remember for selecting events while loading
+        # (all events of the pulser are needed to flag pulser events of the others)
+        self.event_types = kwargs.get("event_types") or []
+        self.load_selection = (
+            {}
+            if self.type == "pulser"
+            else selection.combine_selections(self.event_types)
+        )
+        # whether pulser events were dropped while loading, see get_load_mask()
+        self.pulser_dropped = False
+
+        # catalog of files of this production, instead of looking for files in the production tree
+        self.catalog = catalog.FileCatalog(
+            os.path.join(self.path, self.version, "generated", "tier"),
+            kwargs.get("catalog"),
+        )
 
-        self.timerange, self.first_timestamp = utils.get_query_times(**kwargs)
+        self.timerange, self.first_timestamp = utils.get_query_times(
+            file_catalog=self.catalog, **kwargs
+        )
 
         # None will be returned if something went wrong
         if not self.timerange:
@@ -135,49 +166,104 @@ class Subsystem:
         # add column status to channel map stating On/Off
         self.get_channel_status()
 
-        # -------------------------------------------------------------------------
-        # K lines
-        # -------------------------------------------------------------------------
-
-        # # a bit cumbersome, but we need to know if K_lines was requested to select specified energy parameter
-        # self.k_lines = False
-        # for plot in self.plots:
-        #     # if K lines is asked, set to true
-        #     self.k_lines = self.k_lines or (self.plots[plot]['events'] == 'K_lines')
-
         # -------------------------------------------------------------------------
         # have something before get_data() is called just in case
         self.data = pd.DataFrame()
 
-    def get_data(self, parameters: typing.Union[str, list_of_str, tuple_of_str] = ()):
+    def get_data(
+        self,
+        parameters: typing.Union[str, list_of_str, tuple_of_str] = (),
+        cache=None,
+        pulser_timestamps: pd.Series = None,
+    ):
         """
         Get data for requested parameters from DataLoader and "prime" it to be ready for analysis.
 
         parameters: single parameter or list of parameters to load.
             If empty, only default parameters will be loaded (channel, timestamp; baseline and wfmax for pulser)
+        cache: [optional] cache.DataCache object; if given, data already loaded in previous runs is read from there
+            instead of the LH5 files, and newly loaded data is stored in it
+        pulser_timestamps: [optional] timestamps of pulser events (see get_pulser_timestamps());
+            if given, pulser or non-pulser events are dropped while loading, if no plot needs them (see get_load_mask())
         """
-        utils.logger.info("... getting data")
+        get_subsystems_data(
+            [self],
+            {self.type: parameters},
+            cache=cache,
+            pulser_timestamps=pulser_timestamps,
+        )
 
-        # -------------------------------------------------------------------------
-        # Set up DataLoader config
-        # -------------------------------------------------------------------------
-        utils.logger.info("...... setting up DataLoader")
+    def iterate_data(
+        self,
+        parameters: typing.Union[str, list_of_str, tuple_of_str] = (),
+        cache=None,
+        files_per_chunk: int = 10,
+        pulser_timestamps: pd.Series = None,
+    ):
+        """
+        Get data for requested parameters in chunks of files, for time ranges too long to keep all data in memory.
 
-        # --- construct list of parameters for the data loader
-        # depending on special parameters, k lines etc.
-        params_for_dataloader = self.get_parameters_for_dataloader(parameters)
+        Generator: at each iteration, self.data holds the "primed" data of the next files_per_chunk files (see get_data()).
+        Files are looked up only once, and chunks come in time order.
+        pulser_timestamps: [optional] see get_data()
 
-        # --- set up DataLoader config
-        # needs to know path and version from data_info
-        dlconfig, dbconfig = self.construct_dataloader_configs(params_for_dataloader)
+        >>> for data in geds.iterate_data('baseline'):
+        ...     # do something with data of this chunk
+        """
+        utils.logger.info("... getting data in chunks")
 
-        # --- set up DataLoader
-        dl = DataLoader(dlconfig, dbconfig)
+        params = self.get_parameters_for_dataloader(parameters)
+        dlconfig, dbconfig = self.construct_dataloader_configs(params)
+        dl = set_up_dataloader(
+            dlconfig, dbconfig, self.get_query(), params, self.get_filedb(dbconfig)
+        )
 
-        # -------------------------------------------------------------------------
-        # Set up query
-        # -------------------------------------------------------------------------
+        all_files = dl.file_list
+        for first in range(0, len(all_files), files_per_chunk):
+            utils.logger.info(
+                f"...... files {first + 1}-{min(first + files_per_chunk, len(all_files))} of {len(all_files)}"
+            )
+            dl.file_list = all_files[first : first + files_per_chunk]
+            self.data = load_data(
+                dl,
+                dbconfig,
+                cache,
+                self.get_load_selector(pulser_timestamps),
+                files_per_chunk,
+            )
+            # no events of our channels in these files
+            if self.data.empty:
+                continue
+            self.prime_data()
+            yield self.data
+
+        # don't keep the last chunk around
+        self.data = pd.DataFrame()
+
+    def get_filedb(self, dbconfig: dict) -> FileDB:
+        """
+        Set up DataLoader FileDB for given DB config from the file catalog, instead of scanning the production tree.
+
+        Only files of this data type and time range are included.
+        """
+        filedb = FileDB(dbconfig, scan=False)
+        filedb.df = self.catalog.get_files(
+            self.datatype, self.timerange, dbconfig["file_format"]
+        )
+
+        # same as FileDB scan: tables and columns from config
+        filedb.columns = list(dbconfig["columns"].values())
+        for tier in dbconfig["file_format"]:
+            tables = dbconfig["tables"][tier]
+            filedb.df[f"{tier}_tables"] = [tables] * len(filedb.df)
+            filedb.df[f"{tier}_col_idx"] = [
+                [filedb.columns.index(dbconfig["columns"][tier])] * len(tables)
+            ] * len(filedb.df)
+
+        return filedb
 
+    def get_query(self) -> str:
+        """Construct DataLoader file query for the time range and data type of this subsystem."""
         # if querying by run, time word is 'run'; otherwise 'timestamp'; is the key of the timerange dict
         time_word = list(self.timerange.keys())[0]
 
@@ -186,9 +272,14 @@ class Subsystem:
             query = f"({time_word} >= '{self.timerange[time_word]['start']}') and ({time_word} <= '{self.timerange[time_word]['end']}')"
         else:
             # query by (run/timestamp == ) or (run/timestamp == ) if format [list of runs/timestamps]
-            query = " or ".join(
-                f"({time_word} == '" + run_or_timestamp + "')"
-                for run_or_timestamp in self.timerange[time_word]
+            # (in brackets, otherwise the type selection below only applies to the last one)
+            query = (
+                "("
+                + " or ".join(
+                    f"({time_word} == '" + run_or_timestamp + "')"
+                    for run_or_timestamp in self.timerange[time_word]
+                )
+                + ")"
             )
 
         # --- cal or phy data or both
@@ -204,41 +295,43 @@ class Subsystem:
         query += " and (timestamp != '20230125T222013Z')"
         query += " and (timestamp != '20230126T015308Z')"
 
-        utils.logger.info(
-            "...... querying DataLoader (includes quickfix-removed faulty files for r010)"
-        )
-        utils.logger.info(query)
-
-        # -------------------------------------------------------------------------
-        # Query DataLoader & load data
-        # -------------------------------------------------------------------------
-
-        # --- query data loader
-        dl.set_files(query)
-        dl.set_output(fmt="pd.DataFrame", columns=params_for_dataloader)
+        return query
 
-        now = datetime.now()
-        self.data = dl.load()
-        utils.logger.info(f"Total time to load data: {(datetime.now() - now)}")
+    def get_load_mask(
+        self, data: pd.DataFrame, pulser_timestamps: pd.Series = None
+    ) -> np.ndarray:
+        """
+        Return boolean array selecting events of freshly loaded data (before prime_data()) that any plot needs.
 
-        # -------------------------------------------------------------------------
-        # polish things up
-        # -------------------------------------------------------------------------
+        The cut of the event types is applied if there is one for all of them (e.g. only K lines asked);
+        pulser or non-pulser events are dropped if all event types agree and pulser timestamps are given.
+        """
+        flag_pulser = None
+        if pulser_timestamps is not None and "pulser" in self.load_selection:
+            flag_pulser = match_timestamps(
+                event_time.seconds_to_ns(data["timestamp"]),
+                pulser_timestamps,
+                self.pulser_tolerance,
+            )
+            self.pulser_dropped = (
+                self.pulser_dropped or not self.load_selection["pulser"]
+            )
+        return selection.get_mask(data, self.load_selection, flag_pulser)
 
-        tier = "hit" if "hit" in dbconfig["columns"] else "dsp"
-        # remove columns we don't need
-        self.data = self.data.drop([f"{tier}_idx", "file"], axis=1)
-        # rename channel to channel
-        self.data = self.data.rename(columns={f"{tier}_table": "channel"})
+    def get_load_selector(self, pulser_timestamps: pd.Series = None):
+        """Return function selecting rows of a loaded file chunk for load_data(), None if all rows are needed."""
+        if not self.load_selection:
+            return None
+        return lambda data: self.get_load_mask(data, pulser_timestamps)
 
+    def prime_data(self):
+        """Prepare freshly loaded data for analysis: datetime column, channel map info, pulser flag (if pulser)."""
         # -------------------------------------------------------------------------
         # create datetime column based on initial key and timestamp
         # -------------------------------------------------------------------------
 
-        # convert UTC timestamp to datetime (unix epoch time)
-        self.data["datetime"] = pd.to_datetime(
-            self.data["timestamp"], origin="unix", utc=True, unit="s"
-        )
+        # convert UTC timestamp to datetime (unix epoch time), the only conversion of event times (see event_time.py)
+        self.data["datetime"] = event_time.from_seconds(self.data["timestamp"])
         # drop timestamp
         self.data = self.data.drop("timestamp", axis=1)
 
@@ -247,19 +340,20 @@ class Subsystem:
         # -------------------------------------------------------------------------
 
         utils.logger.info("... mapping to name and string/fiber position")
-        self.data = self.data.set_index("channel")
-        # expand channel map index to match that of data with repeating channels
-        ch_map_reindexed = self.channel_map.set_index("channel").reindex(
-            self.data.index
+        # gather channel map columns for each event from a lookup table by channel number
+        # (channel map in compact types -> categoricals only take codes, no strings repeated for each event)
+        # for the log: memory with channel map info repeated for each event in the types of the map
+        memory_before = self.data.memory_usage(deep=True).sum()
+        memory_before += channels.get_repeated_memory_usage(
+            self.channel_map, self.data["channel"]
+        )
+        channel_map = channels.compact_dtypes(self.channel_map.copy())
+        channels.ChannelLookup(channel_map).attach(self.data)
+        self.compact_data()
+        memory_after = self.data.memory_usage(deep=True).sum()
+        utils.logger.info(
+            f"... data memory usage: {memory_before / 1024**2:.1f} MB -> {memory_after / 1024**2:.1f} MB"
         )
-        # append the channel map columns to the data
-        self.data = pd.concat([self.data, ch_map_reindexed], axis=1)
-        self.data = self.data.reset_index()
-        # stupid dataframe, why float
-        for col in ["location", "position"]:
-            # ignore string values for fibers ('I/OB-XXX-XXX') and positions ('top/bottom') for SiPMs
-            if isinstance(self.data[col].iloc[0], float):
-                self.data[col] = self.data[col].astype(int)
 
         # -------------------------------------------------------------------------
         # if this subsystem is pulser, flag pulser timestamps
@@ -268,165 +362,156 @@ class Subsystem:
         if self.type == "pulser":
             self.flag_pulser_events()
 
+    def compact_data(self):
+        """
+        Convert data columns to compact types to save memory.
+
+        Channel map info repeats the same few values for every event:
+            - strings (name, status, CC4 ID; fiber name and top/bottom position for SiPMs) -> categorical
+            - numbers (channel, string number and position for geds, CC4 channel) -> smallest integer type
+        If float32 was asked, float64 parameters are converted to float32.
+        """
+        channels.compact_dtypes(
+            self.data, [col for col in self.channel_map.columns if col in self.data]
+        )
+
+        if self.float32:
+            for col in self.data.select_dtypes("float64"):
+                self.data[col] = self.data[col].astype("float32")
+
     def flag_pulser_events(self, pulser=None):
-        utils.logger.info("... flagging pulser events")
+        """
+        Add column flag_pulser to data, True for pulser events.
 
-        # --- if a pulser object was provided, flag pulser events in data based on its flag
-        if pulser:
-            try:
-                pulser_timestamps = pulser.data[pulser.data["flag_pulser"]][
-                    "datetime"
-                ]  # .set_index('datetime').index
-                self.data["flag_pulser"] = False
-                self.data = self.data.set_index("datetime")
-                self.data.loc[pulser_timestamps, "flag_pulser"] = True
-            except KeyError:
-                utils.logger.warning(
-                    "Warning: cannot flag pulser events, timestamps don't match!\n \
-                    If you are you looking at calibration data, it's not possible to flag pulser events in it this way.\n \
-                    Contact the developers if you would like them to focus on advanced flagging methods."
-                )
-                utils.logger.warning("! Proceeding without pulser flag !")
+        pulser: Subsystem of type 'pulser' with its data loaded, or directly a Series of its pulser timestamps
+            (see get_pulser_timestamps()). If not provided, this Subsystem is understood to be the pulser itself.
 
+        Events are flagged if their timestamp matches a pulser timestamp within the pulser tolerance of this Subsystem
+        (see match_timestamps()). Number of events and pulser events of each channel are kept in self.pulser_stats.
+        """
+        utils.logger.info("... flagging pulser events")
+
+        # --- if a pulser object or pulser timestamps were provided, flag pulser events in data based on them
+        pulser_timestamps = ()
+        if pulser is not None:
+            pulser_timestamps = (
+                pulser.get_pulser_timestamps()
+                if isinstance(pulser, Subsystem)
+                else pulser
+            )
+            self.data["flag_pulser"] = match_timestamps(
+                self.data["datetime"], pulser_timestamps, self.pulser_tolerance
+            )
         else:
             # --- if no object was provided, it's understood that this itself is a pulser
-            # find timestamps over threshold
+            # find events over threshold
             high_thr = 12500
-            self.data = self.data.set_index("datetime")
             wf_max_rel = self.data["wf_max"] - self.data["baseline"]
-            pulser_timestamps = self.data[wf_max_rel > high_thr].index
-            # flag them
-            self.data["flag_pulser"] = False
-            self.data.loc[pulser_timestamps, "flag_pulser"] = True
+            self.data["flag_pulser"] = (wf_max_rel > high_thr).to_numpy()
+
+        # --- match statistics
+        self.pulser_stats = self.data.groupby("channel")["flag_pulser"].agg(
+            events="size", pulser_events="sum"
+        )
+        utils.logger.debug(self.pulser_stats)
+        unmatched = list(
+            self.pulser_stats.index[self.pulser_stats["pulser_events"] == 0]
+        )
+        # (only if there were pulser timestamps to match, and pulser events were not dropped while loading)
+        if unmatched and len(pulser_timestamps) and not self.pulser_dropped:
+            utils.logger.warning(
+                f"Warning: no pulser events found for channels {unmatched}! "
+                + "If timestamps are slightly off (e.g. calibration data), try a larger 'pulser_tolerance' in the config."
+            )
 
-        self.data = self.data.reset_index()
+    def get_pulser_timestamps(self) -> pd.Series:
+        """Return timestamps of events flagged as pulser. Only valid for a Subsystem of type 'pulser' with data loaded."""
+        return self.data[self.data["flag_pulser"]]["datetime"]
 
     def get_channel_map(self):
         """
         Build channel map for given subsystem.
 
-        setup_info: dict with the keys 'experiment' and 'period'
-
-        Later will probably be changed to get channel map by timestamp (or hopefully run, if possible)
+        Channel map is looked up by the first timestamp of the selection and cached between runs,
+        see metadata.get_channel_records().
+        For SiPMs, column 'barrel' tells the inner and outer barrel apart (for the per barrel plot structures).
         Planning to add:
             - CC4 name
-            - barrel column for SiPMs special case
         """
         utils.logger.info("... getting channel map")
 
         # -------------------------------------------------------------------------
-        # load full channel map of this exp and period
+        # load full channel map at this time point (cached between runs)
         # -------------------------------------------------------------------------
 
-        full_channel_map = LEGEND_META.hardware.configuration.channelmaps.on(
-            timestamp=self.first_timestamp
+        records = metadata.get_channel_records(
+            self.first_timestamp, self.metadata_cache
         )
 
-        df_map = pd.DataFrame(
-            columns=["name", "location", "channel", "position", "cc4_id", "cc4_channel"]
-        )
-        df_map = df_map.set_index("channel")
-
         # -------------------------------------------------------------------------
-        # helper function to determine which channel map entry belongs to this subsystem
+        # select entries belonging to this subsystem
         # -------------------------------------------------------------------------
 
-        # dct_key is the subdict corresponding to one chmap entry
-        def is_subsystem(entry):
+        if self.type == "pulser":
             # special case for pulser
-            if self.type == "pulser":
-                pulser_ch = 0 if self.experiment == "L60" else 1
-                return entry["system"] == "auxs" and entry["daq"]["fcid"] == pulser_ch
+            pulser_ch = 0 if self.experiment == "L60" else 1
+            records = records[
+                (records["system"] == "auxs") & (records["channel"] == pulser_ch)
+            ]
+        else:
             # for geds or spms
-            return entry["system"] == self.type
+            records = records[records["system"] == self.type]
 
         # name of location in the channel map
         loc_code = {"geds": "string", "spms": "fiber"}
 
         # -------------------------------------------------------------------------
-        # loop over entries and find out subsystem
+        # build channel map in one go
         # -------------------------------------------------------------------------
 
-        # config.channel_map is already a dict read from the channel map json
-        for entry in full_channel_map:
-            # skip 'BF' don't even know what it is
-            # ! not needed since BF is auxs
-            if "BF" in entry:
-                continue
-
-            entry_info = full_channel_map[entry]
-            # skip if this is not our system
-            if not is_subsystem(entry_info):
-                continue
-
-            # --- add info for this channel
-            # FlashCam channel, unique for geds/spms/pulser
-            ch = entry_info["daq"]["fcid"]
-            df_map.at[ch, "name"] = entry_info["name"]
-            # number/name of string/fiber for geds/spms, dummy for pulser
-            df_map.at[ch, "location"] = (
-                0
+        df_map = pd.DataFrame(
+            {
+                # FlashCam channel, unique for geds/spms/pulser
+                "channel": records["channel"],
+                "name": records["name"],
+                # number/name of string/fiber for geds/spms, dummy for pulser
+                "location": 0
                 if self.type == "pulser"
-                else entry_info["location"][loc_code[self.type]]
-            )
-            # position in string/fiber for geds/spms, dummy for pulser (works if there is only one pulser channel)
-            df_map.at[ch, "position"] = (
-                0 if self.type == "pulser" else entry_info["location"]["position"]
-            )
-            # CC4 information - will be None for L60 or spms -> put an if condition to avoid?
-            df_map.at[ch, "cc4_id"] = (
-                entry_info["electronics"]["cc4"]["id"] if self.type == "geds" else None
-            )
-            df_map.at[ch, "cc4_channel"] = (
-                entry_info["electronics"]["cc4"]["channel"]
-                if self.type == "geds"
-                else None
-            )
-
-        df_map = df_map.reset_index()
-
-        # -------------------------------------------------------------------------
+                else records[loc_code[self.type]],
+                # position in string/fiber for geds/spms, dummy for pulser (works if there is only one pulser channel)
+                "position": 0 if self.type == "pulser" else records["position"],
+                # inner/outer barrel - only for spms
+                "barrel": get_barrel(records) if self.type == "spms" else None,
+                # CC4 information - only for geds
+                "cc4_id": records["cc4_id"] if self.type == "geds" else None,
+                "cc4_channel": records["cc4_channel"] if self.type == "geds" else None,
+            }
+        )
 
-        # stupid dataframe, can use dtype somehow to fix it?
+        # integers might have become float if other systems have None there
         for col in ["channel", "location", "position", "cc4_channel"]:
-            if isinstance(df_map[col].loc[0], float):
+            if pd.api.types.is_float_dtype(df_map[col]) and df_map[col].notna().all():
                 df_map[col] = df_map[col].astype(int)
 
         # sort by channel -> do we really need to?
-        df_map = df_map.sort_values("channel")
+        df_map = df_map.sort_values("channel").reset_index(drop=True)
         return df_map
 
     def get_channel_status(self):
         """
         Add status column to channel map with On/Off for software status.
 
-        setup_info: dict with the keys 'experiment' and 'period'
-
-        Later will probably be changed to get channel status by timestamp (or hopefully run, if possible)
+        Status is looked up by the first timestamp of the selection and the data type, and cached between runs.
         """
         utils.logger.info("... getting channel status")
 
-        # -------------------------------------------------------------------------
-        # load full status map of this time selection
-        # -------------------------------------------------------------------------
-
-        full_status_map = LEGEND_META.dataprod.config.on(
-            timestamp=self.first_timestamp, system=self.datatype
-        )["hardware_configuration"]["channel_map"]
-
+        status = metadata.get_channel_status(
+            self.first_timestamp, self.datatype, self.metadata_cache
+        )
         # AUX channels are not in status map, so at least for pulser need default On
-        self.channel_map["status"] = "On"
-        self.channel_map = self.channel_map.set_index("channel")
-        for channel in full_status_map:
-            # convert string channel ('ch005') to integer (5)
-            ch = int(channel[2:])
-            # status map contains all channels, check if this channel is in our subsystem
-            if ch in self.channel_map.index:
-                self.channel_map.at[ch, "status"] = full_status_map[channel][
-                    "software_status"
-                ]
-
-        self.channel_map = self.channel_map.reset_index()
+        self.channel_map["status"] = (
+            self.channel_map["channel"].map(status).fillna("On")
+        )
 
     def get_parameters_for_dataloader(self, parameters: typing.Union[str, list_of_str]):
         """
@@ -434,7 +519,7 @@ class Subsystem:
 
         - parameters that are always loaded (+ pulser special case)
         - parameters that are already in lh5
-        - parameters needed for calculation, if special parameter(s) asked (e.g. wf_max_rel)
+        - parameters needed for calculation, if derived parameter(s) asked (e.g. wf_max_rel, see derived.resolve())
         """
         # --- always read timestamp
         params = ["timestamp"]
@@ -447,23 +532,10 @@ class Subsystem:
         if isinstance(parameters, str):
             parameters = [parameters]
 
-        global USER_TO_PYGAMA
-        for param in parameters:
-            if param in utils.SPECIAL_PARAMETERS:
-                # for special parameters, look up which parameters are needed to be loaded for their calculation
-                # if none, ignore
-                params += (
-                    utils.SPECIAL_PARAMETERS[param]
-                    if utils.SPECIAL_PARAMETERS[param]
-                    else []
-                )
-            else:
-                # otherwise just add the parameter directly
-                params.append(param)
-
-        # add K_lines energy if needed
-        # if 'K_lines' in parameters:
-        #     params.append(SPECIAL_PARAMETERS['K_lines'][0])
+        # for derived parameters, the parameters needed for their calculation
+        params += derived.get_columns(parameters)
+        # parameters needed to select events of requested types
+        params += derived.get_columns(selection.get_cut_parameters(self.event_types))
 
         # some parameters might be repeated twice - remove
         return list(np.unique(params))
@@ -545,3 +617,240 @@ class Subsystem:
         }
 
         return dict_dlconfig, dict_dbconfig
+
+
+# -------------------------------------------------------------------------
+# channel map helpers
+# -------------------------------------------------------------------------
+
+
+def get_barrel(records: pd.DataFrame) -> pd.Series:
+    """
+    Return barrel of each SiPM in given channel records (see metadata.get_channel_records()).
+
+    Taken from the location in the channel map if given there, otherwise from the fiber name (IB... or OB...).
+    Records cached before the barrel was looked up have no 'barrel' column, their barrel also comes from the fiber name.
+    """
+    fiber_barrel = records["fiber"].str[:2]
+    if "barrel" not in records:
+        return fiber_barrel
+    return records["barrel"].where(records["barrel"].notna(), fiber_barrel)
+
+
+# -------------------------------------------------------------------------
+# loading data of several subsystems at once
+# -------------------------------------------------------------------------
+
+
+def get_subsystems_data(
+    subsystems: list, parameters: dict, cache=None, pulser_timestamps=None
+):
+    """
+    Load data for several subsystems in as few passes over the LH5 files as possible.
+
+    subsystems: list of Subsystem objects
+    parameters: dict of format {<subsystem type>: <single parameter or list of parameters to load>}
+    cache: [optional] cache.DataCache object, see Subsystem.get_data()
+    pulser_timestamps: [optional] see Subsystem.get_data()
+
+    Subsystems looking at the same files (same path, version and query) and needing the same tiers
+    are loaded together: their parameters and channels are merged in one DataLoader configuration,
+    so that each file is opened only once per tier. The loaded data is then split back by channel
+    and each subsystem gets its own "primed" data, same as with Subsystem.get_data().
+
+    Subsystems needing different tiers are loaded separately, since the DataLoader only returns
+    events of channels that are present in the highest tier (e.g. AUX channels have no hit tier).
+    Events no plot of their subsystem needs are dropped from each file chunk while loading (see Subsystem.get_load_mask()).
+    """
+    utils.logger.info("... getting data")
+
+    # -------------------------------------------------------------------------
+    # Set up DataLoader configs of each subsystem, and group those that can be loaded together
+    # -------------------------------------------------------------------------
+    utils.logger.info("...... setting up DataLoader")
+
+    # {(path, version, query, tiers): [(subsystem, parameters, dlconfig, dbconfig), ...]}
+    load_plan = {}
+    for sub in subsystems:
+        # --- construct list of parameters for the data loader
+        # depending on derived parameters, k lines etc.
+        params = sub.get_parameters_for_dataloader(parameters.get(sub.type, ()))
+        # --- set up DataLoader config
+        # needs to know path and version from data_info
+        dlconfig, dbconfig = sub.construct_dataloader_configs(params)
+
+        group = (sub.path, sub.version, sub.get_query(), tuple(dbconfig["columns"]))
+        load_plan.setdefault(group, []).append((sub, params, dlconfig, dbconfig))
+
+    # -------------------------------------------------------------------------
+    # Load each group in one go and split
+    # -------------------------------------------------------------------------
+
+    for (_, _, query, _), group in load_plan.items():
+        utils.logger.info(
+            "...... loading together: " + ", ".join(x[0].type for x in group)
+        )
+
+        # --- merge configs: union of channels and columns for each tier
+        dlconfig, dbconfig = group[0][2], group[0][3]
+        for _, _, _, sub_dbconfig in group[1:]:
+            for tier in dbconfig["tables"]:
+                dbconfig["tables"][tier] = sorted(
+                    set(dbconfig["tables"][tier]) | set(sub_dbconfig["tables"][tier])
+                )
+                dbconfig["columns"][tier] = sorted(
+                    set(dbconfig["columns"][tier]) | set(sub_dbconfig["columns"][tier])
+                )
+        params = sorted({param for x in group for param in x[1]})
+
+        filedb = group[0][0].get_filedb(dbconfig)
+        dl = set_up_dataloader(dlconfig, dbconfig, query, params, filedb)
+        data = load_data(
+            dl, dbconfig, cache, get_group_selector(group, pulser_timestamps)
+        )
+
+        # --- split by channel
+        for sub, sub_params, _, _ in group:
+            channels = sub.channel_map["channel"]
+            sub.data = data[data["channel"].isin(channels)][["channel"] + sub_params]
+            sub.data = sub.data.reset_index(drop=True)
+            if sub.data.empty:
+                utils.logger.warning(f"No {sub.type} data for this selection!")
+            sub.prime_data()
+
+
+def get_group_selector(group: list, pulser_timestamps=None):
+    """
+    Return function selecting rows of a file chunk loaded for a group of subsystems, None if all rows are needed.
+
+    group: list of (subsystem, ...) loaded together; each row is kept if its subsystem needs it (see Subsystem.get_load_mask())
+    """
+    subsystems = [x[0] for x in group]
+    if not any(sub.load_selection for sub in subsystems):
+        return None
+
+    def select(data: pd.DataFrame) -> np.ndarray:
+        keep = np.zeros(len(data), dtype=bool)
+        for sub in subsystems:
+            of_sub = data["channel"].isin(sub.channel_map["channel"]).to_numpy()
+            keep |= of_sub & sub.get_load_mask(data, pulser_timestamps)
+        return keep
+
+    return select
+
+
+def match_timestamps(times, reference, tolerance: pd.Timedelta) -> np.ndarray:
+    """
+    Return boolean array, True where times are within tolerance of any of the reference times.
+
+    times, reference: datetime Series or int64 nanoseconds (see event_time.to_ns())
+
+    Reference times are sorted once, then the closest ones to each time are found with a binary search:
+    O((n + m) log m) for n times and m reference times, no index needed and no exact match required.
+    """
+    if len(reference) == 0:
+        return np.zeros(len(times), dtype=bool)
+
+    # as int64 nanoseconds
+    times = event_time.to_ns(times)
+    reference = np.sort(event_time.to_ns(reference))
+
+    # closest reference time on the right and on the left
+    right = np.searchsorted(reference, times).clip(max=len(reference) - 1)
+    left = (right - 1).clip(min=0)
+    distance = np.minimum(
+        np.abs(times - reference[left]), np.abs(times - reference[right])
+    )
+
+    return distance <= tolerance.value
+
+
+def set_up_dataloader(
+    dlconfig: dict,
+    dbconfig: dict,
+    query: str,
+    params: list_of_str,
+    filedb: FileDB = None,
+) -> DataLoader:
+    """
+    Set up DataLoader with given configs to load given parameters for files matching query.
+
+    filedb: [optional] FileDB to use (see Subsystem.get_filedb()); if not given, the DataLoader scans the files itself
+    """
+    # --- set up DataLoader
+    dl = DataLoader(dlconfig, dbconfig if filedb is None else filedb)
+
+    utils.logger.info(
+        "...... querying DataLoader (includes quickfix-removed faulty files for r010)"
+    )
+    utils.logger.info(query)
+
+    # --- query data loader
+    dl.set_files(query)
+    dl.set_output(fmt="pd.DataFrame", columns=params)
+
+    return dl
+
+
+def load_data(
+    dl: DataLoader,
+    dbconfig: dict,
+    cache=None,
+    selector=None,
+    files_per_chunk: int = 10,
+) -> pd.DataFrame:
+    """
+    Load data of files selected in given DataLoader, set up with set_up_dataloader().
+
+    selector: [optional] function returning boolean array of rows to keep for a DataFrame of loaded rows
+        (see Subsystem.get_load_selector()); if given, files are loaded in chunks of files_per_chunk files
+        (each file on its own when read from cache), and each chunk is selected before all are concatenated
+
+    Returns DataFrame with column channel (instead of <tier>_table) and the requested parameters;
+    empty (with these columns) if no file matches the selection (e.g. empty time range).
+    """
+    if not len(dl.file_list):
+        utils.logger.warning("No files to load for this selection!")
+        return pd.DataFrame(
+            columns=["channel"]
+            + list(
+                dict.fromkeys(
+                    col for columns in dbconfig["columns"].values() for col in columns
+                )
+            )
+        )
+
+    now = datetime.now()
+    if cache is None:
+        all_files = dl.file_list
+        chunks = (
+            [all_files]
+            if selector is None
+            else [
+                all_files[first : first + files_per_chunk]
+                for first in range(0, len(all_files), files_per_chunk)
+            ]
+        )
+        data = []
+        for file_list in chunks:
+            dl.file_list = file_list
+            chunk = dl.load()
+
+            # -------------------------------------------------------------------------
+            # polish things up
+            # -------------------------------------------------------------------------
+
+            tier = "hit" if "hit" in dbconfig["columns"] else "dsp"
+            # remove columns we don't need
+            chunk = chunk.drop([f"{tier}_idx", "file"], axis=1)
+            # rename channel to channel
+            chunk = chunk.rename(columns={f"{tier}_table": "channel"})
+            data.append(chunk if selector is None else chunk[selector(chunk)])
+        dl.file_list = all_files
+        data = data[0] if len(data) == 1 else pd.concat(data, ignore_index=True)
+    else:
+        # already polished up by the cache
+        data = cache.load(dl, dbconfig, selector)
+    utils.logger.info(f"Total time to load data: {(datetime.now() - now)}")
+
+    return data
@@ -1,4 +1,3 @@
-import glob
 import importlib.resources
 import json
 import logging
@@ -38,14 +37,16 @@ with open(pkg / "settings" / "par-settings.json") as f:
 with open(pkg / "settings" / "parameter-tiers.json") as f:
     PARAMETER_TIERS = json.load(f)
 
-# which lh5 parameters are needed to be loaded from lh5 to calculate them
-with open(pkg / "settings" / "special-parameters.json") as f:
-    SPECIAL_PARAMETERS = json.load(f)
+# event types: pulser flag and/or cut on (derived) parameters, see selection.py
+with open(pkg / "settings" / "event-types.json") as f:
+    EVENT_TYPES = json.load(f)
 
-# convert all to lists for convenience
-for param in SPECIAL_PARAMETERS:
-    if isinstance(SPECIAL_PARAMETERS[param], str):
-        SPECIAL_PARAMETERS[param] = [SPECIAL_PARAMETERS[param]]
+# available plot structures and styles: keys of plotting.PLOT_STRUCTURE and plot_styles.PLOT_STYLE
+# (only names here, so that configs can be checked without importing matplotlib)
+PLOT_STRUCTURES = ["per channel", "per string", "per barrel", "top bottom"]
+# structures grouping SiPMs by barrel, only for spms
+SIPM_STRUCTURES = ["per barrel", "top bottom"]
+PLOT_STYLES = ["vs time", "histogram", "scatter", "heatmap"]
 
 # -------------------------------------------------------------------------
 
@@ -72,6 +73,9 @@ def get_query_times(**kwargs):
 
     Path, version, and type only needed because channel map and status cannot be queried by run directly,
         so we need these to look up first timestamp in data path to run.
+    The first timestamp of a run is looked up in the file catalog (see catalog.FileCatalog):
+        file_catalog= [optional] FileCatalog object to use, otherwise created for given path and version
+        catalog= [optional] str: path of the catalog file
 
     >>> get_query_times(..., start='2022-09-28 08:00:00', end='2022-09-28 09:30:00')
     {'timestamp': {'start': '20220928T080000Z', 'end': '20220928T093000Z'}}, '20220928T080000Z'
@@ -95,28 +99,24 @@ def get_query_times(**kwargs):
         # find earliest run, format rXXX
         first_run = min(timerange["run"])
 
-        # --- get dsp filelist of this run
+        # --- look up in the file catalog instead of walking the production tree
         # if setup= keyword was used, get dict; otherwise kwargs is already the dict we need
         path_info = kwargs["dataset"] if "dataset" in kwargs else kwargs
-
-        # format to search /path/to/prod-ref/v06.00/generated/tier/**/phy/**/r027
-        glob_path = os.path.join(
-            path_info["path"],
-            path_info["version"],
-            "generated",
-            "tier",
-            "**",
-            path_info["type"],
-            "**",
-            first_run,
-            "*.lh5",
-        )
-        dsp_files = glob.glob(glob_path)
-        # find earliest
-        dsp_files.sort()
-        first_file = dsp_files[0]
-        # extract timestamp
-        first_timestamp = get_key(first_file)
+        file_catalog = kwargs.get("file_catalog")
+        if file_catalog is None:
+            from .catalog import FileCatalog
+
+            file_catalog = FileCatalog(
+                os.path.join(
+                    path_info["path"], path_info["version"], "generated", "tier"
+                ),
+                kwargs.get("catalog"),
+            )
+
+        first_timestamp = file_catalog.get_first_timestamp(path_info["type"], first_run)
+        if first_timestamp is None:
+            logger.error(f"No {path_info['type']} files found for run {first_run}!")
+            return None, ""
 
     return timerange, first_timestamp
 
@@ -224,11 +224,16 @@ def get_query_timerange(**kwargs):
 
 
 def check_plot_settings(conf: dict):
-    from .plotting import PLOT_STRUCTURE, PLOT_STYLE
+    """
+    Check plot settings of all subsystems in given config.
 
+    Plot structure and style have to be available, see PLOT_STRUCTURES and PLOT_STYLES (SIPM_STRUCTURES only for spms),
+    and parameters have to be described in settings/par-settings.json (with a valid expression, if derived).
+    Returns False if something is wrong, True otherwise.
+    """
     options = {
-        "plot_structure": PLOT_STRUCTURE.keys(),
-        "plot_style": PLOT_STYLE.keys(),
+        "plot_structure": PLOT_STRUCTURES,
+        "plot_style": PLOT_STYLES,
     }
 
     for subsys in conf["subsystems"]:
@@ -261,13 +266,40 @@ def check_plot_settings(conf: dict):
                     )
                     return False
 
-            # if vs time was provided, need time window
+            # SiPM structures need the barrel of each channel, which only SiPMs have
+            if plot_settings["plot_structure"] in SIPM_STRUCTURES and subsys != "spms":
+                logger.error(
+                    f"Plot structure '{plot_settings['plot_structure']}' of '{plot}' is only available for spms, not for {subsys}!"
+                )
+                return False
+
+            # check if parameters are known
+            if "parameters" not in plot_settings:
+                logger.error(
+                    f"Provide parameters in plot settings of '{plot}' for {subsys}!"
+                )
+                return False
+
+            params = plot_settings["parameters"]
+            for param in [params] if isinstance(params, str) else params:
+                if param not in PLOT_INFO:
+                    logger.error(
+                        f"Parameter {param} provided in plot settings of '{plot}' for {subsys} is not in par-settings.json!"
+                    )
+                    return False
+                # derived imports utils -> import here
+                from . import derived
+
+                if not derived.check_parameter(param):
+                    return False
+
+            # if vs time or heatmap was provided, need time window
             if (
-                plot_settings["plot_style"] == "vs time"
+                plot_settings["plot_style"] in ["vs time", "heatmap"]
                 and "time_window" not in plot_settings
             ):
                 logger.error(
-                    "You chose plot style 'vs time' and did not provide 'time_window'!"
+                    f"You chose plot style '{plot_settings['plot_style']}' and did not provide 'time_window'!"
                 )
                 return False
 
@@ -321,16 +353,18 @@ def make_dir(dir_path):
     logger.info(message)
 
 
+def get_plot_parameters(plot_settings: dict) -> list:
+    """Get list of parameters of given plot settings, which can be given as one parameter or a list."""
+    parameters = plot_settings["parameters"]
+    return [parameters] if isinstance(parameters, str) else list(parameters)
+
+
 def get_all_plot_parameters(subsystem: str, config: dict):
     """Get list of all parameters needed for all plots for given subsystem."""
     all_parameters = []
     if subsystem in config["subsystems"]:
         for plot in config["subsystems"][subsystem]:
-            parameters = config["subsystems"][subsystem][plot]["parameters"]
-            if isinstance(parameters, str):
-                all_parameters.append(parameters)
-            else:
-                all_parameters += parameters
+            all_parameters += get_plot_parameters(config["subsystems"][subsystem][plot])
 
     return all_parameters
 
@@ -0,0 +1,89 @@
+import json
+
+import matplotlib
+import numpy as np
+import pandas as pd
+
+from legend_data_monitor import core, streaming
+
+matplotlib.use("Agg")
+
+
+class FakeSubsystem:
+    """Stand-in for Subsystem: data given in chunks instead of loaded with the DataLoader."""
+
+    type = "geds"
+    experiment = "l200"
+    version = "v0"
+    datatype = "phy"
+    pulser_tolerance = pd.Timedelta(0)
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.channel_map = pd.DataFrame(
+            {
+                "channel": [1, 2],
+                "name": ["a", "b"],
+                "location": [1, 1],
+                "position": [1, 2],
+                "status": "On",
+            }
+        )
+        self.data = pd.DataFrame()
+
+    def iterate_data(
+        self, parameters, cache=None, files_per_chunk=10, pulser_timestamps=None
+    ):
+        for chunk in self.chunks:
+            self.data = chunk.copy()
+            yield self.data
+
+    def flag_pulser_events(self, pulser=None):
+        self.data["flag_pulser"] = False
+
+
+def test_streaming_with_histogram(tmp_path):
+    rng = np.random.default_rng(5)
+    n = 6000
+    data = pd.DataFrame(
+        {
+            "channel": rng.choice([1, 2], n),
+            "datetime": pd.Timestamp("2023-01-01", tz="UTC")
+            + pd.to_timedelta(np.sort(rng.uniform(0, 4 * 3600, n)), unit="s"),
+            "baseline": rng.normal(100, 5, n),
+        }
+    )
+    sub = FakeSubsystem([data.iloc[: n // 2], data.iloc[n // 2 :]])
+    plots = {
+        "baseline vs time": {
+            "parameters": "baseline",
+            "event_type": "all",
+            "plot_style": "vs time",
+            "plot_structure": "per channel",
+            "time_window": "10T",
+        },
+        "baseline histogram": {
+            "parameters": "baseline",
+            "event_type": "all",
+            "plot_style": "histogram",
+            "plot_structure": "per channel",
+        },
+    }
+    config = {
+        "output": str(tmp_path),
+        "anomalies": {"min_periods": 5},
+        "subsystems": {"geds": plots},
+    }
+    (tmp_path / "json_files").mkdir()
+
+    analyses = streaming.stream_subsystem_plots(
+        sub, plots, pd.Series([], dtype="datetime64[ns, UTC]")
+    )
+    core.plot_subsystem(sub, config, str(tmp_path / "out"), analyses)
+
+    # histogram aggregates are not a time series: no report, but no crash either
+    with open(tmp_path / "json_files" / "out_geds_anomalies.json") as f:
+        report = json.load(f)
+    assert report["baseline histogram"] == []
+    assert {x["channel"] for x in report["baseline vs time"]} == {1, 2}
+    assert (tmp_path / "out_geds.pdf").exists()
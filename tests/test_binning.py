@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+from legend_data_monitor.binning import bin_in_time
+
+
+def make_events(n=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    time = pd.Timestamp("2023-01-01", tz="UTC") + pd.to_timedelta(
+        np.sort(rng.uniform(0, 4 * 3600, n)), unit="s"
+    )
+    data = pd.DataFrame(
+        {
+            "channel": rng.choice([1, 2, 7], n),
+            "datetime": time,
+            "value": rng.normal(100, 5, n),
+        }
+    )
+    # a few NaN values, and a gap with empty windows for one channel
+    data.loc[rng.choice(n, 50, replace=False), "value"] = np.nan
+    gap = (data["channel"] == 7) & (data["datetime"] > time[n // 3])
+    gap &= data["datetime"] < time[n // 2]
+    return data[~gap].reset_index(drop=True)
+
+
+def test_bin_in_time_as_resample():
+    data = make_events()
+    bins = bin_in_time(data["channel"], data["datetime"], "10T", data["value"])
+
+    for channel, bins_ch in bins.groupby("channel"):
+        expected = (
+            data[data["channel"] == channel]
+            .set_index("datetime")["value"]
+            .resample("10T", origin="start")
+            .agg(["count", "mean", "std", "min", "max"])
+        )
+        assert (bins_ch["start"].to_numpy() == expected.index.to_numpy()).all()
+        for column in expected:
+            np.testing.assert_allclose(
+                bins_ch[column].to_numpy(dtype=float),
+                expected[column].to_numpy(dtype=float),
+                rtol=1e-10,
+            )
+
+
+def test_bin_in_time_counts():
+    data = make_events()
+    bins = bin_in_time(data["channel"], data["datetime"], "30T")
+
+    for channel, bins_ch in bins.groupby("channel"):
+        expected = (
+            data[data["channel"] == channel]
+            .set_index("datetime")["channel"]
+            .resample("30T", origin="start")
+            .count()
+        )
+        assert (bins_ch["count"].to_numpy() == expected.to_numpy()).all()
+    # last partial window of each channel cut at the last event
+    assert (bins["duration"] <= pd.Timedelta("30T")).all()
+    assert bins["start"].add(bins["duration"]).max() == data["datetime"].max()
+
+
+def test_bin_in_time_empty():
+    bins = bin_in_time([], pd.Series([], dtype="datetime64[ns, UTC]"), "10T", [])
+    assert bins.empty
+    assert "mean" in bins
+
+
+def test_bin_in_time_several_parameters():
+    data = make_events()
+    data["other"] = data["value"] * 2 + 1
+    bins = bin_in_time(
+        data["channel"], data["datetime"], "10T", data[["value", "other"]]
+    )
+
+    counts = bin_in_time(data["channel"], data["datetime"], "10T")
+    assert (bins["count"] == counts["count"]).all()
+    for param in ["value", "other"]:
+        single = bin_in_time(data["channel"], data["datetime"], "10T", data[param])
+        for column in ["count", "sum", "mean", "min", "max", "std"]:
+            np.testing.assert_array_equal(bins[f"{param}_{column}"], single[column])
@@ -0,0 +1,124 @@
+import os
+
+import pandas as pd
+import pytest
+
+from legend_data_monitor.cache import DataCache
+
+FILES = ["f0.lh5", "f1.lh5", "f2.lh5"]
+
+
+class FakeDataLoader:
+    """Stand-in for pygama's DataLoader: same columns as DataLoader.load(), calls recorded."""
+
+    def __init__(self, level="hit", files=FILES):
+        self.level = level
+        self.files = files
+        self.file_list = list(range(len(files)))
+        self.calls = []
+
+    def get_file_list(self):
+        return pd.DataFrame(
+            {
+                "dsp_file": ["/" + f for f in self.files],
+                "hit_file": ["/" + f for f in self.files],
+            }
+        )
+
+    def set_output(self, fmt, columns):
+        self.columns = columns
+
+    def load(self):
+        self.calls.append((list(self.file_list), list(self.columns)))
+        rows = []
+        # no event of our channels in f1
+        for file in [f for f in self.file_list if f != 1]:
+            for channel in [3, 5]:
+                for idx in range(4):
+                    row = {
+                        f"{self.level}_table": channel,
+                        f"{self.level}_idx": idx,
+                        "file": file,
+                    }
+                    row.update(
+                        {
+                            col: file * 100 + channel * 10 + idx + len(col)
+                            for col in self.columns
+                        }
+                    )
+                    rows.append(row)
+        return pd.DataFrame(rows)
+
+
+@pytest.fixture
+def dbconfig(tmp_path):
+    for tier in ["dsp", "hit"]:
+        (tmp_path / "data" / tier).mkdir(parents=True)
+        for file in FILES:
+            (tmp_path / "data" / tier / file).write_text("")
+    return {
+        "data_dir": str(tmp_path / "data"),
+        "tier_dirs": {"dsp": "/dsp", "hit": "/hit"},
+        "tables": {"hit": [3, 5], "dsp": [3, 5]},
+        "columns": {"dsp": ["baseline", "timestamp"], "hit": ["cuspEmax_ctc_cal"]},
+    }
+
+
+def test_hit_and_miss(tmp_path, dbconfig):
+    cache = DataCache(str(tmp_path / "cache"))
+
+    dl = FakeDataLoader()
+    data = cache.load(dl, dbconfig)
+    assert dl.calls == [([0, 1, 2], ["baseline", "timestamp", "cuspEmax_ctc_cal"])]
+    assert list(data) == ["channel", "baseline", "timestamp", "cuspEmax_ctc_cal"]
+    assert len(data) == 16
+
+    # everything cached, also the file without events
+    dl = FakeDataLoader()
+    pd.testing.assert_frame_equal(cache.load(dl, dbconfig), data)
+    assert dl.calls == []
+
+    # only the new column is loaded
+    dbconfig["columns"]["dsp"].append("wf_max")
+    dl = FakeDataLoader()
+    more = cache.load(dl, dbconfig)
+    assert dl.calls == [([0, 1, 2], ["wf_max"])]
+    pd.testing.assert_frame_equal(more.drop(columns="wf_max"), data)
+
+
+def test_modified_file(tmp_path, dbconfig):
+    cache = DataCache(str(tmp_path / "cache"))
+    cache.load(FakeDataLoader(), dbconfig)
+
+    # reprocessed file: loaded again
+    path = tmp_path / "data" / "hit" / "f2.lh5"
+    path.write_text("reprocessed")
+    mtime = path.stat().st_mtime + 10
+    os.utime(path, (mtime, mtime))
+    dl = FakeDataLoader()
+    cache.load(dl, dbconfig)
+    assert dl.calls == [([2], ["cuspEmax_ctc_cal"])]
+
+
+def test_level(tmp_path, dbconfig):
+    cache = DataCache(str(tmp_path / "cache"))
+    cache.load(FakeDataLoader(), dbconfig)
+
+    # same dsp columns without hit tier: rows come from the dsp table, not found in the cache
+    del dbconfig["columns"]["hit"]
+    dl = FakeDataLoader(level="dsp")
+    data = cache.load(dl, dbconfig)
+    assert dl.calls == [([0, 1, 2], ["baseline", "timestamp"])]
+    assert list(data) == ["channel", "baseline", "timestamp"]
+
+
+def test_missing_and_no_files(tmp_path, dbconfig):
+    cache = DataCache(str(tmp_path / "cache"))
+    assert (
+        cache.find(str(tmp_path / "data" / "hit" / "none.lh5"), "hit", "hit", [3, 5])
+        == {}
+    )
+
+    data = cache.load(FakeDataLoader(files=[]), dbconfig)
+    assert data.empty
+    assert list(data) == ["channel", "baseline", "timestamp", "cuspEmax_ctc_cal"]
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+
+from legend_data_monitor import channels
+
+
+def test_repeated_memory_usage():
+    channel_map = pd.DataFrame(
+        {
+            "channel": [1000, 1001, 1002],
+            "name": ["V00001", "V00002", "P00003"],
+            "location": [1, 1, 2],
+            "status": ["On", "Off", "On"],
+        }
+    )
+    channel = pd.Series(np.random.default_rng(6).choice([1000, 1002, 5], 1000))
+
+    # same as joining the channel map as it is to each event
+    joined = channel_map.set_index("channel").reindex(channel).reset_index(drop=True)
+    joined = joined[channel.isin(channel_map["channel"]).to_numpy()]
+    expected = joined.memory_usage(deep=True, index=False).sum()
+    assert channels.get_repeated_memory_usage(channel_map, channel) == expected
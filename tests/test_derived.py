@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+
+from legend_data_monitor import derived, utils
+
+
+@pytest.fixture
+def plot_info(monkeypatch):
+    info = {
+        "diff": {"expression": "wf_max - baseline"},
+        "rel": {"expression": "diff / baseline"},
+        "loop_a": {"expression": "loop_b + 1"},
+        "loop_b": {"expression": "2 * loop_a"},
+        "uses_loop": {"expression": "loop_a - baseline"},
+        "broken": {"expression": "wf_max -"},
+    }
+    monkeypatch.setattr(utils, "PLOT_INFO", info)
+    return info
+
+
+def test_get_inputs():
+    assert derived.get_inputs("abs(wf_max - baseline) / baseline") == [
+        "wf_max",
+        "baseline",
+    ]
+
+
+def test_resolve(plot_info):
+    assert derived.resolve("rel") == (["wf_max", "baseline"], ["diff", "rel"])
+    assert derived.resolve(["baseline", "event_rate", "diff"]) == (
+        ["baseline", "wf_max"],
+        ["diff"],
+    )
+
+
+def test_resolve_cycle(plot_info, caplog):
+    assert derived.resolve("loop_a") == ([], [])
+    assert "loop_a -> loop_b -> loop_a" in caplog.text
+    # parameters depending on a cycle are left out too, others are resolved
+    assert derived.resolve(["uses_loop", "diff"]) == (
+        ["baseline", "wf_max"],
+        ["diff"],
+    )
+
+
+def test_check_parameter(plot_info):
+    assert derived.check_parameter("rel")
+    assert derived.check_parameter("baseline")
+    assert not derived.check_parameter("loop_b")
+    assert not derived.check_parameter("uses_loop")
+    assert not derived.check_parameter("broken")
+
+
+def test_evaluate(plot_info):
+    data = pd.DataFrame({"wf_max": [3.0, 8.0], "baseline": [1.0, 2.0]})
+    assert derived.evaluate(data, "rel").tolist() == [2.0, 3.0]
+    # no columns added to data
+    assert list(data) == ["wf_max", "baseline"]
+    assert list(derived.calculate(data, ["rel"])) == [
+        "wf_max",
+        "baseline",
+        "diff",
+        "rel",
+    ]
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from legend_data_monitor.histograms import ChannelHistograms
+
+
+def make_events(n=4000, seed=2):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(
+        {
+            "channel": rng.choice([1, 4, 6], n),
+            "datetime": pd.Timestamp("2023-01-01", tz="UTC")
+            + pd.to_timedelta(np.arange(n), unit="s"),
+            "value": rng.normal(50, 10, n),
+        }
+    )
+    # NaN values, values outside the range and exactly on bin edges
+    data.loc[:9, "value"] = np.nan
+    data.loc[10:19, "value"] = 1000
+    data.loc[20:29, "value"] = [0, 10, 20, 30, 40, 60, 70, 80, 90, 100]
+    return data
+
+
+def assert_as_np_histogram(histos, data, no_bins, x_min, x_max):
+    for channel, values in data.groupby("channel")["value"]:
+        if isinstance(x_min, pd.Series):
+            range_ch = (x_min[channel], x_max[channel])
+        else:
+            range_ch = (x_min, x_max)
+        counts, edges = np.histogram(values, no_bins, range_ch)
+        assert (histos.counts.loc[channel].to_numpy() == counts).all()
+        np.testing.assert_allclose(histos.edges.loc[channel].to_numpy(), edges)
+
+
+def test_from_values():
+    data = make_events()
+    histos = ChannelHistograms.from_values(
+        data["channel"], data["value"], (37, [0, 100])
+    )
+    assert_as_np_histogram(histos, data, 37, 0, 100)
+
+
+def test_range_per_channel():
+    data = make_events()
+    data = data[data["value"] < 1000]
+    groups = data.groupby("channel")["value"]
+    x_min, x_max = groups.min(), groups.max()
+    histos = ChannelHistograms.from_values(
+        data["channel"], data["value"], (50, [x_min, x_max])
+    )
+    assert_as_np_histogram(histos, data, 50, x_min, x_max)
+
+
+def test_update_in_chunks(tmp_path):
+    data = make_events()
+    histos = ChannelHistograms()
+    for rows in np.array_split(np.arange(len(data)), 3):
+        chunk = data.iloc[rows]
+        histos.update(
+            chunk["channel"], chunk["value"], (20, [0, 100]), chunk["datetime"]
+        )
+        # saved and loaded between chunks, as between runs
+        histos.save(tmp_path / "histos.json")
+        histos = ChannelHistograms.load(tmp_path / "histos.json")
+    assert_as_np_histogram(histos, data, 20, 0, 100)
+
+    # events already included are not counted twice
+    histos.update(data["channel"], data["value"], (20, [0, 100]), data["datetime"])
+    assert_as_np_histogram(histos, data, 20, 0, 100)
@@ -0,0 +1,67 @@
+import os
+import subprocess
+
+import pytest
+
+from legend_data_monitor import metadata
+
+
+@pytest.fixture
+def meta_dir(tmp_path, monkeypatch):
+    path = tmp_path / "legend-metadata"
+    path.mkdir()
+    (path / "channelmap.json").write_text("{}")
+    monkeypatch.setenv("LEGEND_METADATA", str(path))
+    return path
+
+
+def load(cache_dir, calls):
+    def query():
+        calls.append(1)
+        return {"V00001": "On"}
+
+    return metadata.load_cached("status", "20230101T000000Z", "phy", query, cache_dir)
+
+
+def test_load_cached(tmp_path, meta_dir):
+    calls = []
+    assert load(tmp_path / "cache", calls) == {"V00001": "On"}
+    assert load(tmp_path / "cache", calls) == {"V00001": "On"}
+    assert len(calls) == 1
+
+    # metadata updated: looked up again
+    mtime = os.path.getmtime(meta_dir / "channelmap.json") + 10
+    os.utime(meta_dir / "channelmap.json", (mtime, mtime))
+    load(tmp_path / "cache", calls)
+    assert len(calls) == 2
+
+
+def test_git_version(meta_dir):
+    def git(*args):
+        subprocess.run(
+            [
+                "git",
+                "-C",
+                str(meta_dir),
+                "-c",
+                "user.name=test",
+                "-c",
+                "user.email=test",
+            ]
+            + list(args),
+            check=True,
+            capture_output=True,
+        )
+
+    try:
+        git("init", "-q")
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        pytest.skip("git not available")
+    git("add", "channelmap.json")
+    git("commit", "-q", "-m", "first")
+    first = metadata.get_metadata_version(str(meta_dir))
+    assert len(first) == 40
+
+    (meta_dir / "channelmap.json").write_text('{"V00001": {}}')
+    git("commit", "-q", "-a", "-m", "second")
+    assert metadata.get_metadata_version(str(meta_dir)) not in [first, None]
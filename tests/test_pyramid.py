@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+from legend_data_monitor.binning import bin_in_time
+from legend_data_monitor.pyramid import EPOCH, TimePyramid
+
+
+def make_events(n=6000, seed=3):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "channel": rng.choice([2, 9], n),
+            "datetime": pd.Timestamp("2023-01-01 00:17", tz="UTC")
+            + pd.to_timedelta(np.sort(rng.uniform(0, 6 * 3600, n)), unit="s"),
+            "value": rng.normal(10, 1, n),
+        }
+    )
+
+
+def test_read_as_bin_in_time(tmp_path):
+    data = make_events()
+    path = str(tmp_path / "pyramid")
+    chunks = [data.iloc[rows] for rows in np.array_split(np.arange(len(data)), 3)]
+
+    # chunk by chunk in memory, written once
+    pyramid = TimePyramid(path)
+    for chunk in chunks[:2]:
+        pyramid.update(chunk["channel"], chunk["datetime"], chunk["value"])
+        assert not (tmp_path / "pyramid").exists()
+    pyramid.save()
+    # next run
+    pyramid = TimePyramid(path)
+    pyramid.update(chunks[2]["channel"], chunks[2]["datetime"], chunks[2]["value"])
+    pyramid.save()
+
+    # read back from disk, windows aligned to EPOCH
+    result = TimePyramid(str(tmp_path / "pyramid")).read("2H")
+    expected = bin_in_time(
+        data["channel"],
+        data["datetime"],
+        "2H",
+        data["value"],
+        origin=pd.Series(EPOCH, index=data["channel"].unique()),
+        end=data["datetime"].max(),
+    )
+    expected = expected[expected["count"] > 0].reset_index(drop=True)
+
+    assert (result["channel"].to_numpy() == expected["channel"].to_numpy()).all()
+    assert (result["count"].to_numpy() == expected["count"].to_numpy()).all()
+    for column in ["mean", "std", "min", "max"]:
+        np.testing.assert_allclose(result[column], expected[column], rtol=1e-10)
+    # windows cut to the time range of the events included
+    assert result["start"].min() == data["datetime"].min()
+    assert (result["start"] + result["duration"]).max() == data["datetime"].max()
+
+
+def test_read_event_rate(tmp_path):
+    data = make_events()
+    pyramid = TimePyramid(str(tmp_path / "pyramid"))
+    pyramid.update(data["channel"], data["datetime"])
+
+    result = pyramid.read("30T")
+    expected = bin_in_time(
+        data["channel"],
+        data["datetime"],
+        "30T",
+        origin=pd.Series(EPOCH, index=data["channel"].unique()),
+    )
+    expected = expected[expected["count"] > 0]
+    assert (result["count"].to_numpy() == expected["count"].to_numpy()).all()
+
+
+def test_read_no_level(tmp_path):
+    pyramid = TimePyramid(str(tmp_path / "pyramid"))
+    assert pyramid.read("1H") is None
+    assert pyramid.read("90S") is None
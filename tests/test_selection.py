@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from legend_data_monitor import selection, utils
+
+
+def test_combine_selections():
+    assert selection.combine_selections(["K_lines", "phy"]) == {"pulser": False}
+    assert selection.combine_selections(["K_lines"]) == {
+        "pulser": False,
+        "cut": "(K_lines > 1430) & (K_lines < 1575)",
+    }
+    # pulser and non-pulser events, or all events: no selection
+    assert selection.combine_selections(["pulser", "phy"]) == {}
+    assert selection.combine_selections(["all", "pulser"]) == {}
+    assert selection.combine_selections([]) == {}
+
+
+def test_combine_cuts(monkeypatch):
+    event_types = {
+        "low": {"pulser": False, "cut": "energy < 10"},
+        "high": {"pulser": False, "cut": "energy > 100"},
+        "low_pulser": {"pulser": True, "cut": "energy < 10"},
+    }
+    monkeypatch.setattr(utils, "EVENT_TYPES", event_types)
+
+    assert selection.combine_selections(["low", "high", "low"]) == {
+        "pulser": False,
+        "cut": "(energy < 10) | (energy > 100)",
+    }
+    assert selection.combine_selections(["low", "low_pulser"]) == {"cut": "energy < 10"}
+
+    # combined selection keeps events of any of the event types
+    data = pd.DataFrame({"energy": [1.0, 50.0, 200.0, 5.0]})
+    flag_pulser = np.array([False, False, False, True])
+    combined = selection.combine_selections(["low", "high"])
+    keep = selection.get_mask(data, combined, flag_pulser)
+    assert keep.tolist() == [True, False, True, False]
+    for evt_type in ["low", "high"]:
+        mask = selection.get_mask(data, event_types[evt_type], flag_pulser)
+        assert not (mask & ~keep).any()
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+from legend_data_monitor.stats import ChannelStats
+
+
+def make_events(n=3000, seed=1):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(
+        {
+            "channel": rng.choice([3, 5, 8], n),
+            "datetime": pd.Timestamp("2023-01-01", tz="UTC")
+            + pd.to_timedelta(np.arange(n), unit="s"),
+            "value": rng.normal(1000, 20, n),
+        }
+    )
+    data.loc[rng.choice(n, 30, replace=False), "value"] = np.nan
+    return data
+
+
+def assert_as_pandas(stats, data):
+    expected = data.groupby("channel")["value"].agg(
+        ["count", "mean", "std", "min", "max"]
+    )
+    assert (stats.count.to_numpy() == expected["count"].to_numpy()).all()
+    for column in ["mean", "std", "min", "max"]:
+        np.testing.assert_allclose(
+            getattr(stats, column).to_numpy(dtype=float),
+            expected[column].to_numpy(),
+            rtol=1e-10,
+        )
+
+
+def test_from_values():
+    data = make_events()
+    stats = ChannelStats.from_values(data["channel"], data["value"], data["datetime"])
+    assert_as_pandas(stats, data)
+    assert stats.end == data["datetime"].max()
+
+
+def test_update_in_chunks(tmp_path):
+    data = make_events()
+    stats = ChannelStats()
+    for rows in np.array_split(np.arange(len(data)), 4):
+        chunk = data.iloc[rows]
+        stats.update(chunk["channel"], chunk["value"], chunk["datetime"])
+        # saved and loaded between chunks, as between runs
+        stats.save(tmp_path / "stats.json")
+        stats = ChannelStats.load(tmp_path / "stats.json")
+    assert_as_pandas(stats, data)
+
+
+def test_update_skips_included_events(caplog):
+    data = make_events()
+    half = len(data) // 2
+    stats = ChannelStats.from_values(
+        data["channel"][:half], data["value"][:half], data["datetime"][:half]
+    )
+    # overlapping with the events already included
+    stats.update(data["channel"][10:], data["value"][10:], data["datetime"][10:])
+    assert_as_pandas(stats, data)
+    assert "left out of channel statistics" in caplog.text
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from legend_data_monitor.event_time import to_ns
+from legend_data_monitor.subsystem import match_timestamps
+
+
+def test_match_timestamps():
+    reference = pd.Series(
+        pd.to_datetime(["2023-01-01 00:00:10", "2023-01-01 00:00:02"], utc=True)
+    )
+    # in microseconds
+    offsets = [1999500, 2000000, 2000600, 5000000, 9999400, 10000500, 11000000]
+    times = pd.Series(
+        pd.Timestamp("2023-01-01", tz="UTC") + pd.to_timedelta(offsets, unit="us")
+    )
+
+    # reference times do not need to be sorted, times match within tolerance (included)
+    match = match_timestamps(times, reference, pd.Timedelta("0.5ms"))
+    assert match.tolist() == [True, True, False, False, False, True, False]
+    match = match_timestamps(times, reference, pd.Timedelta("1ms"))
+    assert match.tolist() == [True, True, True, False, True, True, False]
+
+    # same result with int64 nanoseconds
+    match_ns = match_timestamps(to_ns(times), to_ns(reference), pd.Timedelta("1ms"))
+    assert (match_ns == match).all()
+
+
+def test_match_timestamps_as_brute_force():
+    rng = np.random.default_rng(4)
+    times = rng.integers(0, 10**12, 2000)
+    reference = rng.integers(0, 10**12, 300)
+    tolerance = pd.Timedelta("1s")
+
+    distance = np.abs(times[:, None] - reference[None, :]).min(axis=1)
+    expected = distance <= tolerance.value
+    assert (match_timestamps(times, reference, tolerance) == expected).all()
+    assert expected.any() and not expected.all()
+
+
+def test_match_timestamps_no_reference():
+    times = pd.Series(pd.to_datetime(["2023-01-01"], utc=True))
+    assert not match_timestamps(times, [], pd.Timedelta("1ms")).any()
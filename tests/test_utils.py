@@ -0,0 +1,28 @@
+import subprocess
+import sys
+
+from legend_data_monitor import plot_styles, plotting, utils
+
+
+def test_plot_names():
+    # utils keeps only the names, so that configs can be checked without importing matplotlib
+    assert utils.PLOT_STRUCTURES == list(plotting.PLOT_STRUCTURE)
+    assert utils.PLOT_STYLES == list(plot_styles.PLOT_STYLE)
+    assert set(utils.SIPM_STRUCTURES) <= set(utils.PLOT_STRUCTURES)
+
+
+def test_check_plot_settings_imports():
+    # run in a new interpreter: other tests may have imported pandas already
+    code = "\n".join(
+        [
+            "import sys",
+            "from legend_data_monitor import utils",
+            "conf = {'subsystems': {'geds': {'max': {",
+            "    'plot_structure': 'per string', 'plot_style': 'vs time',",
+            "    'parameters': ['wf_max_rel'], 'time_window': '10T'}}}}",
+            "assert utils.check_plot_settings(conf)",
+            "assert 'pandas' not in sys.modules",
+            "assert 'matplotlib' not in sys.modules",
+        ]
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)